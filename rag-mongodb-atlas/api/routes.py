@@ -2,7 +2,9 @@
 Rutas y endpoints de la API
 """
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
 from typing import List
+import time
 import logging
 
 from models.schemas import (
@@ -10,16 +12,48 @@ from models.schemas import (
     SearchResponse,
     SearchResult,
     RAGRequest,
-    RAGResponse
+    RAGResponse,
+    RAGBatchRequest,
+    RAGBatchItem,
+    RAGBatchResponse,
+    ConversationRequest,
+    ConversationResponse
 )
 from services.search_service import search_service
 from services.rag_service import rag_service
-from services.query_service import QueryService
+from services.query_service import query_service
+from services.llm_service import llm_service, LLMRateLimitError
+from services.answer_cache import answer_cache
+from services.session_store import session_store
+from services.relevance_gate import relevance_gate
+from services.answer_store import answer_store
+from services.usage_tracker import usage_tracker
+from services.schema_cache import schema_cache
+from services.plan_cache import plan_cache
+from services.query_guard import query_guard
+from services.index_advisor import index_advisor
+from services.plan_rewriter import plan_rewriter
+from config.settings import settings
+from utils.profiling import RequestProfiler, profile_stage
+from utils.serialization import dumps, dumps_line, to_jsonable
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["API"])
-query_service = QueryService()
+
+# Parámetros de RAGRequest que cambian la respuesta (clave del AnswerStore)
+RAG_ANSWER_PARAMS = {"context_limit", "temperature", "max_tokens"}
+
+
+def _rate_limit_exception(error: LLMRateLimitError) -> HTTPException:
+    """Traduce un límite de tasa de Groq a 429 con Retry-After"""
+    logger.warning(f"Groq rate limit: {error}")
+    headers = {"Retry-After": str(int(error.retry_after or 1))}
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Límite de tasa del LLM alcanzado, reintenta más tarde",
+        headers=headers
+    )
 
 
 @router.post("/search", response_model=SearchResponse)
@@ -32,31 +66,36 @@ async def search_documents(request: SearchRequest):
     try:
         logger.info(f"Search request: {request.query} ({request.search_type})")
 
+        profiler = RequestProfiler() if request.profile else None
+
         # Realizar búsqueda
         results = await search_service.search(
             query=request.query,
             search_type=request.search_type,
             collection_name=request.collection,
-            limit=request.limit
+            limit=request.limit,
+            profiler=profiler
         )
 
         # Formatear resultados
-        search_results = [
-            SearchResult(
-                id=str(doc.get("_id", "")),
-                score=doc.get("score", 0.0),
-                title=doc.get("title"),
-                content=doc.get("content"),
-                metadata=doc.get("metadata", {})
-            )
-            for doc in results
-        ]
+        with profile_stage(profiler, "serialization"):
+            search_results = [
+                SearchResult(
+                    id=str(doc.get("_id", "")),
+                    score=doc.get("score", 0.0),
+                    title=doc.get("title"),
+                    content=doc.get("content"),
+                    metadata=to_jsonable(doc.get("metadata", {}))
+                )
+                for doc in results
+            ]
 
         response = SearchResponse(
             results=search_results,
             total=len(search_results),
             query=request.query,
-            search_type=request.search_type
+            search_type=request.search_type,
+            profile=profiler.to_dict() if profiler else None
         )
 
         return response
@@ -69,6 +108,63 @@ async def search_documents(request: SearchRequest):
         )
 
 
+@router.post("/search/stream")
+async def search_documents_stream(request: SearchRequest):
+    """
+    Variante en streaming de /search (NDJSON)
+
+    Emite una línea JSON por resultado a medida que el cursor los produce,
+    seguida de una línea final de resumen con el total y los tiempos. El
+    cliente puede pintar los primeros resultados sin esperar al resto.
+    """
+    logger.info(f"Search stream request: {request.query} ({request.search_type})")
+
+    async def generate_lines():
+        start = time.perf_counter()
+        first_result_ms = None
+        total = 0
+
+        try:
+            async for doc in search_service.search_stream(
+                query=request.query,
+                search_type=request.search_type,
+                collection_name=request.collection,
+                limit=request.limit
+            ):
+                if first_result_ms is None:
+                    first_result_ms = (time.perf_counter() - start) * 1000
+
+                total += 1
+                line = {
+                    "type": "result",
+                    "id": str(doc.get("_id", "")),
+                    "score": doc.get("score", 0.0),
+                    "title": doc.get("title"),
+                    "content": doc.get("content"),
+                    "metadata": doc.get("metadata", {})
+                }
+                yield dumps_line(line)
+
+        except Exception as e:
+            # Los encabezados ya se enviaron: el error viaja como una línea más
+            logger.error(f"Error in search stream endpoint: {e}")
+            yield dumps_line({"type": "error", "detail": f"Error en búsqueda: {str(e)}"})
+
+        summary = {
+            "type": "summary",
+            "total": total,
+            "query": request.query,
+            "search_type": request.search_type.value,
+            "timings": {
+                "first_result_ms": round(first_result_ms, 2) if first_result_ms is not None else None,
+                "total_ms": round((time.perf_counter() - start) * 1000, 2)
+            }
+        }
+        yield dumps_line(summary)
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
+
 @router.post("/rag", response_model=RAGResponse)
 async def rag_query(request: RAGRequest):
     """
@@ -79,35 +175,55 @@ async def rag_query(request: RAGRequest):
     try:
         logger.info(f"RAG request: {request.question}")
 
-        # Generar respuesta RAG
-        result = await rag_service.generate_answer(
-            question=request.question,
-            context_limit=request.context_limit,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens
+        profiler = RequestProfiler() if request.profile else None
+        answer_store.record_question("rag", request.question)
+
+        # Respuesta precalculada (FAQ) o pipeline RAG completo
+        result = None if profiler else answer_store.lookup(
+            "rag", request.question, request.model_dump(include=RAG_ANSWER_PARAMS)
         )
+        with usage_tracker.scope("rag", settings.DOCUMENTS_COLLECTION) as request_usage:
+            if result is not None:
+                result = {**result, "cached": True}
+            else:
+                result = await rag_service.generate_answer(
+                    question=request.question,
+                    context_limit=request.context_limit,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    profiler=profiler
+                )
 
         # Formatear contexto
-        context_results = [
-            SearchResult(
-                id=ctx.get("id", ""),
-                score=ctx.get("score", 0.0),
-                title=ctx.get("title"),
-                content=ctx.get("content"),
-                metadata=ctx.get("metadata", {})
-            )
-            for ctx in result.get("context", [])
-        ]
+        with profile_stage(profiler, "serialization"):
+            context_results = [
+                SearchResult(
+                    id=ctx.get("id", ""),
+                    score=ctx.get("score", 0.0),
+                    title=ctx.get("title"),
+                    content=ctx.get("content"),
+                    metadata=ctx.get("metadata", {})
+                )
+                for ctx in result.get("context", [])
+            ]
 
         response = RAGResponse(
             answer=result["answer"],
             question=result["question"],
             context=context_results,
-            model=result["model"]
+            model=result["model"],
+            cached=result.get("cached", False),
+            gated=result.get("gated", False),
+            relevance=result.get("relevance"),
+            context_stats=result.get("context_stats"),
+            usage=request_usage.summary() if request.include_usage else None,
+            profile=profiler.to_dict() if profiler else None
         )
 
         return response
 
+    except LLMRateLimitError as e:
+        raise _rate_limit_exception(e)
     except Exception as e:
         logger.error(f"Error in RAG endpoint: {e}")
         raise HTTPException(
@@ -116,6 +232,181 @@ async def rag_query(request: RAGRequest):
         )
 
 
+@router.post("/rag/batch", response_model=RAGBatchResponse)
+async def rag_batch_query(request: RAGBatchRequest):
+    """
+    Endpoint para múltiples consultas RAG en una sola petición
+
+    Las preguntas se procesan de forma concurrente; un fallo en una de ellas
+    se informa en su propio resultado sin afectar al resto.
+    """
+    if len(request.questions) > settings.RAG_BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Máximo {settings.RAG_BATCH_MAX_QUESTIONS} preguntas por batch"
+        )
+
+    try:
+        logger.info(f"RAG batch request: {len(request.questions)} preguntas")
+
+        with usage_tracker.scope("rag_batch", settings.DOCUMENTS_COLLECTION):
+            results = await rag_service.multi_query_rag(
+                questions=request.questions,
+                context_limit=request.context_limit,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                concurrency=request.concurrency
+            )
+
+        items = [
+            RAGBatchItem(
+                question=result["question"],
+                answer=result.get("answer"),
+                context=[
+                    SearchResult(
+                        id=ctx.get("id", ""),
+                        score=ctx.get("score", 0.0),
+                        title=ctx.get("title"),
+                        content=ctx.get("content"),
+                        metadata=ctx.get("metadata", {})
+                    )
+                    for ctx in result.get("context", [])
+                ],
+                model=result.get("model"),
+                cached=result.get("cached", False),
+                gated=result.get("gated", False),
+                error=result.get("error")
+            )
+            for result in results
+        ]
+
+        return RAGBatchResponse(
+            results=items,
+            total=len(items),
+            failed=sum(1 for item in items if item.error)
+        )
+
+    except Exception as e:
+        logger.error(f"Error in RAG batch endpoint: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error en RAG batch: {str(e)}"
+        )
+
+
+@router.post("/rag/stream")
+async def rag_query_stream(request: RAGRequest):
+    """
+    Variante en streaming de /rag (Server-Sent Events)
+
+    Envía primero el contexto recuperado (evento `context`), luego los
+    tokens a medida que Groq los genera (eventos `token`) y por último un
+    evento `done` con el tiempo hasta el primer token.
+    """
+    logger.info(f"RAG stream request: {request.question}")
+    answer_store.record_question("rag", request.question)
+    stored = answer_store.lookup("rag", request.question, request.model_dump(include=RAG_ANSWER_PARAMS))
+
+    async def stored_events():
+        """Respuesta precalculada con la misma secuencia de eventos"""
+        yield {"event": "context", "data": {"question": stored["question"], "context": stored["context"]}}
+        yield {"event": "token", "data": {"text": stored["answer"]}}
+        yield {
+            "event": "done",
+            "data": {"model": stored["model"], "cached": True, "first_token_ms": 0.0, "total_ms": 0.0}
+        }
+
+    async def generate_events():
+        try:
+            events = stored_events() if stored is not None else rag_service.generate_answer_stream(
+                question=request.question,
+                context_limit=request.context_limit,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens
+            )
+            with usage_tracker.scope("rag_stream", settings.DOCUMENTS_COLLECTION) as request_usage:
+                async for event in events:
+                    if event["event"] == "done" and request.include_usage:
+                        event["data"]["usage"] = request_usage.summary()
+                    data = dumps(event["data"])
+                    yield f"event: {event['event']}\ndata: {data}\n\n"
+
+        except Exception as e:
+            logger.error(f"Error in RAG stream endpoint: {e}")
+            data = dumps({"detail": f"Error en RAG: {str(e)}"})
+            yield f"event: error\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        generate_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/rag/conversation", response_model=ConversationResponse)
+async def rag_conversation(request: ConversationRequest):
+    """
+    RAG conversacional con sesión en el servidor
+
+    El cliente solo envía la pregunta y el session_id devuelto en el turno
+    anterior; el historial (últimos turnos + resumen acumulado) se mantiene
+    en el servidor.
+    """
+    try:
+        logger.info(f"RAG conversation request: {request.question}")
+
+        with usage_tracker.scope("rag_conversation", settings.DOCUMENTS_COLLECTION):
+            result = await rag_service.conversational_rag(
+                question=request.question,
+                session_id=request.session_id,
+                context_limit=request.context_limit,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens
+            )
+
+        return ConversationResponse(
+            session_id=result["session_id"],
+            answer=result["answer"],
+            question=result["original_question"],
+            reformulated_query=result["reformulated_query"],
+            context=[
+                SearchResult(
+                    id=ctx.get("id", ""),
+                    score=ctx.get("score", 0.0),
+                    title=ctx.get("title"),
+                    content=ctx.get("content"),
+                    metadata=ctx.get("metadata", {})
+                )
+                for ctx in result.get("context", [])
+            ],
+            model=result["model"],
+            turns=result["turns"],
+            history_chars=result.get("history_chars", 0)
+        )
+
+    except LLMRateLimitError as e:
+        raise _rate_limit_exception(e)
+    except Exception as e:
+        logger.error(f"Error in RAG conversation endpoint: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error en conversación: {str(e)}"
+        )
+
+
+@router.delete("/rag/conversation/{session_id}")
+async def delete_conversation(session_id: str):
+    """
+    Elimina una sesión de conversación
+    """
+    if not await session_store.delete(session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Sesión '{session_id}' no encontrada"
+        )
+    return {"session_id": session_id, "deleted": True}
+
+
 @router.get("/collections")
 async def list_collections():
     """
@@ -156,14 +447,11 @@ async def collection_stats(collection_name: str):
         # Obtener un documento de ejemplo
         sample = await collection.find_one({})
 
-        # Convertir ObjectId a string
-        if sample and '_id' in sample:
-            sample['_id'] = str(sample['_id'])
-
         return {
             "collection": collection_name,
             "document_count": count,
-            "sample_document": sample
+            # ObjectId, fechas y Decimal128 anidados (ventas.items[].producto_id...)
+            "sample_document": to_jsonable(sample)
         }
 
     except Exception as e:
@@ -178,38 +466,13 @@ async def collection_stats(collection_name: str):
 async def get_database_schema():
     """
     Obtiene la estructura dinámica de la base de datos conectada
+
+    Sale de la caché de esquema ($sample por colección, refrescada en
+    segundo plano): rutas anidadas, unión de tipos y frecuencia de cada
+    campo. `count` es la estimación por metadatos de la colección.
     """
     try:
-        from config.database import mongodb
-        from config.settings import settings
-
-        db = mongodb.db
-
-        # Obtener todas las colecciones
-        collections_info = []
-
-        for coll_name in await db.list_collection_names():
-            collection = mongodb.get_collection(coll_name)
-            count = await collection.count_documents({})
-
-            # Obtener un documento de muestra para ver campos
-            sample = await collection.find_one({})
-            fields = []
-
-            if sample:
-                for key, value in sample.items():
-                    if key != '_id':
-                        field_type = type(value).__name__
-                        fields.append({
-                            "name": key,
-                            "type": field_type
-                        })
-
-            collections_info.append({
-                "name": coll_name,
-                "count": count,
-                "fields": fields[:10]  # Limitar a 10 campos
-            })
+        collections_info = await schema_cache.collections_info()
 
         return {
             "database": settings.MONGODB_DB_NAME,
@@ -241,15 +504,176 @@ async def natural_language_query(request: dict):
             )
 
         logger.info(f"Natural language query: {question}")
+        answer_store.record_question("query", question)
 
-        # Procesar consulta
-        result = await query_service.natural_language_query(question)
+        # Respuesta precalculada (FAQ) o traducción y ejecución de la consulta
+        result = answer_store.lookup("query", question)
+        if result is not None:
+            return {**result, "cached": True}
+
+        # La colección la fija query_service cuando conoce el plan
+        with usage_tracker.scope("query"):
+            result = await query_service.natural_language_query(question)
 
         return result
 
+    except HTTPException:
+        raise
+    except LLMRateLimitError as e:
+        raise _rate_limit_exception(e)
     except Exception as e:
         logger.error(f"Error in natural language query: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error en consulta: {str(e)}"
         )
+
+
+@router.post("/query/stream")
+async def natural_language_query_stream(request: dict):
+    """
+    Variante en streaming de /query (NDJSON)
+
+    Emite el plan (`plan`), una línea por documento a medida que el cursor
+    los lee (`result`), la respuesta en lenguaje natural generada con los
+    primeros QUERY_SUMMARY_ROWS documentos (`answer`) y una línea final de
+    resumen con el total y los tiempos.
+    """
+    question = request.get("question")
+    if not question:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="La pregunta es requerida"
+        )
+
+    logger.info(f"Natural language query stream: {question}")
+    answer_store.record_question("query", question)
+
+    async def generate_lines():
+        start = time.perf_counter()
+        first_result_ms = None
+        total = 0
+
+        try:
+            with usage_tracker.scope("query_stream"):
+                async for event in query_service.stream_query(question):
+                    if event["type"] == "result":
+                        if first_result_ms is None:
+                            first_result_ms = (time.perf_counter() - start) * 1000
+                        total += 1
+                    yield dumps_line(event)
+
+        except LLMRateLimitError as e:
+            logger.warning(f"Groq rate limit: {e}")
+            yield dumps_line({"type": "error", "detail": "Límite de tasa del LLM alcanzado, reintenta más tarde"})
+        except Exception as e:
+            # Los encabezados ya se enviaron: el error viaja como una línea más
+            logger.error(f"Error in natural language query stream: {e}")
+            yield dumps_line({"type": "error", "detail": f"Error en consulta: {str(e)}"})
+
+        summary = {
+            "type": "summary",
+            "total": total,
+            "timings": {
+                "first_result_ms": round(first_result_ms, 2) if first_result_ms is not None else None,
+                "total_ms": round((time.perf_counter() - start) * 1000, 2)
+            }
+        }
+        yield dumps_line(summary)
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
+
+@router.get("/indexes/recommendations")
+async def index_recommendations(min_count: int = None, collection: str = None):
+    """
+    Índices compuestos recomendados para las consultas de /query
+
+    Agrupa las formas registradas (igualdad, orden, rango y $group por
+    colección), propone claves ESR que no cubra ya un índice existente y
+    estima con explain los documentos examinados que se ahorrarían.
+    """
+    try:
+        recommendations = await index_advisor.recommend(min_count=min_count, collection=collection)
+        return {
+            "recommendations": recommendations,
+            "total": len(recommendations)
+        }
+
+    except Exception as e:
+        logger.error(f"Error getting index recommendations: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error obteniendo recomendaciones: {str(e)}"
+        )
+
+
+@router.post("/indexes/apply")
+async def apply_index_recommendation(request: dict):
+    """
+    Crea uno de los índices recomendados (`collection` y `name` de
+    /indexes/recommendations). Requiere INDEX_ADVISOR_API_APPLY.
+    """
+    if not settings.INDEX_ADVISOR_API_APPLY:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="La creación de índices desde la API está desactivada (INDEX_ADVISOR_API_APPLY)"
+        )
+
+    collection, name = request.get("collection"), request.get("name")
+    if not collection or not name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="collection y name son requeridos"
+        )
+
+    try:
+        # Solo se crean índices que el asesor recomienda en este momento
+        recommendations = await index_advisor.recommend(min_count=1, collection=collection, explain=False)
+        recommendation = next((item for item in recommendations if item["name"] == name), None)
+        if recommendation is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"No hay ninguna recomendación {name} para {collection}"
+            )
+
+        created = await index_advisor.apply(recommendation)
+        return {"collection": collection, "index": created, "keys": recommendation["keys"]}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error applying index recommendation: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error creando índice: {str(e)}"
+        )
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Métricas de proceso: cliente LLM (peticiones, reintentos, tiempo de
+    espera por limitación, hedging, latencia), tokens y coste por endpoint,
+    modelo y colección, caché de respuestas, plantillas de planes de /query,
+    planes rechazados por coste, filtros de fecha reescritos a rangos, formas
+    de consulta registradas, llamadas al LLM evitadas por la compuerta
+    de relevancia, respuestas precalculadas servidas y peticiones idénticas
+    agrupadas (single-flight)
+    """
+    return {
+        "llm": llm_service.stats(),
+        "answer_cache": answer_cache.stats(),
+        "relevance_gate": relevance_gate.stats(),
+        "answer_store": answer_store.stats(),
+        "usage": usage_tracker.stats(),
+        "schema_cache": schema_cache.stats(),
+        "plan_cache": plan_cache.stats(),
+        "query_guard": query_guard.stats(),
+        "index_advisor": index_advisor.stats(),
+        "plan_rewriter": plan_rewriter.stats(),
+        "singleflight": {
+            "rag": rag_service.singleflight.stats(),
+            "query": query_service.singleflight.stats()
+        }
+    }
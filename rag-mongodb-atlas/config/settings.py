@@ -16,6 +16,38 @@ class Settings(BaseSettings):
     # Groq API Configuration
     GROQ_API_KEY: str = Field(..., description="Groq API key")
     GROQ_MODEL: str = Field(default="llama-3.3-70b-versatile", description="Groq model to use")
+    GROQ_FAST_MODEL: str = Field(default="llama-3.1-8b-instant", description="Small fast model for routed tasks")
+    GROQ_TIMEOUT: float = Field(default=60.0, description="Groq request timeout in seconds")
+    GROQ_MAX_CONNECTIONS: int = Field(default=20, description="Max concurrent connections to Groq (async pool)")
+    GROQ_MAX_KEEPALIVE_CONNECTIONS: int = Field(default=10, description="Idle keep-alive connections kept in the pool")
+    GROQ_KEEPALIVE_EXPIRY: float = Field(default=30.0, description="Seconds an idle keep-alive connection is kept")
+
+    # Model Routing Configuration
+    MODEL_ROUTING_ENABLED: bool = Field(default=True, description="Route simple tasks to GROQ_FAST_MODEL")
+    ROUTING_FAST_TASKS: str = Field(default="format,summary,rewrite", description="Tasks always sent to the fast model")
+    ROUTING_CONFIDENCE_TASKS: str = Field(default="rag", description="Tasks sent to the fast model when short and confident")
+    ROUTING_FAST_MAX_PROMPT_TOKENS: int = Field(default=1500, description="Max prompt tokens for confidence-routed tasks")
+    ROUTING_FAST_MIN_CONFIDENCE: float = Field(default=0.85, description="Min top vector score for confidence-routed tasks")
+
+    # LLM Provider Configuration
+    LLM_PROVIDER: str = Field(default="groq", description="LLM backend: groq | openai (any OpenAI-compatible server)")
+    LLM_BASE_URL: str = Field(default="", description="Base URL for the LLM backend (required for openai)")
+    LLM_API_KEY: str = Field(default="", description="Bearer token for the openai provider (optional)")
+
+    # Groq Rate Limiting Configuration
+    GROQ_RPM_LIMIT: int = Field(default=0, description="Client-side Groq requests per minute (0 = unlimited)")
+    GROQ_TPM_LIMIT: int = Field(default=0, description="Client-side Groq tokens per minute (0 = unlimited)")
+    GROQ_MAX_RETRIES: int = Field(default=4, description="Retries for 429/5xx/connection errors")
+    GROQ_BACKOFF_BASE: float = Field(default=0.5, description="Base seconds for exponential backoff")
+    GROQ_BACKOFF_MAX: float = Field(default=20.0, description="Max seconds between retries")
+    GROQ_HEDGE_ENABLED: bool = Field(default=False, description="Send a duplicate request after the p95 latency")
+    GROQ_HEDGE_MIN_SAMPLES: int = Field(default=20, description="Latency samples required before hedging")
+
+    # LLM Usage Accounting Configuration
+    LLM_PRICING: str = Field(
+        default='{"llama-3.3-70b-versatile": [0.59, 0.79], "llama-3.1-8b-instant": [0.05, 0.08]}',
+        description="USD per million input/output tokens per model, as JSON"
+    )
 
     # Application Configuration
     ENVIRONMENT: str = Field(default="development", description="Environment")
@@ -32,9 +64,103 @@ class Settings(BaseSettings):
     MAX_SEARCH_RESULTS: int = Field(default=10, description="Maximum search results")
     SIMILARITY_THRESHOLD: float = Field(default=0.7, description="Similarity threshold")
 
+    # Relevance Gate Configuration
+    RELEVANCE_GATE_ENABLED: bool = Field(default=True, description="Skip the LLM when retrieval scores are below threshold")
+    RELEVANCE_GATE_MODE: str = Field(default="extractive", description="Below threshold: extractive | refuse")
+    RELEVANCE_GATE_SNIPPETS: int = Field(default=2, description="Documents quoted in extractive fallback answers")
+    RELEVANCE_THRESHOLDS: str = Field(default="{}", description='Per-collection thresholds as JSON, e.g. {"documents": 0.78}')
+    RELEVANCE_THRESHOLDS_FILE: str = Field(default="data/relevance_thresholds.json", description="Calibrated thresholds file")
+
+    # Exact Search Configuration (matrices np.memmap)
+    EXACT_SEARCH_DIR: str = Field(default="data/vectors", description="Directory for exported embedding matrices")
+    EXACT_SEARCH_BLOCK_SIZE: int = Field(default=8192, description="Rows per block in exact top-k search")
+
+    # Context Packing Configuration
+    CONTEXT_TOKEN_BUDGET: int = Field(default=3000, description="Max context tokens in RAG prompts (0 = unlimited)")
+    CONTEXT_COMPRESSION_ENABLED: bool = Field(default=True, description="Keep only question-relevant sentences in RAG context")
+    CONTEXT_COMPRESSION_RATIO: float = Field(default=0.5, description="Fraction of context tokens kept by compression")
+    CONTEXT_COMPRESSION_NEIGHBORS: int = Field(default=1, description="Neighbour sentences kept around each selected one")
+    CONTEXT_COMPRESSION_MIN_TOKENS: int = Field(default=400, description="Skip compression for shorter contexts")
+
+    # RAG Batch Configuration
+    RAG_BATCH_CONCURRENCY: int = Field(default=8, description="Max concurrent LLM calls in multi-question RAG")
+    RAG_BATCH_RETRIEVAL_CONCURRENCY: int = Field(default=16, description="Max concurrent retrievals in multi-question RAG")
+    RAG_BATCH_MAX_QUESTIONS: int = Field(default=500, description="Max questions per /rag/batch request")
+
+    # Answer Cache Configuration
+    ANSWER_CACHE_ENABLED: bool = Field(default=True, description="Cache RAG answers")
+    ANSWER_CACHE_TTL_SECONDS: float = Field(default=3600, description="Answer cache entry lifetime")
+    ANSWER_CACHE_MAX_ENTRIES: int = Field(default=1000, description="Max cached answers (LRU eviction)")
+    ANSWER_CACHE_MAX_TEMPERATURE: float = Field(default=0.7, description="Only cache answers at or below this temperature")
+    ANSWER_CACHE_WATCH_CHANGES: bool = Field(default=True, description="Invalidate cached answers via change streams")
+    SINGLEFLIGHT_ENABLED: bool = Field(default=True, description="Coalesce identical in-flight /rag and /query requests")
+
+    # Natural Language Query Configuration
+    QUERY_MAX_RESULTS: int = Field(default=100, description="Max documents returned by /query ($limit is always injected)")
+    QUERY_STREAM_MAX_RESULTS: int = Field(default=10000, description="Max documents streamed by /query/stream")
+    QUERY_BATCH_SIZE: int = Field(default=100, description="Cursor batch size for /query execution")
+    QUERY_SUMMARY_ROWS: int = Field(default=20, description="Documents included in the answer-formatting prompt")
+
+    # Query Guard Configuration
+    QUERY_GUARD_ENABLED: bool = Field(default=True, description="Check /query plans with explain before running them")
+    QUERY_COLLSCAN_MAX_DOCS: int = Field(default=10000, description="Reject plans that scan whole collections larger than this")
+    QUERY_MAX_PIPELINE_STAGES: int = Field(default=10, description="Max aggregation stages (including $lookup/$facet sub-pipelines)")
+    QUERY_MAX_LOOKUPS: int = Field(default=2, description="Max $lookup stages per pipeline")
+    QUERY_MAX_TIME_MS: int = Field(default=5000, description="maxTimeMS for every /query execution")
+    QUERY_ALLOW_DISK_USE: bool = Field(default=False, description="Let /query sorts and groups spill to disk")
+    QUERY_GUARD_MAX_REWRITES: int = Field(default=2, description="Times a rejected plan is sent back to the LLM")
+
+    # Index Advisor Configuration
+    INDEX_ADVISOR_RECORD_SHAPES: bool = Field(default=True, description="Record filter/sort/group shapes of /query plans")
+    INDEX_ADVISOR_FLUSH_SECONDS: float = Field(default=60.0, description="How often query shape counts are written to MongoDB")
+    INDEX_ADVISOR_MIN_COUNT: int = Field(default=3, description="Times a shape must be seen before recommending an index")
+    INDEX_ADVISOR_API_APPLY: bool = Field(default=False, description="Allow POST /api/indexes/apply to create indexes")
+    INDEX_ADVISOR_AUTO_APPLY: bool = Field(default=False, description="Create recommended indexes in the background")
+    INDEX_ADVISOR_MIN_DOCS_SAVED: int = Field(default=10000, description="Estimated documents saved required to auto-apply an index")
+    INDEX_ADVISOR_MAX_INDEXES: int = Field(default=5, description="Max advisor-created indexes per collection")
+
+    # Query Plan Cache Configuration
+    PLAN_CACHE_ENABLED: bool = Field(default=True, description="Reuse /query plans as templates for questions differing only in values")
+    PLAN_CACHE_TTL_SECONDS: float = Field(default=3600, description="Plan template lifetime")
+    PLAN_CACHE_MAX_ENTRIES: int = Field(default=500, description="Max cached plan templates (LRU eviction)")
+
+    # Schema Cache Configuration
+    SCHEMA_SAMPLE_SIZE: int = Field(default=100, description="Documents sampled ($sample) per collection to infer the schema")
+    SCHEMA_CACHE_REFRESH_SECONDS: float = Field(default=600.0, description="Full schema refresh interval")
+    SCHEMA_CACHE_WATCH_CHANGES: bool = Field(default=True, description="Refresh changed collections via change streams")
+    SCHEMA_CACHE_CHANGE_DELAY_SECONDS: float = Field(default=5.0, description="Wait after a change before resampling")
+    SCHEMA_PROMPT_MAX_FIELDS: int = Field(default=40, description="Max fields per collection in the /query prompt")
+
+    # Precomputed Answers (FAQ) Configuration
+    ANSWER_STORE_ENABLED: bool = Field(default=True, description="Serve precomputed FAQ answers from the answer store")
+    ANSWER_STORE_AUTO_REFRESH: bool = Field(default=True, description="Recompute stored answers when their collections change")
+    ANSWER_STORE_REFRESH_DELAY_SECONDS: float = Field(default=30.0, description="Wait before recomputing (groups bulk changes)")
+    ANSWER_STORE_POLL_SECONDS: float = Field(default=300.0, description="Polling interval when change streams are unavailable")
+    ANSWER_STORE_LEASE_SECONDS: float = Field(default=600.0, description="Lease that lets a single worker recompute a collection")
+    FAQ_QUESTIONS_FILE: str = Field(default="data/faq_questions.json", description="Questions precomputed by scripts/precompute_faq.py")
+    FAQ_CONCURRENCY: int = Field(default=4, description="Questions precomputed in parallel")
+    QUERY_LOG_ENABLED: bool = Field(default=True, description="Count incoming questions to mine frequent ones")
+    QUERY_LOG_FLUSH_SECONDS: float = Field(default=60.0, description="How often question counts are written to MongoDB")
+
+    # Conversation Session Configuration
+    SESSION_BACKEND: str = Field(default="memory", description="Conversation session store: memory | mongo")
+    SESSION_TTL_SECONDS: float = Field(default=86400, description="Idle conversation session lifetime")
+    SESSION_WINDOW_TURNS: int = Field(default=4, description="Recent turns kept verbatim per session")
+    SESSION_SUMMARY_MAX_TOKENS: int = Field(default=256, description="Max tokens of the rolling conversation summary")
+    SESSION_TURN_MAX_CHARS: int = Field(default=1000, description="Answer characters per turn included in prompts")
+    CONVERSATION_HISTORY_WEIGHT: float = Field(default=0.5, description="Retrieval weight of the previous turn's embedding")
+    CONVERSATION_HISTORY_DECAY: float = Field(default=0.5, description="Weight decay per older turn")
+    CONVERSATION_LLM_REWRITE: bool = Field(default=False, description="Speculative LLM query rewrite in parallel with retrieval")
+    CONVERSATION_REWRITE_BUDGET_MS: float = Field(default=300, description="Max wait for the speculative rewrite")
+
     # Collection Names
     DOCUMENTS_COLLECTION: str = Field(default="documents", description="Documents collection")
     IMAGES_COLLECTION: str = Field(default="images", description="Images collection")
+    SESSIONS_COLLECTION: str = Field(default="conversation_sessions", description="Conversation sessions collection")
+    ANSWER_STORE_COLLECTION: str = Field(default="precomputed_answers", description="Precomputed FAQ answers collection")
+    QUERY_LOG_COLLECTION: str = Field(default="query_log", description="Question frequency log collection")
+    ANSWER_STORE_LEASES_COLLECTION: str = Field(default="precompute_leases", description="Recompute leases shared by workers")
+    QUERY_SHAPES_COLLECTION: str = Field(default="query_shapes", description="Query shape counts for the index advisor")
 
     class Config:
         env_file = ".env"
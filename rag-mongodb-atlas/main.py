@@ -7,9 +7,17 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from contextlib import asynccontextmanager
 from pathlib import Path
+import asyncio
 
 from config.settings import settings
 from config.database import mongodb
+from services.llm_service import llm_service
+from services.answer_cache import answer_cache
+from services.session_store import session_store
+from services.answer_store import answer_store
+from services.faq_precompute import faq_precomputer
+from services.schema_cache import schema_cache
+from services.index_advisor import index_advisor
 from api.routes import router as api_router
 
 
@@ -42,12 +50,47 @@ async def lifespan(app: FastAPI):
         print("="*70 + "\n")
         raise
 
+    # Invalidación de la caché de respuestas cuando cambian los documentos
+    background_tasks = []
+    if settings.ANSWER_CACHE_ENABLED and settings.ANSWER_CACHE_WATCH_CHANGES:
+        background_tasks.append(asyncio.create_task(
+            answer_cache.watch_invalidations(collection)
+        ))
+
+    # Esquema inferido para /api/query y /api/database/schema
+    background_tasks.append(asyncio.create_task(schema_cache.run()))
+
+    # Respuestas precalculadas en memoria y recálculo cuando cambian los datos
+    if settings.ANSWER_STORE_ENABLED:
+        try:
+            await answer_store.load()
+        except Exception as e:
+            print(f"⚠️  No se pudieron cargar las respuestas precalculadas: {e}")
+        # Respuestas que escriben el job offline u otro worker
+        background_tasks.append(asyncio.create_task(answer_store.watch_store()))
+        if settings.ANSWER_STORE_AUTO_REFRESH:
+            background_tasks.append(asyncio.create_task(faq_precomputer.watch()))
+
+    if settings.QUERY_LOG_ENABLED:
+        background_tasks.append(asyncio.create_task(answer_store.run_query_log_flusher()))
+
+    # Formas de consulta de /api/query para el asesor de índices
+    if settings.INDEX_ADVISOR_RECORD_SHAPES:
+        background_tasks.append(asyncio.create_task(index_advisor.run()))
+
     yield
 
     # Shutdown
+    for task in background_tasks:
+        task.cancel()
+    # El query log y las formas de consulta se vuelcan al cancelar su tarea: se espera antes de cerrar MongoDB
+    await asyncio.gather(*background_tasks, return_exceptions=True)
     print("\n" + "="*70)
     print("🛑 Deteniendo servidor...")
+    # Terminar los resúmenes de conversación en curso antes de cerrar MongoDB
+    await session_store.wait_idle()
     await mongodb.disconnect()
+    await llm_service.close()
     print("✅ Desconectado de MongoDB")
     print("="*70 + "\n")
 
@@ -141,6 +141,52 @@ class IndexDefinitions:
         }
     ]
 
+    SESSIONS_INDEXES = [
+        {
+            # MongoDB elimina las sesiones cuando vence expires_at
+            "name": "expires_at_ttl_index",
+            "keys": [("expires_at", 1)],
+            "options": {"expireAfterSeconds": 0}
+        }
+    ]
+
+    ANSWER_STORE_INDEXES = [
+        {
+            # Invalidación de respuestas cuando cambia una colección
+            "name": "collections_index",
+            "keys": [("collections", 1)],
+            "options": {}
+        }
+    ]
+
+    QUERY_LOG_INDEXES = [
+        {
+            # Preguntas más frecuentes para scripts/precompute_faq.py
+            "name": "count_index",
+            "keys": [("count", -1)],
+            "options": {}
+        }
+    ]
+
+    # Colecciones de negocio consultadas por /api/query
+    VENTAS_INDEXES = [
+        {
+            # Filtros y agregaciones por periodo: rango sobre fecha
+            "name": "fecha_index",
+            "keys": [("fecha", 1)],
+            "options": {}
+        }
+    ]
+
+    QUERY_SHAPES_INDEXES = [
+        {
+            # Formas más frecuentes para el asesor de índices
+            "name": "shape_count_index",
+            "keys": [("collection", 1), ("count", -1)],
+            "options": {}
+        }
+    ]
+
     # Definición de índices vectoriales (Atlas Search)
     VECTOR_SEARCH_INDEX = {
         "name": "vector_index",
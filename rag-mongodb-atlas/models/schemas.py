@@ -12,6 +12,7 @@ class SearchType(str, Enum):
     VECTOR = "vector"
     HYBRID = "hybrid"
     FULLTEXT = "fulltext"
+    EXACT = "exact"
 
 
 class DocumentBase(BaseModel):
@@ -69,6 +70,7 @@ class SearchRequest(BaseModel):
     search_type: SearchType = Field(default=SearchType.VECTOR, description="Tipo de búsqueda")
     limit: int = Field(default=10, ge=1, le=100, description="Número máximo de resultados")
     collection: Optional[str] = Field(default="documents", description="Colección a buscar")
+    profile: bool = Field(default=False, description="Incluir tiempos por etapa y explain de MongoDB")
 
 
 class SearchResult(BaseModel):
@@ -86,6 +88,7 @@ class SearchResponse(BaseModel):
     total: int = Field(..., description="Total de resultados")
     query: str = Field(..., description="Query original")
     search_type: SearchType = Field(..., description="Tipo de búsqueda usado")
+    profile: Optional[Dict[str, Any]] = Field(default=None, description="Perfil de la petición (si profile=true)")
 
 
 class RAGRequest(BaseModel):
@@ -94,6 +97,8 @@ class RAGRequest(BaseModel):
     context_limit: int = Field(default=5, ge=1, le=20, description="Número de contextos a recuperar")
     temperature: float = Field(default=0.7, ge=0.0, le=2.0, description="Temperatura del modelo")
     max_tokens: int = Field(default=1024, ge=1, le=4096, description="Tokens máximos de respuesta")
+    profile: bool = Field(default=False, description="Incluir tiempos por etapa, explain y latencia del LLM")
+    include_usage: bool = Field(default=False, description="Incluir tokens, tiempos y coste de las llamadas al LLM")
 
 
 class RAGResponse(BaseModel):
@@ -102,6 +107,60 @@ class RAGResponse(BaseModel):
     question: str = Field(..., description="Pregunta original")
     context: List[SearchResult] = Field(..., description="Contextos utilizados")
     model: str = Field(..., description="Modelo usado")
+    cached: bool = Field(default=False, description="La respuesta salió de la caché de respuestas")
+    gated: bool = Field(default=False, description="Respondida sin LLM por baja relevancia del contexto")
+    relevance: Optional[Dict[str, Any]] = Field(default=None, description="Scores de la recuperación frente al umbral")
+    context_stats: Optional[Dict[str, Any]] = Field(default=None, description="Tokens de contexto empaquetados y descartados")
+    usage: Optional[Dict[str, Any]] = Field(default=None, description="Consumo del LLM en la petición (si include_usage=true)")
+    profile: Optional[Dict[str, Any]] = Field(default=None, description="Perfil de la petición (si profile=true)")
+
+
+class RAGBatchRequest(BaseModel):
+    """Modelo para solicitudes RAG de múltiples preguntas"""
+    questions: List[str] = Field(..., min_length=1, description="Preguntas a responder")
+    context_limit: int = Field(default=5, ge=1, le=20, description="Número de contextos por pregunta")
+    temperature: float = Field(default=0.7, ge=0.0, le=2.0, description="Temperatura del modelo")
+    max_tokens: int = Field(default=1024, ge=1, le=4096, description="Tokens máximos por respuesta")
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64, description="Llamadas simultáneas al LLM")
+
+
+class RAGBatchItem(BaseModel):
+    """Resultado de una pregunta dentro de un batch RAG"""
+    question: str = Field(..., description="Pregunta original")
+    answer: Optional[str] = Field(None, description="Respuesta generada")
+    context: List[SearchResult] = Field(default_factory=list, description="Contextos utilizados")
+    model: Optional[str] = Field(None, description="Modelo usado")
+    cached: bool = Field(default=False, description="La respuesta salió de la caché de respuestas")
+    gated: bool = Field(default=False, description="Respondida sin LLM por baja relevancia del contexto")
+    error: Optional[str] = Field(None, description="Error si la pregunta falló")
+
+
+class RAGBatchResponse(BaseModel):
+    """Modelo para respuesta RAG de múltiples preguntas"""
+    results: List[RAGBatchItem] = Field(..., description="Resultados en el orden de las preguntas")
+    total: int = Field(..., description="Total de preguntas")
+    failed: int = Field(..., description="Preguntas que fallaron")
+
+
+class ConversationRequest(BaseModel):
+    """Modelo para una pregunta dentro de una conversación"""
+    question: str = Field(..., description="Pregunta del usuario", min_length=1)
+    session_id: Optional[str] = Field(None, description="Id de la sesión (se crea una nueva si se omite)")
+    context_limit: int = Field(default=5, ge=1, le=20, description="Número de contextos a recuperar")
+    temperature: float = Field(default=0.7, ge=0.0, le=2.0, description="Temperatura del modelo")
+    max_tokens: int = Field(default=1024, ge=1, le=4096, description="Tokens máximos de respuesta")
+
+
+class ConversationResponse(BaseModel):
+    """Modelo para respuesta de una conversación"""
+    session_id: str = Field(..., description="Id de la sesión a reutilizar en el siguiente turno")
+    answer: str = Field(..., description="Respuesta generada")
+    question: str = Field(..., description="Pregunta original")
+    reformulated_query: str = Field(..., description="Pregunta reformulada con el historial")
+    context: List[SearchResult] = Field(..., description="Contextos utilizados")
+    model: str = Field(..., description="Modelo usado")
+    turns: int = Field(..., description="Turnos de la sesión")
+    history_chars: int = Field(default=0, description="Tamaño del historial incluido en el prompt")
 
 
 class HealthResponse(BaseModel):
@@ -0,0 +1,125 @@
+"""
+Benchmark de serialización de resultados de consultas
+
+Genera documentos como los de la colección ventas (ObjectId, fechas e items
+anidados) y compara, sobre el mismo resultado:
+
+- legacy: conversión de _id y fechas de primer nivel documento a documento
+  y json.dumps(indent=2) con default=str (lo que hacía QueryService)
+- json_util: bson.json_util.dumps en modo relaxed
+- serializer: utils.serialization (to_jsonable para la respuesta + dumps
+  para el prompt), con orjson si está instalado
+
+Uso:
+    python scripts/benchmark_serialization.py
+    python scripts/benchmark_serialization.py --documents 10000 --repeat 7
+"""
+import sys
+import json
+import random
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bson import ObjectId, json_util
+from bson.json_util import RELAXED_JSON_OPTIONS
+
+from utils import serialization
+from utils.serialization import dumps, to_jsonable
+
+
+def make_documents(count: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Documentos de ventas sintéticos con tipos BSON anidados"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    products = [ObjectId() for _ in range(50)]
+
+    return [
+        {
+            "_id": ObjectId(),
+            "cliente_id": ObjectId(),
+            "fecha": start + timedelta(minutes=rng.randint(0, 525600)),
+            "estado": rng.choice(["pagada", "pendiente", "cancelada"]),
+            "total": round(rng.uniform(10, 2000), 2),
+            "items": [
+                {
+                    "producto_id": rng.choice(products),
+                    "cantidad": rng.randint(1, 5),
+                    "precio": round(rng.uniform(5, 500), 2),
+                    "entregado": start + timedelta(days=rng.randint(0, 400))
+                }
+                for _ in range(rng.randint(1, 4))
+            ]
+        }
+        for _ in range(count)
+    ]
+
+
+def legacy(documents: List[Dict[str, Any]]) -> str:
+    """Conversión anterior: solo _id y fechas de primer nivel"""
+    for doc in documents:
+        if "_id" in doc:
+            doc["_id"] = str(doc["_id"])
+        for key, value in list(doc.items()):
+            if isinstance(value, datetime):
+                doc[key] = value.isoformat()
+    # Sin default=str fallaría con los ObjectId y fechas de items
+    return json.dumps(documents, indent=2, ensure_ascii=False, default=str)
+
+
+def with_json_util(documents: List[Dict[str, Any]]) -> str:
+    return json_util.dumps(documents, json_options=RELAXED_JSON_OPTIONS)
+
+
+def with_serializer(documents: List[Dict[str, Any]]) -> str:
+    return dumps(to_jsonable(documents))
+
+
+def measure(fn: Callable[[List[Dict[str, Any]]], str], documents: List[Dict[str, Any]], repeat: int) -> Dict[str, float]:
+    """Mediana y mínimo en ms (cada repetición con una copia fresca)"""
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        batch = [dict(doc) for doc in documents]
+        start = time.perf_counter()
+        output = fn(batch)
+        timings.append((time.perf_counter() - start) * 1000)
+        size = len(output.encode("utf-8"))
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "bytes": size}
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Benchmark de serialización BSON a JSON")
+    parser.add_argument("--documents", type=int, default=10000, help="Documentos por resultado")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por variante")
+    args = parser.parse_args()
+
+    documents = make_documents(args.documents)
+    backend = "orjson" if serialization.orjson is not None else "json"
+    variants = [
+        ("legacy", legacy),
+        ("json_util", with_json_util),
+        (f"serializer ({backend})", with_serializer)
+    ]
+
+    print(f"{args.documents} documentos, {args.repeat} repeticiones\n")
+    print(f"{'variante':<22} {'mediana ms':>11} {'mín ms':>9} {'KB':>8}")
+    results = {}
+    for name, fn in variants:
+        results[name] = measure(fn, documents, args.repeat)
+        row = results[name]
+        print(f"{name:<22} {row['median_ms']:>11.1f} {row['min_ms']:>9.1f} {row['bytes'] / 1024:>8.0f}")
+
+    baseline = results["legacy"]["median_ms"]
+    current = results[variants[-1][0]]["median_ms"]
+    print(f"\nserializer vs legacy: {baseline / current:.1f}x más rápido")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Script para calibrar el umbral de la compuerta de relevancia por colección
+
+Lee un JSONL de preguntas etiquetadas, busca cada una con Vector Search y
+elige el umbral de score que mejor separa las que tienen respuesta en la
+colección de las que no. El resultado se guarda en RELEVANCE_THRESHOLDS_FILE,
+que RelevanceGate recarga sin reiniciar la API.
+
+Formato del archivo de entrada (una pregunta por línea):
+    {"question": "¿Qué es un índice vectorial?", "answerable": true}
+    {"question": "¿Quién ganó el mundial de 1986?", "answerable": false, "collection": "documents"}
+
+Uso:
+    python scripts/calibrate_relevance.py data/relevance_questions.jsonl
+"""
+import sys
+import json
+import asyncio
+import argparse
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.database import mongodb
+from config.settings import settings
+from services.search_service import search_service
+from services.relevance_gate import calibrate_threshold
+from models.schemas import SearchType
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_questions(path: Path) -> List[Dict]:
+    """Carga las preguntas etiquetadas del JSONL"""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                questions.append(json.loads(line))
+    return questions
+
+
+async def top_scores(questions: List[Dict], limit: int) -> Dict[str, Dict[str, List[float]]]:
+    """
+    Top score vectorial de cada pregunta, agrupado por colección y etiqueta
+
+    Args:
+        questions: Preguntas etiquetadas
+        limit: Documentos recuperados por pregunta
+
+    Returns:
+        {coleccion: {"positive": [...], "negative": [...]}}
+    """
+    scores: Dict[str, Dict[str, List[float]]] = {}
+
+    for item in questions:
+        collection_name = item.get("collection") or settings.DOCUMENTS_COLLECTION
+        results = await search_service.search(
+            query=item["question"],
+            search_type=SearchType.VECTOR,
+            collection_name=collection_name,
+            limit=limit
+        )
+        top = max((doc.get("score", 0) for doc in results), default=0.0)
+        group = "positive" if item.get("answerable") else "negative"
+        scores.setdefault(collection_name, {"positive": [], "negative": []})[group].append(top)
+
+    return scores
+
+
+async def calibrate(input_path: Path, output_path: Path, limit: int):
+    """Calibra y guarda los umbrales"""
+    try:
+        await mongodb.connect()
+
+        questions = load_questions(input_path)
+        logger.info(f"Calibrando con {len(questions)} preguntas etiquetadas")
+
+        scores = await top_scores(questions, limit)
+
+        thresholds = {}
+        for collection_name, groups in scores.items():
+            if not groups["positive"] or not groups["negative"]:
+                logger.warning(f"⚠️  {collection_name}: faltan preguntas con o sin respuesta, se omite")
+                continue
+
+            threshold = calibrate_threshold(groups["positive"], groups["negative"])
+            thresholds[collection_name] = round(threshold, 4)
+            logger.info(
+                f"✅ {collection_name}: umbral {threshold:.4f} "
+                f"({len(groups['positive'])} con respuesta, {len(groups['negative'])} sin respuesta)"
+            )
+
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "thresholds": thresholds,
+                "model": settings.EMBEDDING_MODEL,
+                "questions": len(questions),
+                "calibrated_at": datetime.utcnow().isoformat()
+            }, f, indent=2, ensure_ascii=False)
+
+        logger.info(f"Umbrales guardados en {output_path}")
+
+    finally:
+        await mongodb.disconnect()
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Calibra los umbrales de la compuerta de relevancia")
+    parser.add_argument("questions", type=Path, help="JSONL con question, answerable y collection (opcional)")
+    parser.add_argument("--output", type=Path, default=Path(settings.RELEVANCE_THRESHOLDS_FILE))
+    parser.add_argument("--limit", type=int, default=5, help="Documentos recuperados por pregunta")
+    args = parser.parse_args()
+
+    asyncio.run(calibrate(args.questions, args.output, args.limit))
+
+
+if __name__ == "__main__":
+    main()
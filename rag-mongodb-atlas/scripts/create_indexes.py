@@ -53,6 +53,40 @@ def create_text_indexes():
             except Exception as e:
                 logger.warning(f"⚠️  Índice {index_def['name']} ya existe o error: {e}")
 
+        # Índices para sesiones de conversación
+        logger.info(f"Creando índices para {settings.SESSIONS_COLLECTION}")
+        sessions_collection = db[settings.SESSIONS_COLLECTION]
+
+        for index_def in IndexDefinitions.SESSIONS_INDEXES:
+            try:
+                sessions_collection.create_index(
+                    index_def["keys"],
+                    name=index_def["name"],
+                    **index_def["options"]
+                )
+                logger.info(f"✅ Índice creado: {index_def['name']}")
+            except Exception as e:
+                logger.warning(f"⚠️  Índice {index_def['name']} ya existe o error: {e}")
+
+        # Índices para respuestas precalculadas, query log, formas de consulta y ventas
+        for collection_name, index_defs in [
+            (settings.ANSWER_STORE_COLLECTION, IndexDefinitions.ANSWER_STORE_INDEXES),
+            (settings.QUERY_LOG_COLLECTION, IndexDefinitions.QUERY_LOG_INDEXES),
+            (settings.QUERY_SHAPES_COLLECTION, IndexDefinitions.QUERY_SHAPES_INDEXES),
+            ("ventas", IndexDefinitions.VENTAS_INDEXES)
+        ]:
+            logger.info(f"Creando índices para {collection_name}")
+            for index_def in index_defs:
+                try:
+                    db[collection_name].create_index(
+                        index_def["keys"],
+                        name=index_def["name"],
+                        **index_def["options"]
+                    )
+                    logger.info(f"✅ Índice creado: {index_def['name']}")
+                except Exception as e:
+                    logger.warning(f"⚠️  Índice {index_def['name']} ya existe o error: {e}")
+
         logger.info("✅ Índices de texto creados")
 
     except Exception as e:
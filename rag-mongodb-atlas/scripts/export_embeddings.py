@@ -0,0 +1,100 @@
+"""
+Script para exportar embeddings a matrices np.memmap (búsqueda exacta)
+
+Uso:
+    python scripts/export_embeddings.py                    # exporta documents
+    python scripts/export_embeddings.py -c documents images
+    python scripts/export_embeddings.py --watch            # re-exporta al cambiar la colección
+"""
+import sys
+import time
+import argparse
+import logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.database import mongodb
+from config.settings import settings
+from services.exact_search_service import exact_search_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def export_collections(collection_names):
+    """Exporta y publica la matriz de cada colección"""
+    for coll_name in collection_names:
+        logger.info(f"Exportando embeddings de: {coll_name}")
+        manifest = exact_search_service.export_collection(
+            mongodb.sync_db[coll_name],
+            coll_name
+        )
+        logger.info(f"  Versión: {manifest['version']} | Vectores: {manifest['rows']}")
+
+
+def watch_collections(collection_names, debounce_seconds: float):
+    """
+    Re-exporta cuando cambia alguna colección (requiere change streams)
+
+    Los cambios se agrupan durante `debounce_seconds` para no re-exportar
+    en cada escritura de una carga masiva.
+    """
+    pipeline = [{"$match": {"ns.coll": {"$in": list(collection_names)}}}]
+
+    with mongodb.sync_db.watch(pipeline) as stream:
+        # Exportación inicial con el stream ya abierto: no se pierden cambios
+        export_collections(collection_names)
+        logger.info(f"👀 Observando cambios en: {', '.join(collection_names)}")
+        pending = set()
+        last_change = 0.0
+
+        while stream.alive:
+            change = stream.try_next()
+
+            if change is not None:
+                pending.add(change["ns"]["coll"])
+                last_change = time.monotonic()
+                continue
+
+            if pending and time.monotonic() - last_change >= debounce_seconds:
+                export_collections(sorted(pending))
+                pending.clear()
+
+            time.sleep(0.5)
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Exporta embeddings para búsqueda exacta")
+    parser.add_argument(
+        "-c", "--collections",
+        nargs="+",
+        default=[settings.DOCUMENTS_COLLECTION],
+        help="Colecciones a exportar"
+    )
+    parser.add_argument("--watch", action="store_true", help="Re-exportar al detectar cambios")
+    parser.add_argument("--debounce", type=float, default=5.0, help="Segundos de espera entre cambios")
+    args = parser.parse_args()
+
+    logger.info("=== Exportando embeddings ===")
+    logger.info(f"Directorio: {settings.EXACT_SEARCH_DIR}")
+
+    try:
+        mongodb.connect_sync()
+
+        if args.watch:
+            watch_collections(args.collections, args.debounce)
+        else:
+            export_collections(args.collections)
+
+    except KeyboardInterrupt:
+        logger.info("Detenido por el usuario")
+    finally:
+        mongodb.disconnect_sync()
+
+    logger.info("\n✅ Proceso completado")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Script del asesor de índices
+
+Lista los índices compuestos recomendados para las formas de consulta más
+frecuentes de /api/query (con el beneficio estimado por explain) y, con
+--apply, los crea.
+
+Uso:
+    python scripts/index_advisor.py
+    python scripts/index_advisor.py --collection ventas --min-count 5
+    python scripts/index_advisor.py --apply --min-docs-saved 50000
+"""
+import sys
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.database import mongodb
+from config.settings import settings
+from services.index_advisor import index_advisor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def advise(args: argparse.Namespace):
+    """Muestra las recomendaciones y aplica las seleccionadas"""
+    try:
+        await mongodb.connect()
+
+        recommendations = await index_advisor.recommend(
+            min_count=args.min_count,
+            collection=args.collection,
+            explain=not args.no_explain
+        )
+        if not recommendations:
+            logger.info("✅ No hay índices que recomendar")
+            return
+
+        for item in recommendations:
+            keys = ", ".join(f"{field}: {direction}" for field, direction in item["keys"])
+            stats = item.get("explain", {})
+            logger.info(
+                f"📇 {item['collection']} {{{keys}}} — {item['queries']} consultas, "
+                f"examinados {stats.get('docs_examined', '?')} / devueltos {stats.get('n_returned', '?')}, "
+                f"ahorro estimado {item.get('estimated_docs_saved', '?')} documentos"
+            )
+
+        if not args.apply:
+            logger.info("ℹ️  Usa --apply para crear los índices recomendados")
+            return
+
+        for item in recommendations:
+            if item.get("estimated_docs_saved", 0) < args.min_docs_saved:
+                continue
+            created = await index_advisor.apply(item)
+            logger.info(f"✅ Índice creado: {item['collection']}.{created}")
+
+    finally:
+        await mongodb.disconnect()
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Recomienda índices para las consultas de /api/query")
+    parser.add_argument("--min-count", type=int, default=settings.INDEX_ADVISOR_MIN_COUNT, help="Veces mínimas que se ha visto la forma")
+    parser.add_argument("--collection", default=None, help="Limitar a una colección")
+    parser.add_argument("--no-explain", action="store_true", help="No estimar el beneficio con explain")
+    parser.add_argument("--apply", action="store_true", help="Crear los índices recomendados")
+    parser.add_argument("--min-docs-saved", type=int, default=0, help="Ahorro estimado mínimo para crear un índice")
+    args = parser.parse_args()
+
+    asyncio.run(advise(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Servidor local compatible con OpenAI/Groq para pruebas de carga sin red
+
+Responde /v1/chat/completions (y /openai/v1/chat/completions, la ruta que usa
+el SDK de Groq) con texto determinista derivado del prompt, simulando
+latencia hasta el primer token, velocidad de generación, streaming SSE,
+límites de tasa y errores.
+
+Uso:
+    python scripts/llm_stub_server.py --port 9000 --latency-ms 300 --tokens-per-second 250
+    python scripts/llm_stub_server.py --latency-dist lognormal --error-rate 0.02 --rate-limit-rpm 600
+
+Y en .env de la API:
+    LLM_PROVIDER=openai
+    LLM_BASE_URL=http://localhost:9000/v1
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+from pathlib import Path
+from collections import deque
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from utils.tokens import count_tokens
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VOCABULARY = [
+    "MongoDB", "Atlas", "documento", "índice", "vector", "consulta", "contexto",
+    "respuesta", "datos", "colección", "búsqueda", "modelo", "resultado", "según",
+    "el", "la", "los", "de", "en", "con", "para", "que", "se", "y", "una", "es"
+]
+
+
+class StubConfig:
+    """Parámetros de simulación del servidor"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.latency_ms = args.latency_ms
+        self.latency_dist = args.latency_dist
+        self.latency_jitter = args.latency_jitter
+        self.tokens_per_second = args.tokens_per_second
+        self.completion_tokens = args.completion_tokens
+        self.error_rate = args.error_rate
+        self.rate_limit_rpm = args.rate_limit_rpm
+        self.random = random.Random(args.seed)
+
+
+def sample_latency(config: StubConfig) -> float:
+    """
+    Latencia hasta el primer token en segundos
+
+    fixed: siempre latency_ms; uniform: ±jitter; exponential: media latency_ms;
+    lognormal: mediana latency_ms con sigma = jitter (cola larga, como un
+    servicio real bajo carga)
+    """
+    mean = config.latency_ms / 1000.0
+    rng = config.random
+
+    if config.latency_dist == "uniform":
+        return max(0.0, rng.uniform(mean * (1 - config.latency_jitter), mean * (1 + config.latency_jitter)))
+    if config.latency_dist == "exponential":
+        return rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+    if config.latency_dist == "lognormal":
+        return rng.lognormvariate(0.0, config.latency_jitter) * mean
+    return mean
+
+
+def generate_words(messages: List[Dict[str, str]], count: int) -> List[str]:
+    """Texto determinista: el mismo prompt produce siempre la misma respuesta"""
+    prompt = "\n".join(message.get("content", "") for message in messages)
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16], 16)
+    rng = random.Random(seed)
+    return [rng.choice(VOCABULARY) for _ in range(count)]
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    """Construye la app FastAPI del stub"""
+    app = FastAPI(title="LLM stub server")
+    recent_requests: deque = deque()
+    stats = {"requests": 0, "completed": 0, "errors_injected": 0, "rate_limited": 0}
+
+    def check_failures():
+        """Devuelve una respuesta de error si toca inyectarla"""
+        now = time.monotonic()
+
+        if config.rate_limit_rpm:
+            while recent_requests and now - recent_requests[0] > 60:
+                recent_requests.popleft()
+            if len(recent_requests) >= config.rate_limit_rpm:
+                stats["rate_limited"] += 1
+                retry_after = 60 - (now - recent_requests[0])
+                return JSONResponse(
+                    status_code=429,
+                    headers={"retry-after": f"{retry_after:.2f}"},
+                    content={"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}}
+                )
+            recent_requests.append(now)
+
+        if config.error_rate and config.random.random() < config.error_rate:
+            stats["errors_injected"] += 1
+            return JSONResponse(
+                status_code=503,
+                content={"error": {"message": "Injected failure", "type": "service_unavailable"}}
+            )
+
+        return None
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+
+        failure = check_failures()
+        if failure is not None:
+            return failure
+
+        messages = body.get("messages", [])
+        model = body.get("model", "stub-model")
+        max_tokens = body.get("max_tokens") or config.completion_tokens
+        words = generate_words(messages, min(max_tokens, config.completion_tokens))
+
+        prompt_tokens = sum(count_tokens(message.get("content", "")) for message in messages)
+        created = int(time.time())
+        completion_id = f"chatcmpl-stub-{stats['requests']}"
+        token_interval = 1.0 / config.tokens_per_second if config.tokens_per_second else 0.0
+        latency = sample_latency(config)
+
+        # Mismos campos que el usage de Groq (la latencia simulada cuenta como cola)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+            "queue_time": latency,
+            "prompt_time": 0.0,
+            "completion_time": token_interval * len(words),
+            "total_time": latency + token_interval * len(words)
+        }
+
+        await asyncio.sleep(latency)
+
+        if body.get("stream"):
+            async def events():
+                for i, word in enumerate(words):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"content": word if i == 0 else f" {word}"},
+                            "finish_reason": None
+                        }]
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(token_interval)
+
+                final = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "x_groq": {"usage": usage}
+                }
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+                stats["completed"] += 1
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(token_interval * len(words))
+        stats["completed"] += 1
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+
+    app.add_api_route("/v1/chat/completions", chat_completions, methods=["POST"])
+    app.add_api_route("/openai/v1/chat/completions", chat_completions, methods=["POST"])
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Servidor LLM simulado compatible con OpenAI/Groq")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Latencia hasta el primer token")
+    parser.add_argument(
+        "--latency-dist",
+        choices=["fixed", "uniform", "exponential", "lognormal"],
+        default="fixed",
+        help="Distribución de la latencia"
+    )
+    parser.add_argument("--latency-jitter", type=float, default=0.5, help="Dispersión (uniform: ±fracción, lognormal: sigma)")
+    parser.add_argument("--tokens-per-second", type=float, default=250.0, help="Velocidad de generación (0 = instantánea)")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Tokens por respuesta (acotado por max_tokens)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que responden 503")
+    parser.add_argument("--rate-limit-rpm", type=int, default=0, help="Peticiones por minuto antes de responder 429 (0 = sin límite)")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla de latencias y errores")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    logger.info(
+        f"=== LLM stub en http://{args.host}:{args.port}/v1 "
+        f"({args.latency_dist} {args.latency_ms}ms, {args.tokens_per_second} tok/s) ==="
+    )
+    uvicorn.run(create_app(StubConfig(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,34 @@
 """
 Script para cargar datos de negocio a MongoDB
+
+Las fechas de los JSON ("2024-01-15") se guardan como fechas BSON, para que
+los filtros por periodo de /api/query sean rangos sobre un índice.
 """
 import json
 import asyncio
 from pathlib import Path
 from datetime import datetime
+from typing import Any, Dict, List
 from config.database import mongodb
 from config.settings import settings
+from models.collections import IndexDefinitions
+
+# Campos de fecha de cada colección de negocio
+DATE_FIELDS = {
+    "clientes": ["fecha_registro"],
+    "productos": ["fecha_lanzamiento"],
+    "ventas": ["fecha"]
+}
+
+
+def convert_dates(documents: List[Dict[str, Any]], fields: List[str]):
+    """Convierte a datetime los campos de fecha en formato ISO"""
+    for document in documents:
+        for field in fields:
+            value = document.get(field)
+            if isinstance(value, str) and value:
+                document[field] = datetime.fromisoformat(value)
+
 
 async def load_business_data():
     """Cargar datos de negocio (clientes, productos, ventas)"""
@@ -28,7 +50,8 @@ async def load_business_data():
         # Limpiar colección existente
         db['clientes'].delete_many({})
 
-        # Agregar timestamps
+        # Fechas como BSON y timestamps
+        convert_dates(clientes, DATE_FIELDS["clientes"])
         for cliente in clientes:
             cliente['created_at'] = datetime.utcnow()
             cliente['updated_at'] = datetime.utcnow()
@@ -49,7 +72,8 @@ async def load_business_data():
         # Limpiar colección existente
         db['productos'].delete_many({})
 
-        # Agregar timestamps
+        # Fechas como BSON y timestamps
+        convert_dates(productos, DATE_FIELDS["productos"])
         for producto in productos:
             producto['created_at'] = datetime.utcnow()
             producto['updated_at'] = datetime.utcnow()
@@ -70,7 +94,8 @@ async def load_business_data():
         # Limpiar colección existente
         db['ventas'].delete_many({})
 
-        # Agregar timestamps
+        # Fechas como BSON y timestamps
+        convert_dates(ventas, DATE_FIELDS["ventas"])
         for venta in ventas:
             venta['created_at'] = datetime.utcnow()
             venta['updated_at'] = datetime.utcnow()
@@ -78,6 +103,10 @@ async def load_business_data():
         # Insertar datos
         result = db['ventas'].insert_many(ventas)
         print(f"✅ {len(result.inserted_ids)} ventas cargadas")
+
+        for index_def in IndexDefinitions.VENTAS_INDEXES:
+            db['ventas'].create_index(index_def["keys"], name=index_def["name"], **index_def["options"])
+        print("✅ Índice sobre ventas.fecha creado")
     else:
         print(f"❌ Archivo no encontrado: {ventas_path}")
 
@@ -0,0 +1,82 @@
+"""
+Script para precalcular respuestas a preguntas frecuentes
+
+Responde por adelantado las preguntas de FAQ_QUESTIONS_FILE y/o las más
+frecuentes del query log, y guarda los resultados en el AnswerStore. La API
+las sirve desde memoria y las recalcula sola cuando cambian las colecciones
+de las que dependen (ANSWER_STORE_AUTO_REFRESH).
+
+Uso:
+    python scripts/precompute_faq.py
+    python scripts/precompute_faq.py --from-log 50 --min-count 3 --concurrency 8
+    python scripts/precompute_faq.py --questions otra_lista.json --no-file
+"""
+import sys
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.database import mongodb
+from config.settings import settings
+from services.answer_store import answer_store
+from services.faq_precompute import faq_precomputer, load_questions_file
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def precompute(args: argparse.Namespace):
+    """Reúne las preguntas y las precalcula"""
+    try:
+        await mongodb.connect()
+        await answer_store.load()
+
+        items = []
+        if not args.no_file:
+            items.extend(load_questions_file(args.questions))
+            logger.info(f"📄 {len(items)} preguntas de {args.questions}")
+
+        if args.from_log:
+            mined = await answer_store.frequent_questions(args.from_log, args.min_count)
+            items.extend({"endpoint": endpoint, "question": question} for endpoint, question in mined)
+            logger.info(f"📈 {len(mined)} preguntas frecuentes del query log")
+
+        # La misma pregunta puede venir del archivo y del log
+        unique = {
+            answer_store.make_key(item["endpoint"], item["question"]): item
+            for item in items
+        }
+        items = list(unique.values())
+
+        if not items:
+            logger.warning("⚠️  No hay preguntas que precalcular")
+            return
+
+        summary = await faq_precomputer.precompute(items, concurrency=args.concurrency)
+        logger.info(
+            f"✅ {summary['computed']} respuestas guardadas, {summary['failed']} fallidas "
+            f"en {summary['elapsed_seconds']} s"
+        )
+
+    finally:
+        await mongodb.disconnect()
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Precalcula respuestas a preguntas frecuentes")
+    parser.add_argument("--questions", default=settings.FAQ_QUESTIONS_FILE, help='JSON {"rag": [...], "query": [...]}')
+    parser.add_argument("--no-file", action="store_true", help="No usar el archivo de preguntas")
+    parser.add_argument("--from-log", type=int, default=0, help="Añadir las N preguntas más frecuentes del query log")
+    parser.add_argument("--min-count", type=int, default=2, help="Veces mínimas en el query log")
+    parser.add_argument("--concurrency", type=int, default=settings.FAQ_CONCURRENCY, help="Preguntas en paralelo")
+    args = parser.parse_args()
+
+    asyncio.run(precompute(args))
+
+
+if __name__ == "__main__":
+    main()
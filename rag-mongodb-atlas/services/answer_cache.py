@@ -0,0 +1,193 @@
+"""
+Caché de respuestas RAG
+
+La clave combina la pregunta normalizada, los _id recuperados (en orden) con
+su versión (updated_at), el modelo y los parámetros de generación. Si cambia
+cualquiera de ellos la clave es otra, así que una respuesta nunca se sirve con
+un contexto distinto al que la produjo. Además, un change stream invalida las
+entradas que citan documentos modificados o eliminados.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """Caché LRU con TTL de respuestas generadas por el LLM"""
+
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None):
+        """
+        Args:
+            max_entries: Número máximo de respuestas guardadas
+            ttl_seconds: Vida de cada entrada en segundos
+        """
+        self.max_entries = max_entries or settings.ANSWER_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or settings.ANSWER_CACHE_TTL_SECONDS
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_document: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Normaliza mayúsculas, espacios y signos de interrogación/exclamación"""
+        normalized = re.sub(r"\s+", " ", question.strip().lower())
+        return normalized.strip("¿?¡!. ")
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """Solo se cachean respuestas de temperatura baja o moderada"""
+        return settings.ANSWER_CACHE_ENABLED and temperature <= settings.ANSWER_CACHE_MAX_TEMPERATURE
+
+    def make_key(
+        self,
+        question: str,
+        context_docs: List[Dict[str, Any]],
+        model: str,
+        params: Dict[str, Any]
+    ) -> str:
+        """
+        Construye la clave de caché
+
+        Args:
+            question: Pregunta del usuario
+            context_docs: Documentos recuperados, en orden
+            model: Modelo del LLM
+            params: Parámetros de generación (temperature, max_tokens...)
+
+        Returns:
+            Hash SHA-256 de la clave
+        """
+        payload = {
+            "question": self.normalize_question(question),
+            "documents": [
+                [str(doc.get("_id", "")), str(doc.get("updated_at", ""))]
+                for doc in context_docs
+            ],
+            "model": model,
+            "params": params
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Retorna el valor cacheado o None si no existe o expiró"""
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry["expires_at"] < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry["value"]
+
+    def set(self, key: str, value: Any, document_ids: List[str]):
+        """
+        Guarda un valor asociado a los documentos que cita
+
+        Args:
+            key: Clave de caché
+            value: Valor a guardar
+            document_ids: _id de los documentos del contexto
+        """
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = {
+            "value": value,
+            "expires_at": time.monotonic() + self.ttl_seconds,
+            "document_ids": [str(doc_id) for doc_id in document_ids]
+        }
+        for doc_id in self._entries[key]["document_ids"]:
+            self._by_document.setdefault(doc_id, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate_document(self, document_id: Any) -> int:
+        """
+        Elimina todas las respuestas que citan un documento
+
+        Returns:
+            Número de entradas invalidadas
+        """
+        keys = self._by_document.pop(str(document_id), set())
+        for key in keys:
+            self._remove(key)
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        """Vacía la caché"""
+        self._entries.clear()
+        self._by_document.clear()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for doc_id in entry["document_ids"]:
+            keys = self._by_document.get(doc_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._by_document[doc_id]
+
+    def stats(self) -> Dict[str, Any]:
+        """Estadísticas de uso de la caché"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+    async def watch_invalidations(self, collection):
+        """
+        Invalida entradas cuando cambian documentos de la colección
+
+        Requiere change streams (replica set / Atlas). Pensado para correr
+        como tarea de fondo durante la vida de la aplicación.
+
+        Args:
+            collection: Colección asíncrona (Motor) a observar
+        """
+        pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+
+        try:
+            async with collection.watch(pipeline) as stream:
+                logger.info(f"👀 Caché de respuestas observando: {collection.name}")
+                async for change in stream:
+                    removed = self.invalidate_document(change["documentKey"]["_id"])
+                    if removed:
+                        logger.info(f"Caché de respuestas: {removed} entradas invalidadas")
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Invalidación por change stream desactivada: {e}")
+
+
+# Singleton instance
+answer_cache = AnswerCache()
@@ -0,0 +1,408 @@
+"""
+Almacén persistente de respuestas precalculadas (FAQ)
+
+scripts/precompute_faq.py responde por adelantado las preguntas frecuentes
+y guarda aquí el resultado completo de /api/rag o /api/query. La API lo
+carga en memoria al arrancar y sigue los cambios de la colección (change
+stream o sondeo), así que lo que escribe el job offline llega a la API en
+marcha y una pregunta frecuente se responde sin búsqueda ni LLM. Cada
+entrada recuerda de qué colecciones depende: cuando una cambia, sus entradas
+dejan de servirse al momento (se marcan como obsoletas) y un solo proceso,
+el que obtiene la concesión en MongoDB, las vuelve a calcular.
+
+También lleva un registro de preguntas (query log) del que el job puede
+extraer las más frecuentes.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from config.database import mongodb
+from config.settings import settings
+from services.answer_cache import AnswerCache
+from utils.serialization import dumps
+from utils.singleflight import request_key
+
+logger = logging.getLogger(__name__)
+
+
+def query_collections(query_plan: Dict[str, Any]) -> List[str]:
+    """Colecciones que lee un plan de /api/query (incluye las de $lookup)"""
+    collections = [query_plan["collection"]] if query_plan.get("collection") else []
+    pipeline = query_plan.get("query")
+    if query_plan.get("operation") == "aggregate" and isinstance(pipeline, list):
+        for stage in pipeline:
+            lookup = stage.get("$lookup") if isinstance(stage, dict) else None
+            if lookup and lookup.get("from"):
+                collections.append(lookup["from"])
+    return collections
+
+
+def _stored_response(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Respuesta tal como se guarda: el plan de /api/query va como JSON (lleva claves $)"""
+    if isinstance(response.get("query_plan"), dict):
+        return {**response, "query_plan": dumps(response["query_plan"])}
+    return response
+
+
+def _loaded_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Entrada leída de MongoDB con el plan de /api/query decodificado"""
+    response = entry.get("response")
+    if isinstance(response, dict) and isinstance(response.get("query_plan"), str):
+        entry["response"] = {**response, "query_plan": json.loads(response["query_plan"])}
+    return entry
+
+
+class AnswerStore:
+    """Respuestas precalculadas en MongoDB con espejo en memoria"""
+
+    def __init__(self, collection_name: str = None, log_collection_name: str = None):
+        """
+        Args:
+            collection_name: Colección de respuestas precalculadas
+            log_collection_name: Colección del registro de preguntas
+        """
+        self.collection_name = collection_name or settings.ANSWER_STORE_COLLECTION
+        self.log_collection_name = log_collection_name or settings.QUERY_LOG_COLLECTION
+        self.lease_collection_name = settings.ANSWER_STORE_LEASES_COLLECTION
+        # Identifica a este proceso en las concesiones de recálculo
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._question_counts: Counter = Counter()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def collection(self):
+        return mongodb.get_collection(self.collection_name)
+
+    @staticmethod
+    def make_key(endpoint: str, question: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Clave de una respuesta precalculada
+
+        Args:
+            endpoint: "rag" o "query"
+            question: Pregunta del usuario
+            params: Parámetros que cambian la respuesta (temperature, context_limit...)
+
+        Returns:
+            Hash de endpoint, pregunta normalizada y parámetros
+        """
+        return request_key({
+            "endpoint": endpoint,
+            "question": AnswerCache.normalize_question(question),
+            "params": params or {}
+        })
+
+    async def load(self) -> int:
+        """
+        Carga todas las respuestas en memoria
+
+        Returns:
+            Número de entradas cargadas
+        """
+        self._entries = {
+            entry["_id"]: _loaded_entry(entry)
+            async for entry in self.collection.find({"stale": {"$ne": True}})
+        }
+        logger.info(f"📚 Respuestas precalculadas cargadas: {len(self._entries)}")
+        return len(self._entries)
+
+    def lookup(
+        self,
+        endpoint: str,
+        question: str,
+        params: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Respuesta precalculada de una pregunta (solo memoria, sin E/S)
+
+        Returns:
+            Resultado guardado o None
+        """
+        if not settings.ANSWER_STORE_ENABLED:
+            return None
+
+        entry = self._entries.get(self.make_key(endpoint, question, params))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry["response"]
+
+    async def save(
+        self,
+        endpoint: str,
+        question: str,
+        response: Dict[str, Any],
+        collections: Iterable[str],
+        params: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Guarda una respuesta precalculada
+
+        Args:
+            endpoint: "rag" o "query"
+            question: Pregunta tal como se precalculó
+            response: Resultado completo del endpoint
+            collections: Colecciones de las que depende la respuesta
+            params: Parámetros con los que se calculó
+        """
+        key = self.make_key(endpoint, question, params)
+        entry = {
+            "_id": key,
+            "endpoint": endpoint,
+            "question": question,
+            "params": params or {},
+            "response": response,
+            "collections": sorted(set(collections)),
+            "computed_at": datetime.utcnow()
+        }
+        await self.collection.replace_one(
+            {"_id": key},
+            {**entry, "response": _stored_response(response)},
+            upsert=True
+        )
+        self._entries[key] = entry
+
+    async def invalidate_collection(self, collection_name: str) -> List[Dict[str, Any]]:
+        """
+        Deja de servir las respuestas que dependen de una colección
+
+        Se quitan de memoria al momento y se marcan como obsoletas en
+        MongoDB (idempotente: cada worker lo hace al recibir el cambio); el
+        recálculo las vuelve a escribir sin la marca.
+
+        Returns:
+            Entradas descartadas de memoria
+        """
+        stale = [
+            entry for entry in self._entries.values()
+            if collection_name in entry["collections"]
+        ]
+        for entry in stale:
+            self._entries.pop(entry["_id"], None)
+
+        await self.collection.update_many(
+            {"collections": collection_name, "stale": {"$ne": True}},
+            {"$set": {"stale": True}}
+        )
+        if stale:
+            self.invalidations += len(stale)
+            logger.info(f"Respuestas precalculadas: {len(stale)} descartadas por cambios en {collection_name}")
+
+        return stale
+
+    async def stale_entries(self, collection_name: str) -> List[Dict[str, Any]]:
+        """Entradas obsoletas de una colección, según MongoDB (no la memoria de este worker)"""
+        cursor = self.collection.find({"collections": collection_name, "stale": True})
+        return [_loaded_entry(entry) async for entry in cursor]
+
+    async def acquire_refresh_lease(self, collection_name: str) -> bool:
+        """
+        Concesión para recalcular una colección: solo un proceso la obtiene
+
+        Caduca sola tras ANSWER_STORE_LEASE_SECONDS si el proceso muere.
+
+        Returns:
+            True si este proceso puede recalcular
+        """
+        now = datetime.utcnow()
+        leases = mongodb.get_collection(self.lease_collection_name)
+        try:
+            await leases.update_one(
+                {
+                    "_id": f"refresh:{collection_name}",
+                    "$or": [{"expires_at": {"$lt": now}}, {"owner": self.owner}]
+                },
+                {"$set": {
+                    "owner": self.owner,
+                    "expires_at": now + timedelta(seconds=settings.ANSWER_STORE_LEASE_SECONDS)
+                }},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Otro proceso tiene la concesión vigente
+            return False
+
+    async def release_refresh_lease(self, collection_name: str):
+        await mongodb.get_collection(self.lease_collection_name).delete_one(
+            {"_id": f"refresh:{collection_name}", "owner": self.owner}
+        )
+
+    def apply_change(self, change: Dict[str, Any]):
+        """Aplica al espejo en memoria un evento del change stream de la colección"""
+        key = change.get("documentKey", {}).get("_id")
+        entry = change.get("fullDocument")
+        if change.get("operationType") == "delete" or entry is None or entry.get("stale"):
+            self._entries.pop(key, None)
+        else:
+            self._entries[key] = _loaded_entry(entry)
+
+    async def watch_store(self):
+        """
+        Tarea de fondo: mantiene la memoria al día con la colección
+
+        Así llegan a la API las respuestas que escribe scripts/precompute_faq.py
+        o el worker que recalcula. Sin change streams recarga cada
+        ANSWER_STORE_POLL_SECONDS.
+        """
+        try:
+            async with self.collection.watch(full_document="updateLookup") as stream:
+                logger.info("👀 Respuestas precalculadas: siguiendo la colección")
+                async for change in stream:
+                    self.apply_change(change)
+            return
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Change streams no disponibles ({e}); recargando respuestas periódicamente")
+
+        while True:
+            await asyncio.sleep(settings.ANSWER_STORE_POLL_SECONDS)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.warning(f"Error recargando respuestas precalculadas: {e}")
+
+    def dependent_collections(self) -> List[str]:
+        """Colecciones de las que depende alguna respuesta guardada"""
+        return sorted({name for entry in self._entries.values() for name in entry["collections"]})
+
+    def record_question(self, endpoint: str, question: str):
+        """Cuenta una pregunta recibida (se vuelca con flush_query_log)"""
+        if settings.QUERY_LOG_ENABLED:
+            self._question_counts[(endpoint, question.strip())] += 1
+
+    async def flush_query_log(self):
+        """Vuelca los contadores de preguntas a MongoDB"""
+        if not self._question_counts:
+            return
+
+        counts, self._question_counts = self._question_counts, Counter()
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"_id": self.make_key(endpoint, question)},
+                {
+                    "$inc": {"count": count},
+                    "$set": {"last_seen": now},
+                    "$setOnInsert": {"endpoint": endpoint, "question": question}
+                },
+                upsert=True
+            )
+            for (endpoint, question), count in counts.items()
+        ]
+        await mongodb.get_collection(self.log_collection_name).bulk_write(operations, ordered=False)
+
+    async def run_query_log_flusher(self):
+        """Tarea de fondo que vuelca el query log periódicamente"""
+        try:
+            while True:
+                await asyncio.sleep(settings.QUERY_LOG_FLUSH_SECONDS)
+                try:
+                    await self.flush_query_log()
+                except Exception as e:
+                    logger.warning(f"Error volcando el query log: {e}")
+        except asyncio.CancelledError:
+            try:
+                await self.flush_query_log()
+            except Exception as e:
+                logger.warning(f"Error volcando el query log: {e}")
+            raise
+
+    async def frequent_questions(self, limit: int, min_count: int = 2) -> List[Tuple[str, str]]:
+        """
+        Preguntas más frecuentes del query log
+
+        Args:
+            limit: Número máximo de preguntas
+            min_count: Veces mínimas que se ha hecho una pregunta
+
+        Returns:
+            Lista de (endpoint, pregunta), de más a menos frecuente
+        """
+        cursor = mongodb.get_collection(self.log_collection_name).find(
+            {"count": {"$gte": min_count}},
+            {"endpoint": 1, "question": 1}
+        ).sort("count", DESCENDING).limit(limit)
+        return [(entry["endpoint"], entry["question"]) async for entry in cursor]
+
+    async def watch_changes(self, on_change: Callable[[str], Awaitable[None]]):
+        """
+        Avisa cuando cambia una colección de la que dependen respuestas
+
+        Usa un change stream sobre la base de datos (replica set / Atlas).
+        Sin change streams, compara cada ANSWER_STORE_POLL_SECONDS el número
+        de documentos y el último _id de cada colección (no detecta
+        actualizaciones en sitio).
+
+        Args:
+            on_change: Corrutina que recibe el nombre de la colección cambiada
+        """
+        ignored = {
+            self.collection_name,
+            self.log_collection_name,
+            self.lease_collection_name,
+            settings.SESSIONS_COLLECTION
+        }
+        pipeline = [{"$match": {"ns.coll": {"$nin": sorted(ignored)}}}]
+
+        try:
+            async with mongodb.db.watch(pipeline) as stream:
+                logger.info("👀 Respuestas precalculadas observando cambios")
+                async for change in stream:
+                    collection_name = change.get("ns", {}).get("coll")
+                    if collection_name in self.dependent_collections():
+                        await on_change(collection_name)
+            return
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Change streams no disponibles ({e}); sondeando colecciones")
+
+        fingerprints: Dict[str, Tuple[int, Any]] = {}
+        while True:
+            for collection_name in self.dependent_collections():
+                fingerprint = await self._fingerprint(collection_name)
+                previous = fingerprints.get(collection_name)
+                fingerprints[collection_name] = fingerprint
+                if previous is not None and previous != fingerprint:
+                    await on_change(collection_name)
+            await asyncio.sleep(settings.ANSWER_STORE_POLL_SECONDS)
+
+    async def _fingerprint(self, collection_name: str) -> Tuple[int, Any]:
+        collection = mongodb.get_collection(collection_name)
+        count = await collection.estimated_document_count()
+        last = await collection.find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+        return count, last["_id"] if last else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Entradas, aciertos e invalidaciones"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+
+
+# Singleton instance
+answer_store = AnswerStore()
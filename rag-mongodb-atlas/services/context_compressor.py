@@ -0,0 +1,189 @@
+"""
+Compresión extractiva del contexto RAG
+
+Entre la recuperación y la generación, divide los documentos en oraciones,
+las embebe en un único batch y conserva solo las más parecidas a la pregunta
+(más sus vecinas inmediatas, para no romper referencias como "esto" o
+"dicho valor") hasta alcanzar la proporción objetivo de tokens.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import logging
+
+import numpy as np
+
+from config.settings import settings
+from utils.helpers import split_sentences
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ContextCompressor:
+    """Selecciona las oraciones del contexto más relevantes para la pregunta"""
+
+    def __init__(self, embedder=None):
+        """
+        Args:
+            embedder: Servicio con generate_text_embeddings_batch()
+                (embedding_service por defecto)
+        """
+        self._embedder = embedder
+
+    @property
+    def embedder(self):
+        # Import diferido: el modelo de embeddings solo se carga si se comprime
+        if self._embedder is None:
+            from services.embedding_service import embedding_service
+            self._embedder = embedding_service
+        return self._embedder
+
+    def select_sentences(
+        self,
+        similarities: np.ndarray,
+        sentence_tokens: List[int],
+        groups: List[int],
+        target_tokens: int,
+        neighbors: int
+    ) -> List[int]:
+        """
+        Elige oraciones por similitud hasta cubrir el objetivo de tokens
+
+        Args:
+            similarities: Similitud de cada oración con la pregunta
+            sentence_tokens: Tokens de cada oración
+            groups: Documento al que pertenece cada oración
+            target_tokens: Tokens a conservar
+            neighbors: Oraciones vecinas a conservar a cada lado
+
+        Returns:
+            Índices de las oraciones conservadas, en orden original
+        """
+        selected = set()
+        kept_tokens = 0
+
+        for idx in np.argsort(-similarities, kind="stable").tolist():
+            if kept_tokens >= target_tokens:
+                break
+
+            for pos in range(idx - neighbors, idx + neighbors + 1):
+                if pos < 0 or pos >= len(groups) or pos in selected:
+                    continue
+                # Las vecinas no cruzan el límite del documento
+                if groups[pos] != groups[idx]:
+                    continue
+                selected.add(pos)
+                kept_tokens += sentence_tokens[pos]
+
+        return sorted(selected)
+
+    async def compress(
+        self,
+        question: str,
+        documents: List[Dict[str, Any]],
+        ratio: float = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Comprime el contenido de los documentos de contexto
+
+        Args:
+            question: Pregunta del usuario
+            documents: Documentos con title, content y score
+            ratio: Proporción de tokens a conservar (CONTEXT_COMPRESSION_RATIO por defecto)
+            query_embedding: Embedding ya calculado de la pregunta (opcional)
+
+        Returns:
+            Tupla (documentos comprimidos, estadísticas de compresión)
+        """
+        try:
+            ratio = settings.CONTEXT_COMPRESSION_RATIO if ratio is None else ratio
+
+            sentences: List[str] = []
+            groups: List[int] = []
+            for doc_idx, doc in enumerate(documents):
+                for sentence in split_sentences(doc.get("content", "")):
+                    sentences.append(sentence)
+                    groups.append(doc_idx)
+
+            sentence_tokens = [count_tokens(sentence) for sentence in sentences]
+            original_tokens = sum(sentence_tokens)
+
+            stats = {
+                "target_ratio": ratio,
+                "original_tokens": original_tokens,
+                "compressed_tokens": original_tokens,
+                "tokens_saved": 0,
+                "sentences_total": len(sentences),
+                "sentences_kept": len(sentences),
+                "applied": False
+            }
+
+            if (
+                not settings.CONTEXT_COMPRESSION_ENABLED
+                or ratio >= 1.0
+                or original_tokens < settings.CONTEXT_COMPRESSION_MIN_TOKENS
+            ):
+                return documents, stats
+
+            # Pregunta y oraciones en un único batch de embeddings
+            texts = sentences if query_embedding is not None else [question] + sentences
+            embeddings = await asyncio.to_thread(self.embedder.generate_text_embeddings_batch, texts)
+            vectors = np.asarray(embeddings, dtype=np.float32)
+
+            if query_embedding is None:
+                query_vector, vectors = vectors[0], vectors[1:]
+            else:
+                query_vector = np.asarray(query_embedding, dtype=np.float32)
+
+            norms = np.linalg.norm(vectors, axis=1)
+            norms[norms == 0] = 1.0
+            query_norm = np.linalg.norm(query_vector) or 1.0
+            similarities = (vectors @ query_vector) / (norms * query_norm)
+
+            selected = self.select_sentences(
+                similarities,
+                sentence_tokens,
+                groups,
+                target_tokens=int(original_tokens * ratio),
+                neighbors=settings.CONTEXT_COMPRESSION_NEIGHBORS
+            )
+
+            # Reconstruir cada documento; los saltos entre fragmentos se marcan con "…"
+            kept_by_doc: Dict[int, List[int]] = {}
+            for pos in selected:
+                kept_by_doc.setdefault(groups[pos], []).append(pos)
+
+            compressed = []
+            for doc_idx, doc in enumerate(documents):
+                positions = kept_by_doc.get(doc_idx)
+                if not positions:
+                    continue
+
+                parts = [sentences[positions[0]]]
+                for prev, pos in zip(positions, positions[1:]):
+                    parts.append(sentences[pos] if pos == prev + 1 else f"… {sentences[pos]}")
+
+                compressed.append({**doc, "content": " ".join(parts)})
+
+            compressed_tokens = sum(sentence_tokens[pos] for pos in selected)
+            stats.update({
+                "compressed_tokens": compressed_tokens,
+                "tokens_saved": original_tokens - compressed_tokens,
+                "sentences_kept": len(selected),
+                "applied": True
+            })
+
+            logger.debug(
+                f"Contexto comprimido: {original_tokens} → {compressed_tokens} tokens "
+                f"({len(selected)}/{len(sentences)} oraciones)"
+            )
+            return compressed, stats
+
+        except Exception as e:
+            logger.error(f"Error comprimiendo contexto: {e}")
+            raise
+
+
+# Singleton instance
+context_compressor = ContextCompressor()
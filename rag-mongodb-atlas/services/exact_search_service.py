@@ -0,0 +1,330 @@
+"""
+Servicio de búsqueda vectorial exacta sobre matrices de embeddings en disco
+
+Cada colección exportada se guarda como:
+    <coleccion>.json              manifiesto (versión activa, filas, dimensión)
+    <coleccion>-<version>.f32     matriz float32 normalizada (np.memmap)
+    <coleccion>-<version>.ids.json  _ids en el mismo orden que las filas
+
+El manifiesto se reemplaza de forma atómica (os.replace), por lo que los
+workers de uvicorn siempre ven una versión completa. Las matrices se abren
+en modo solo lectura y se comparten entre procesos a través del page cache.
+"""
+from pathlib import Path
+from typing import List, Dict, Any, Tuple
+from datetime import datetime
+import asyncio
+import json
+import os
+import logging
+
+import numpy as np
+from bson import json_util
+
+from config.database import mongodb
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExactSearchService:
+    """Top-k exacto por producto punto sobre embeddings mapeados en memoria"""
+
+    def __init__(self, base_dir: str = None, block_size: int = None):
+        """
+        Args:
+            base_dir: Directorio de las matrices exportadas
+            block_size: Filas por bloque en la multiplicación de matrices
+        """
+        self.base_dir = Path(base_dir or settings.EXACT_SEARCH_DIR)
+        self.block_size = block_size or settings.EXACT_SEARCH_BLOCK_SIZE
+        self._loaded: Dict[str, Dict[str, Any]] = {}
+
+    def _manifest_path(self, collection_name: str) -> Path:
+        return self.base_dir / f"{collection_name}.json"
+
+    def export_collection(self, collection, collection_name: str, batch_size: int = 1024) -> Dict[str, Any]:
+        """
+        Exporta los _id y embeddings de una colección a una matriz np.memmap
+
+        Args:
+            collection: Colección síncrona (pymongo)
+            collection_name: Nombre con el que se publica la matriz
+            batch_size: Documentos por lote de escritura
+
+        Returns:
+            Manifiesto de la versión publicada
+        """
+        try:
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+
+            query = {"embedding": {"$exists": True}}
+            expected = collection.count_documents(query)
+            dimension = settings.EMBEDDING_DIMENSION
+
+            version = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+            matrix_name = f"{collection_name}-{version}.f32"
+            ids_name = f"{collection_name}-{version}.ids.json"
+
+            ids: List[Any] = []
+            rows = 0
+
+            if expected:
+                matrix = np.memmap(
+                    self.base_dir / matrix_name,
+                    dtype=np.float32,
+                    mode="w+",
+                    shape=(expected, dimension)
+                )
+
+                cursor = collection.find(query, {"embedding": 1}).batch_size(batch_size)
+                batch_vectors = []
+
+                for doc in cursor:
+                    if rows + len(batch_vectors) >= expected:
+                        logger.warning(f"{collection_name}: documentos nuevos durante la exportación, se omiten")
+                        break
+
+                    embedding = doc.get("embedding") or []
+                    if len(embedding) != dimension:
+                        continue
+
+                    batch_vectors.append(embedding)
+                    ids.append(doc["_id"])
+
+                    if len(batch_vectors) >= batch_size:
+                        rows = self._write_block(matrix, rows, batch_vectors)
+                        batch_vectors = []
+
+                if batch_vectors:
+                    rows = self._write_block(matrix, rows, batch_vectors)
+
+                matrix.flush()
+                del matrix
+            else:
+                # Matriz vacía: se crea el archivo para mantener el formato
+                (self.base_dir / matrix_name).touch()
+
+            with open(self.base_dir / ids_name, "w", encoding="utf-8") as f:
+                f.write(json_util.dumps(ids))
+
+            manifest = {
+                "collection": collection_name,
+                "version": version,
+                "matrix": matrix_name,
+                "ids": ids_name,
+                "rows": rows,
+                "dimension": dimension,
+                "exported_at": datetime.utcnow().isoformat()
+            }
+
+            self._publish_manifest(collection_name, manifest)
+            logger.info(f"✅ Matriz exacta publicada: {collection_name} ({rows} vectores)")
+            return manifest
+
+        except Exception as e:
+            logger.error(f"Error exportando embeddings de {collection_name}: {e}")
+            raise
+
+    def _write_block(self, matrix: np.memmap, offset: int, vectors: List[List[float]]) -> int:
+        """Normaliza y escribe un bloque de vectores; retorna el nuevo offset"""
+        block = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix[offset:offset + len(block)] = block / norms
+        return offset + len(block)
+
+    def _publish_manifest(self, collection_name: str, manifest: Dict[str, Any]):
+        """Reemplaza el manifiesto de forma atómica y limpia versiones antiguas"""
+        manifest_path = self._manifest_path(collection_name)
+        tmp_path = manifest_path.with_suffix(f".json.tmp{os.getpid()}")
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, manifest_path)
+
+        # Se conserva la versión anterior para workers que estén recargando en
+        # este momento; los que ya la tengan mapeada la siguen leyendo aunque
+        # el archivo se desvincule más tarde
+        versions = sorted({
+            path.name[len(collection_name) + 1:].split(".")[0]
+            for path in self.base_dir.glob(f"{collection_name}-*")
+        })
+        versions = [v for v in versions if v.isdigit()]
+        for old_version in versions[:-2]:
+            for path in self.base_dir.glob(f"{collection_name}-{old_version}.*"):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def has_index(self, collection_name: str) -> bool:
+        """Indica si existe una matriz exportada para la colección"""
+        return self._manifest_path(collection_name).exists()
+
+    def _load(self, collection_name: str) -> Dict[str, Any]:
+        """
+        Abre (o reutiliza) la matriz publicada de una colección
+
+        Se recarga automáticamente cuando el manifiesto cambia en disco.
+        """
+        manifest_path = self._manifest_path(collection_name)
+        stat = manifest_path.stat()
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+
+        cached = self._loaded.get(collection_name)
+        if cached and cached["stamp"] == stamp:
+            return cached
+
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        rows = manifest["rows"]
+        if rows:
+            matrix = np.memmap(
+                self.base_dir / manifest["matrix"],
+                dtype=np.float32,
+                mode="r",
+                shape=(rows, manifest["dimension"])
+            )
+        else:
+            matrix = np.empty((0, manifest["dimension"]), dtype=np.float32)
+
+        with open(self.base_dir / manifest["ids"], "r", encoding="utf-8") as f:
+            ids = json_util.loads(f.read())
+
+        loaded = {"stamp": stamp, "manifest": manifest, "matrix": matrix, "ids": ids}
+        self._loaded[collection_name] = loaded
+        logger.info(f"Matriz exacta cargada: {collection_name} v{manifest['version']} ({rows} vectores)")
+        return loaded
+
+    def top_k(self, matrix: np.ndarray, query_vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k exacto por producto punto, procesando la matriz por bloques
+
+        Args:
+            matrix: Matriz (n, d) de vectores normalizados
+            query_vector: Vector de consulta normalizado (d,)
+            k: Número de resultados
+
+        Returns:
+            Tupla (índices, scores) ordenada por score descendente
+        """
+        n = matrix.shape[0]
+        k = min(k, n)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        best_idx = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+
+        for start in range(0, n, self.block_size):
+            scores = matrix[start:start + self.block_size] @ query_vector
+
+            if len(scores) > k:
+                local = np.argpartition(-scores, k - 1)[:k]
+            else:
+                local = np.arange(len(scores))
+
+            cand_idx = np.concatenate([best_idx, local + start])
+            cand_scores = np.concatenate([best_scores, scores[local]])
+
+            if len(cand_scores) > k:
+                keep = np.argpartition(-cand_scores, k - 1)[:k]
+                cand_idx, cand_scores = cand_idx[keep], cand_scores[keep]
+
+            best_idx, best_scores = cand_idx, cand_scores
+
+        order = np.argsort(-best_scores, kind="stable")
+        return best_idx[order], best_scores[order]
+
+    def _rank(
+        self,
+        collection_name: str,
+        query_embedding: List[float],
+        limit: int,
+        min_score: float = None
+    ) -> Tuple[List[Any], Dict[Any, float]]:
+        """
+        Carga la matriz y calcula el top-k (bloqueante: E/S de disco y numpy)
+
+        Returns:
+            Tupla (_ids en orden de score, {_id: score})
+        """
+        loaded = self._load(collection_name)
+
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm:
+            query_vector = query_vector / norm
+
+        indices, cosines = self.top_k(loaded["matrix"], query_vector, limit)
+
+        # Atlas expresa la similitud coseno como (1 + cos) / 2
+        scores = {}
+        ordered_ids = []
+        for idx, cosine in zip(indices.tolist(), cosines.tolist()):
+            score = (1.0 + cosine) / 2.0
+            if min_score and score < min_score:
+                continue
+            doc_id = loaded["ids"][idx]
+            scores[doc_id] = score
+            ordered_ids.append(doc_id)
+
+        return ordered_ids, scores
+
+    async def search(
+        self,
+        query_embedding: List[float],
+        collection_name: str = None,
+        limit: int = 10,
+        min_score: float = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Búsqueda exacta sobre la matriz exportada de una colección
+
+        Args:
+            query_embedding: Embedding de la consulta
+            collection_name: Nombre de la colección
+            limit: Número máximo de resultados
+            min_score: Score mínimo de similitud
+
+        Returns:
+            Lista de documentos con scores (misma escala que vectorSearchScore)
+        """
+        try:
+            coll_name = collection_name or settings.DOCUMENTS_COLLECTION
+            # Lectura de la matriz y producto punto fuera del event loop
+            ordered_ids, scores = await asyncio.to_thread(
+                self._rank, coll_name, query_embedding, limit, min_score
+            )
+
+            if not ordered_ids:
+                return []
+
+            collection = mongodb.get_collection(coll_name)
+            cursor = collection.find(
+                {"_id": {"$in": ordered_ids}},
+                {"title": 1, "content": 1, "metadata": 1, "tags": 1, "updated_at": 1}
+            )
+            documents = {doc["_id"]: doc async for doc in cursor}
+
+            results = [
+                {**documents[doc_id], "score": scores[doc_id]}
+                for doc_id in ordered_ids
+                if doc_id in documents
+            ]
+
+            logger.debug(f"Exact search: {len(results)} resultados en {coll_name}")
+            return results
+
+        except Exception as e:
+            logger.error(f"Error en exact search: {e}")
+            raise
+
+
+# Singleton instance
+exact_search_service = ExactSearchService()
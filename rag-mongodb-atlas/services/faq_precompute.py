@@ -0,0 +1,165 @@
+"""
+Precálculo de respuestas a preguntas frecuentes
+
+Responde por lotes, con concurrencia acotada, una lista de preguntas (de un
+archivo o del query log) usando el mismo pipeline que /api/rag y /api/query,
+y guarda cada resultado en el AnswerStore. Cuando cambia una colección, las
+respuestas que dependen de ella dejan de servirse en el acto; el recálculo
+espera (para agrupar cargas masivas en uno solo) y lo hace un único proceso,
+el que obtiene la concesión de la colección en MongoDB.
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import json
+import logging
+import time
+
+from config.settings import settings
+from models.schemas import RAGRequest
+from services.answer_store import answer_store, query_collections
+from services.rag_service import rag_service
+from services.query_service import query_service
+from services.usage_tracker import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ("rag", "query")
+
+
+def default_rag_params() -> Dict[str, Any]:
+    """Parámetros por defecto de /api/rag, con los que se precalcula"""
+    return RAGRequest(question="-").model_dump(include={"context_limit", "temperature", "max_tokens"})
+
+
+def load_questions_file(path: str) -> List[Dict[str, str]]:
+    """
+    Lee las preguntas a precalcular
+
+    Formato: {"rag": ["..."], "query": ["..."]}
+
+    Returns:
+        Lista de {"endpoint", "question"}
+    """
+    with open(Path(path), "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    return [
+        {"endpoint": endpoint, "question": question}
+        for endpoint in ENDPOINTS
+        for question in data.get(endpoint, [])
+    ]
+
+
+class FAQPrecomputer:
+    """Calcula y refresca las respuestas del AnswerStore"""
+
+    def __init__(self):
+        self._pending_refresh: Set[str] = set()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def precompute(
+        self,
+        items: List[Dict[str, Any]],
+        concurrency: int = None
+    ) -> Dict[str, Any]:
+        """
+        Precalcula un lote de preguntas
+
+        Args:
+            items: Lista de {"endpoint", "question", "params" (opcional)}
+            concurrency: Preguntas en paralelo (FAQ_CONCURRENCY por defecto)
+
+        Returns:
+            Resumen con calculadas, fallidas y tiempo total
+        """
+        semaphore = asyncio.Semaphore(concurrency or settings.FAQ_CONCURRENCY)
+        start = time.perf_counter()
+
+        async def run(item: Dict[str, Any]) -> bool:
+            async with semaphore:
+                try:
+                    with usage_tracker.scope(f"faq_{item['endpoint']}"):
+                        return await self._compute(item["endpoint"], item["question"], item.get("params"))
+                except Exception as e:
+                    logger.warning(f"No se pudo precalcular '{item['question']}': {e}")
+                    return False
+
+        outcomes = await asyncio.gather(*(run(item) for item in items))
+
+        summary = {
+            "computed": sum(outcomes),
+            "failed": len(outcomes) - sum(outcomes),
+            "elapsed_seconds": round(time.perf_counter() - start, 2)
+        }
+        logger.info(f"Precálculo de FAQ: {summary}")
+        return summary
+
+    async def _compute(self, endpoint: str, question: str, params: Optional[Dict[str, Any]]) -> bool:
+        """Calcula una respuesta y la guarda; False si no es reutilizable"""
+        if endpoint == "rag":
+            params = params or default_rag_params()
+            result = await rag_service.generate_answer(question=question, **params)
+            collections = [settings.DOCUMENTS_COLLECTION]
+        elif endpoint == "query":
+            params = None
+            result = await query_service.natural_language_query(question)
+            if "error" in result:
+                return False
+            collections = query_collections(result["query_plan"])
+        else:
+            raise ValueError(f"Endpoint no soportado: {endpoint}")
+
+        await answer_store.save(endpoint, question, result, collections, params)
+        return True
+
+    async def refresh_collection(self, collection_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Recalcula las respuestas obsoletas de una colección
+
+        Returns:
+            Resumen del recálculo, o None si otro proceso tiene la concesión
+        """
+        if not await answer_store.acquire_refresh_lease(collection_name):
+            return None
+
+        try:
+            stale = await answer_store.stale_entries(collection_name)
+            items = [
+                {"endpoint": entry["endpoint"], "question": entry["question"], "params": entry["params"] or None}
+                for entry in stale
+            ]
+            return await self.precompute(items)
+        finally:
+            await answer_store.release_refresh_lease(collection_name)
+
+    async def schedule_refresh(self, collection_name: str):
+        """
+        Descarta ya las respuestas afectadas y programa su recálculo,
+        agrupando cambios seguidos
+        """
+        await answer_store.invalidate_collection(collection_name)
+        self._pending_refresh.add(collection_name)
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_pending())
+
+    async def _refresh_pending(self):
+        await asyncio.sleep(settings.ANSWER_STORE_REFRESH_DELAY_SECONDS)
+        while self._pending_refresh:
+            collection_name = self._pending_refresh.pop()
+            try:
+                await self.refresh_collection(collection_name)
+            except Exception as e:
+                logger.warning(f"Error recalculando respuestas de {collection_name}: {e}")
+
+    async def watch(self):
+        """Tarea de fondo: recalcula cuando cambian las colecciones"""
+        try:
+            await answer_store.watch_changes(self.schedule_refresh)
+        finally:
+            if self._refresh_task is not None:
+                self._refresh_task.cancel()
+
+
+# Singleton instance
+faq_precomputer = FAQPrecomputer()
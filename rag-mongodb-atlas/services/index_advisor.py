@@ -0,0 +1,449 @@
+"""
+Registro de formas de consulta y recomendación de índices
+
+Cada plan de /api/query que se ejecuta (o que QueryGuard rechaza por
+recorrer una colección completa) se reduce a su forma: campos filtrados por
+igualdad y por rango, claves de ordenación y claves de $group, por
+colección. Los $lookup cuentan como una igualdad sobre el foreignField de
+la colección destino. Las formas se cuentan en memoria y se vuelcan a
+QUERY_SHAPES_COLLECTION.
+
+Con las formas más frecuentes se proponen índices compuestos siguiendo la
+regla ESR (igualdad, orden, rango), se descartan los que ya cubre un índice
+existente y se estima el beneficio con explain (executionStats): documentos
+examinados frente a devueltos, multiplicado por la frecuencia. Se aplican a
+petición (scripts/index_advisor.py --apply, POST /api/indexes/apply) o, con
+INDEX_ADVISOR_AUTO_APPLY, en segundo plano.
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+
+from pymongo import DESCENDING, UpdateOne
+
+from config.database import mongodb
+from config.settings import settings
+from services.plan_rewriter import decode_dates, sort_keys
+from services.query_guard import winning_stages
+from utils.serialization import dumps
+from utils.singleflight import request_key
+
+logger = logging.getLogger(__name__)
+
+EQUALITY_OPERATORS = {"$eq", "$in"}
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte"}
+INDEX_NAME_PREFIX = "advisor_"
+
+IndexKeys = List[Tuple[str, int]]
+
+
+def _add(fields: List[str], field: str):
+    if field not in fields:
+        fields.append(field)
+
+
+def _filter_fields(filter_: Any, equality: List[str], range_: List[str]):
+    """Clasifica los campos de un filtro en igualdad y rango"""
+    if not isinstance(filter_, dict):
+        return
+
+    for key, value in filter_.items():
+        if key == "$and" and isinstance(value, list):
+            for condition in value:
+                _filter_fields(condition, equality, range_)
+        elif key.startswith("$"):
+            # $or, $expr, $text...: no se deducen índices de ellos
+            continue
+        elif isinstance(value, dict) and any(str(op).startswith("$") for op in value):
+            operators = set(value)
+            if operators & EQUALITY_OPERATORS:
+                _add(equality, key)
+            elif operators & RANGE_OPERATORS:
+                _add(range_, key)
+            elif "$regex" in operators and str(value["$regex"]).startswith("^"):
+                # Una regex anclada al inicio se resuelve como rango del índice
+                _add(range_, key)
+        else:
+            _add(equality, key)
+
+
+def _referenced_fields(expression: Any) -> List[str]:
+    """Campos ("$campo") usados en una expresión, p. ej. el _id de $group"""
+    if isinstance(expression, str):
+        return [expression[1:]] if expression.startswith("$") and not expression.startswith("$$") else []
+    if isinstance(expression, dict):
+        return [field for child in expression.values() for field in _referenced_fields(child)]
+    if isinstance(expression, list):
+        return [field for child in expression for field in _referenced_fields(child)]
+    return []
+
+
+def _shape(collection: str, equality: List[str], range_: List[str], sort: IndexKeys,
+           group: List[str], probe: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "collection": collection,
+        "equality": sorted(equality),
+        "range": sorted(field for field in range_ if field not in equality),
+        "sort": [list(key) for key in sort],
+        "group": sorted(set(group)),
+        "probe": probe
+    }
+
+
+def extract_shapes(query_plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Formas de consulta de un plan de /api/query
+
+    En un pipeline solo cuentan los $match y el $sort iniciales (los que
+    pueden usar un índice); los $lookup añaden una forma para la colección
+    destino.
+
+    Args:
+        query_plan: Plan generado por el LLM
+
+    Returns:
+        Lista de formas {collection, equality, range, sort, group, probe}
+    """
+    collection = query_plan.get("collection")
+    operation = query_plan.get("operation", "find")
+    query = query_plan.get("query", {})
+    if not collection:
+        return []
+
+    equality: List[str] = []
+    range_: List[str] = []
+    group: List[str] = []
+    shapes: List[Dict[str, Any]] = []
+
+    if operation == "aggregate" and isinstance(query, list):
+        matches: List[Dict[str, Any]] = []
+        sort: IndexKeys = []
+        leading = True
+        for stage in query:
+            if not isinstance(stage, dict):
+                continue
+            if leading and "$match" in stage:
+                matches.append(stage["$match"])
+                _filter_fields(stage["$match"], equality, range_)
+            elif leading and "$sort" in stage:
+                sort = sort_keys(stage["$sort"])
+                leading = False
+            else:
+                leading = False
+
+            if "$group" in stage and isinstance(stage["$group"], dict):
+                group.extend(_referenced_fields(stage["$group"].get("_id")))
+
+            lookup = stage.get("$lookup")
+            if isinstance(lookup, dict) and lookup.get("from") and lookup.get("foreignField"):
+                shapes.append(_shape(lookup["from"], [lookup["foreignField"]], [], [], [], None))
+
+        filter_ = matches[0] if len(matches) == 1 else ({"$and": matches} if matches else {})
+    else:
+        filter_ = query if isinstance(query, dict) else {}
+        _filter_fields(filter_, equality, range_)
+        sort = sort_keys(query_plan.get("sort"))
+
+    if equality or range_ or sort:
+        probe = {"filter": filter_, "sort": dict(sort)}
+        shapes.insert(0, _shape(collection, equality, range_, sort, group, probe))
+
+    return shapes
+
+
+def recommend_keys(shape: Dict[str, Any]) -> IndexKeys:
+    """Clave de índice ESR: igualdad, orden y rango"""
+    keys: IndexKeys = [(field, 1) for field in shape["equality"]]
+    for field, direction in shape["sort"]:
+        if field not in shape["equality"]:
+            keys.append((field, direction))
+    for field in shape["range"]:
+        if field not in dict(keys):
+            keys.append((field, 1))
+    return keys
+
+
+def index_covers(index_keys: IndexKeys, keys: IndexKeys, equality_count: int) -> bool:
+    """
+    Si un índice existente sirve para la clave recomendada
+
+    El orden entre los campos de igualdad no importa; el resto debe ser
+    prefijo del índice con las mismas direcciones (o todas invertidas).
+
+    Args:
+        index_keys: Clave del índice existente
+        keys: Clave recomendada
+        equality_count: Campos de igualdad al principio de keys
+    """
+    if len(index_keys) < len(keys):
+        return False
+
+    index_keys = [(field, direction) for field, direction in index_keys]
+    if {field for field, _ in index_keys[:equality_count]} != {field for field, _ in keys[:equality_count]}:
+        return False
+
+    tail, index_tail = keys[equality_count:], index_keys[equality_count:len(keys)]
+    if [field for field, _ in tail] != [field for field, _ in index_tail]:
+        return False
+    same = all(direction == index_direction for (_, direction), (_, index_direction) in zip(tail, index_tail))
+    inverted = all(direction == -index_direction for (_, direction), (_, index_direction) in zip(tail, index_tail))
+    return same or inverted
+
+
+def index_name(keys: IndexKeys) -> str:
+    """Nombre de los índices creados por el asesor"""
+    return (INDEX_NAME_PREFIX + "_".join(f"{field}_{direction}" for field, direction in keys))[:120]
+
+
+class IndexAdvisor:
+    """Registra formas de consulta y recomienda índices compuestos"""
+
+    def __init__(self, collection_name: str = None):
+        """
+        Args:
+            collection_name: Colección donde se acumulan las formas
+        """
+        self.collection_name = collection_name or settings.QUERY_SHAPES_COLLECTION
+        self._pending: Counter = Counter()
+        self._shapes: Dict[str, Dict[str, Any]] = {}
+        self.recorded = 0
+        self.applied: List[str] = []
+
+    def record(self, query_plan: Dict[str, Any]):
+        """Cuenta las formas de un plan (se vuelcan con flush)"""
+        if not settings.INDEX_ADVISOR_RECORD_SHAPES:
+            return
+        try:
+            for shape in extract_shapes(query_plan):
+                key = request_key({name: shape[name] for name in shape if name != "probe"})
+                self._pending[key] += 1
+                self._shapes[key] = shape
+                self.recorded += 1
+        except Exception as e:
+            logger.warning(f"No se pudo registrar la forma de la consulta: {e}")
+
+    async def flush(self):
+        """Vuelca los contadores de formas a MongoDB"""
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, Counter()
+        shapes, self._shapes = self._shapes, {}
+        now = datetime.utcnow()
+        operations = []
+        for key, count in pending.items():
+            shape = shapes[key]
+            fields = {name: shape[name] for name in ("collection", "equality", "range", "sort", "group")}
+            operations.append(UpdateOne(
+                {"_id": key},
+                {
+                    "$inc": {"count": count},
+                    # El filtro de ejemplo lleva operadores $: se guarda como JSON
+                    "$set": {"last_seen": now, "probe": dumps(shape["probe"]) if shape["probe"] else None},
+                    "$setOnInsert": fields
+                },
+                upsert=True
+            ))
+        try:
+            await mongodb.get_collection(self.collection_name).bulk_write(operations, ordered=False)
+        except Exception:
+            # Los contadores vuelven a la cola para el siguiente volcado
+            for key, count in pending.items():
+                self._pending[key] += count
+                self._shapes.setdefault(key, shapes[key])
+            raise
+
+    async def load_shapes(self, min_count: int = 1, collection: str = None) -> List[Dict[str, Any]]:
+        """
+        Formas registradas, de más a menos frecuente
+
+        Args:
+            min_count: Veces mínimas que se ha visto la forma
+            collection: Filtrar por colección
+        """
+        await self.flush()
+        query: Dict[str, Any] = {"count": {"$gte": min_count}}
+        if collection:
+            query["collection"] = collection
+        cursor = mongodb.get_collection(self.collection_name).find(query).sort("count", DESCENDING)
+        shapes = []
+        async for shape in cursor:
+            shape["probe"] = json.loads(shape["probe"]) if shape.get("probe") else None
+            shapes.append(shape)
+        return shapes
+
+    async def _existing_indexes(self, collection_name: str) -> List[IndexKeys]:
+        indexes = await mongodb.get_collection(collection_name).index_information()
+        return [
+            [(field, direction) for field, direction in index["key"]]
+            for index in indexes.values()
+        ]
+
+    async def _explain_probe(self, collection_name: str, probe: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Documentos examinados y devueltos por la parte indexable de la consulta"""
+        if probe is None:
+            # $lookup: sin índice, cada búsqueda recorre la colección destino
+            size = await mongodb.get_collection(collection_name).estimated_document_count()
+            return {"docs_examined": size, "n_returned": 1, "execution_ms": None, "blocking_sort": False}
+
+        command: Dict[str, Any] = {
+            "find": collection_name,
+            "filter": decode_dates(probe["filter"]),
+            "maxTimeMS": settings.QUERY_MAX_TIME_MS
+        }
+        if probe.get("sort"):
+            command["sort"] = probe["sort"]
+
+        explain = await mongodb.db.command({"explain": command, "verbosity": "executionStats"})
+        stats = explain.get("executionStats", {})
+        return {
+            "docs_examined": stats.get("totalDocsExamined", 0),
+            "n_returned": stats.get("nReturned", 0),
+            "execution_ms": stats.get("executionTimeMillis"),
+            "blocking_sort": any(
+                stage["stage"] == "SORT" for stage in winning_stages(explain.get("queryPlanner", {}))
+            )
+        }
+
+    async def recommend(
+        self,
+        min_count: int = None,
+        collection: str = None,
+        explain: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Índices recomendados para las formas frecuentes
+
+        Args:
+            min_count: Veces mínimas que se ha visto la forma (INDEX_ADVISOR_MIN_COUNT)
+            collection: Limitar a una colección
+            explain: Estimar el beneficio con explain (ejecuta la parte
+                indexable de cada consulta, con maxTimeMS)
+
+        Returns:
+            Recomendaciones ordenadas por beneficio estimado
+        """
+        min_count = min_count or settings.INDEX_ADVISOR_MIN_COUNT
+        shapes = await self.load_shapes(min_count, collection)
+        existing: Dict[str, List[IndexKeys]] = {}
+        candidates: List[Dict[str, Any]] = []
+
+        for shape in shapes:
+            keys = recommend_keys(shape)
+            if not keys or keys == [("_id", 1)]:
+                continue
+
+            name = shape["collection"]
+            if name not in existing:
+                existing[name] = await self._existing_indexes(name)
+            equality_count = len(shape["equality"])
+            if any(index_covers(index, keys, equality_count) for index in existing[name]):
+                continue
+
+            # Una clave que es prefijo de otra ya recomendada se sirve con esa
+            merged = next(
+                (
+                    candidate for candidate in candidates
+                    if candidate["collection"] == name
+                    and index_covers(candidate["keys"], keys, equality_count)
+                ),
+                None
+            )
+            if merged is not None:
+                merged["queries"] += shape["count"]
+                merged["shapes"].append(shape)
+                continue
+
+            candidates.append({
+                "collection": name,
+                "keys": keys,
+                "name": index_name(keys),
+                "queries": shape["count"],
+                "shapes": [shape]
+            })
+
+        recommendations = []
+        for candidate in candidates:
+            shape = candidate["shapes"][0]
+            recommendation = {
+                "collection": candidate["collection"],
+                "keys": [[field, direction] for field, direction in candidate["keys"]],
+                "name": candidate["name"],
+                "queries": candidate["queries"],
+                "shapes": [
+                    {name: item[name] for name in ("equality", "sort", "range", "group", "count")}
+                    for item in candidate["shapes"]
+                ]
+            }
+            if explain:
+                try:
+                    stats = await self._explain_probe(candidate["collection"], shape["probe"])
+                    saved = max(0, stats["docs_examined"] - stats["n_returned"])
+                    recommendation["explain"] = stats
+                    recommendation["estimated_docs_saved"] = saved * candidate["queries"]
+                except Exception as e:
+                    logger.warning(f"explain falló para {candidate['name']}: {e}")
+                    recommendation["explain"] = {"error": str(e)}
+            recommendations.append(recommendation)
+
+        recommendations.sort(key=lambda item: (item.get("estimated_docs_saved", 0), item["queries"]), reverse=True)
+        return recommendations
+
+    async def apply(self, recommendation: Dict[str, Any]) -> str:
+        """
+        Crea el índice de una recomendación
+
+        Returns:
+            Nombre del índice creado
+        """
+        keys = [(field, int(direction)) for field, direction in recommendation["keys"]]
+        name = recommendation.get("name") or index_name(keys)
+        collection = mongodb.get_collection(recommendation["collection"])
+        created = await collection.create_index(keys, name=name)
+        self.applied.append(f"{recommendation['collection']}.{created}")
+        logger.info(f"🗂️  Índice creado por el asesor: {recommendation['collection']}.{created}")
+        return created
+
+    async def _auto_apply(self):
+        """Aplica las recomendaciones que superan INDEX_ADVISOR_MIN_DOCS_SAVED"""
+        for recommendation in await self.recommend():
+            if recommendation.get("estimated_docs_saved", 0) < settings.INDEX_ADVISOR_MIN_DOCS_SAVED:
+                continue
+            indexes = await mongodb.get_collection(recommendation["collection"]).index_information()
+            advisor_indexes = [name for name in indexes if name.startswith(INDEX_NAME_PREFIX)]
+            if len(advisor_indexes) >= settings.INDEX_ADVISOR_MAX_INDEXES:
+                continue
+            await self.apply(recommendation)
+
+    async def run(self):
+        """Tarea de fondo: vuelca las formas y, si está activado, aplica índices"""
+        try:
+            while True:
+                await asyncio.sleep(settings.INDEX_ADVISOR_FLUSH_SECONDS)
+                try:
+                    await self.flush()
+                    if settings.INDEX_ADVISOR_AUTO_APPLY:
+                        await self._auto_apply()
+                except Exception as e:
+                    logger.warning(f"Error en el asesor de índices: {e}")
+        except asyncio.CancelledError:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Error volcando las formas de consulta: {e}")
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Formas registradas e índices creados"""
+        return {
+            "recorded": self.recorded,
+            "pending_shapes": len(self._pending),
+            "applied": list(self.applied)
+        }
+
+
+# Singleton instance
+index_advisor = IndexAdvisor()
@@ -0,0 +1,394 @@
+"""
+Backends de LLM detrás de una interfaz común
+
+LLMService (limitador, reintentos, hedging, métricas) habla con un
+LLMProvider en lugar de con el SDK de Groq directamente. Hay dos
+implementaciones:
+
+    groq    SDK oficial de Groq (por defecto)
+    openai  Cualquier servidor compatible con /chat/completions de OpenAI
+            (Groq, vLLM, Ollama o scripts/llm_stub_server.py para pruebas
+            de carga sin red)
+
+Los proveedores traducen sus errores a LLMProviderError / LLMConnectionError
+para que la política de reintentos no dependa del backend.
+"""
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+import json
+import logging
+
+import httpx
+from groq import Groq, AsyncGroq, APIConnectionError, APIStatusError
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMProviderError(Exception):
+    """Respuesta de error HTTP del backend de LLM"""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LLMConnectionError(Exception):
+    """Fallo de red o timeout hablando con el backend de LLM"""
+
+
+def _parse_retry_after(headers: Optional[httpx.Headers]) -> Optional[float]:
+    """Lee retry-after (segundos) de las cabeceras de una respuesta"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TextStream:
+    """
+    Iterador (síncrono o asíncrono) de fragmentos de texto de un stream
+
+    El proveedor rellena `usage` cuando llega el último chunk, así que solo
+    está completo después de consumir el stream.
+    """
+
+    def __init__(self, chunks: Callable[["TextStream"], Any]):
+        """
+        Args:
+            chunks: Función que recibe este TextStream y devuelve el generador de texto
+        """
+        self.usage: Dict[str, Any] = {}
+        self._chunks = chunks(self)
+
+    def __iter__(self) -> Iterator[str]:
+        return self._chunks
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._chunks
+
+
+class LLMProvider(ABC):
+    """
+    Interfaz de un backend de chat completions
+
+    Las peticiones son dicts con model, messages, temperature y max_tokens.
+    Las respuestas completas se devuelven como {"content": str, "usage": dict}.
+    Los métodos de streaming abren la conexión al ser esperados (así los
+    reintentos cubren la apertura) y devuelven un TextStream de fragmentos.
+    """
+
+    name: str = "base"
+
+    @abstractmethod
+    def complete(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Chat completion síncrona"""
+
+    @abstractmethod
+    async def complete_async(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Chat completion asíncrona"""
+
+    @abstractmethod
+    def open_stream(self, request: Dict[str, Any]) -> TextStream:
+        """Abre un stream síncrono de fragmentos de texto"""
+
+    @abstractmethod
+    async def open_stream_async(self, request: Dict[str, Any]) -> TextStream:
+        """Abre un stream asíncrono de fragmentos de texto"""
+
+    async def close(self):
+        """Libera conexiones del proveedor"""
+
+
+class GroqProvider(LLMProvider):
+    """Backend basado en el SDK oficial de Groq"""
+
+    name = "groq"
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: Optional[str] = None,
+        client: Optional[Groq] = None,
+        async_client: Optional[AsyncGroq] = None
+    ):
+        """
+        Args:
+            api_key: API key de Groq
+            base_url: URL base alternativa (opcional)
+            client: Cliente síncrono ya construido (opcional)
+            async_client: Cliente asíncrono ya construido (opcional)
+        """
+        api_key = api_key or settings.GROQ_API_KEY
+
+        # Los reintentos los gestiona LLMService (backoff + retry-after),
+        # no el SDK, para que pasen por el limitador y las métricas
+        self.client = client or Groq(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=settings.GROQ_TIMEOUT,
+            max_retries=0
+        )
+        self.async_client = async_client or AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=settings.GROQ_TIMEOUT,
+            max_retries=0,
+            http_client=_pooled_async_client()
+        )
+
+    def _translate(self, error: Exception) -> Exception:
+        if isinstance(error, APIStatusError):
+            return LLMProviderError(
+                str(error),
+                status_code=error.status_code,
+                retry_after=_parse_retry_after(error.response.headers)
+            )
+        if isinstance(error, APIConnectionError):
+            return LLMConnectionError(str(error))
+        return error
+
+    @staticmethod
+    def _to_result(response: Any) -> Dict[str, Any]:
+        usage = response.usage.model_dump() if getattr(response, "usage", None) else {}
+        return {"content": response.choices[0].message.content, "usage": usage}
+
+    def complete(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return self._to_result(self.client.chat.completions.create(**request))
+        except Exception as e:
+            raise self._translate(e) from e
+
+    async def complete_async(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return self._to_result(await self.async_client.chat.completions.create(**request))
+        except Exception as e:
+            raise self._translate(e) from e
+
+    @staticmethod
+    def _chunk_usage(chunk: Any) -> Optional[Dict[str, Any]]:
+        """Groq envía el usage en x_groq del último chunk"""
+        x_groq = getattr(chunk, "x_groq", None)
+        if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+            return x_groq.usage.model_dump()
+        return None
+
+    def open_stream(self, request: Dict[str, Any]) -> TextStream:
+        try:
+            stream = self.client.chat.completions.create(**request, stream=True)
+        except Exception as e:
+            raise self._translate(e) from e
+
+        def chunks(text_stream: TextStream):
+            for chunk in stream:
+                text_stream.usage = self._chunk_usage(chunk) or text_stream.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        return TextStream(chunks)
+
+    async def open_stream_async(self, request: Dict[str, Any]) -> TextStream:
+        try:
+            stream = await self.async_client.chat.completions.create(**request, stream=True)
+        except Exception as e:
+            raise self._translate(e) from e
+
+        async def chunks(text_stream: TextStream):
+            async for chunk in stream:
+                text_stream.usage = self._chunk_usage(chunk) or text_stream.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        return TextStream(chunks)
+
+    async def close(self):
+        await self.async_client.close()
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Backend HTTP para cualquier API compatible con OpenAI /chat/completions"""
+
+    name = "openai"
+
+    def __init__(
+        self,
+        base_url: str = None,
+        api_key: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        """
+        Args:
+            base_url: URL base que termina antes de /chat/completions
+                (p. ej. http://localhost:9000/v1)
+            api_key: Token Bearer (opcional)
+            transport: Transporte httpx asíncrono alternativo (tests)
+        """
+        self.base_url = (base_url or settings.LLM_BASE_URL).rstrip("/")
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+        self.client = httpx.Client(
+            base_url=self.base_url,
+            headers=headers,
+            timeout=settings.GROQ_TIMEOUT
+        )
+        self.async_client = _pooled_async_client(
+            base_url=self.base_url,
+            headers=headers,
+            transport=transport
+        )
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response):
+        if response.status_code >= 400:
+            raise LLMProviderError(
+                f"HTTP {response.status_code} desde el backend de LLM",
+                status_code=response.status_code,
+                retry_after=_parse_retry_after(response.headers)
+            )
+
+    @staticmethod
+    def _to_result(payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "content": payload["choices"][0]["message"]["content"],
+            "usage": payload.get("usage") or {}
+        }
+
+    @staticmethod
+    def _parse_sse_line(line: str, text_stream: TextStream) -> Optional[str]:
+        """
+        Extrae el texto de una línea SSE `data: {...}`; None si no aporta
+
+        El usage llega en el último chunk: en `usage` (OpenAI con
+        stream_options) o en `x_groq.usage` (Groq); se guarda en text_stream.
+        """
+        if not line.startswith("data:"):
+            return None
+        data = line[len("data:"):].strip()
+        if not data or data == "[DONE]":
+            return None
+
+        payload = json.loads(data)
+        usage = payload.get("usage") or (payload.get("x_groq") or {}).get("usage")
+        if usage:
+            text_stream.usage = usage
+
+        choices = payload.get("choices") or []
+        if not choices:
+            return None
+        return (choices[0].get("delta") or {}).get("content") or None
+
+    def complete(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = self.client.post("/chat/completions", json=request)
+        except httpx.TransportError as e:
+            raise LLMConnectionError(str(e)) from e
+        self._raise_for_status(response)
+        return self._to_result(response.json())
+
+    async def complete_async(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = await self.async_client.post("/chat/completions", json=request)
+        except httpx.TransportError as e:
+            raise LLMConnectionError(str(e)) from e
+        self._raise_for_status(response)
+        return self._to_result(response.json())
+
+    def open_stream(self, request: Dict[str, Any]) -> TextStream:
+        try:
+            response = self.client.send(
+                self.client.build_request("POST", "/chat/completions", json={**request, "stream": True}),
+                stream=True
+            )
+        except httpx.TransportError as e:
+            raise LLMConnectionError(str(e)) from e
+
+        if response.status_code >= 400:
+            response.close()
+            self._raise_for_status(response)
+
+        def chunks(text_stream: TextStream):
+            try:
+                for line in response.iter_lines():
+                    text = self._parse_sse_line(line, text_stream)
+                    if text:
+                        yield text
+            finally:
+                response.close()
+
+        return TextStream(chunks)
+
+    async def open_stream_async(self, request: Dict[str, Any]) -> TextStream:
+        try:
+            response = await self.async_client.send(
+                self.async_client.build_request("POST", "/chat/completions", json={**request, "stream": True}),
+                stream=True
+            )
+        except httpx.TransportError as e:
+            raise LLMConnectionError(str(e)) from e
+
+        if response.status_code >= 400:
+            await response.aclose()
+            self._raise_for_status(response)
+
+        async def chunks(text_stream: TextStream):
+            try:
+                async for line in response.aiter_lines():
+                    text = self._parse_sse_line(line, text_stream)
+                    if text:
+                        yield text
+            finally:
+                await response.aclose()
+
+        return TextStream(chunks)
+
+    async def close(self):
+        await self.async_client.aclose()
+        self.client.close()
+
+
+def _pooled_async_client(**kwargs) -> httpx.AsyncClient:
+    """
+    Cliente httpx asíncrono con pool de conexiones keep-alive
+
+    Las peticiones concurrentes al LLM no bloquean el event loop y escalan
+    con el tamaño del pool.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.GROQ_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GROQ_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.GROQ_KEEPALIVE_EXPIRY
+        ),
+        timeout=settings.GROQ_TIMEOUT,
+        **kwargs
+    )
+
+
+def create_provider(name: Optional[str] = None) -> LLMProvider:
+    """
+    Construye el proveedor configurado en LLM_PROVIDER
+
+    Args:
+        name: "groq" u "openai" (usa settings.LLM_PROVIDER si no se indica)
+
+    Returns:
+        Instancia del proveedor
+    """
+    name = (name or settings.LLM_PROVIDER).lower()
+
+    if name == "groq":
+        return GroqProvider(base_url=settings.LLM_BASE_URL or None)
+    if name == "openai":
+        if not settings.LLM_BASE_URL:
+            raise ValueError("LLM_PROVIDER=openai requiere LLM_BASE_URL")
+        return OpenAICompatibleProvider(
+            base_url=settings.LLM_BASE_URL,
+            api_key=settings.LLM_API_KEY or None
+        )
+
+    raise ValueError(f"Proveedor de LLM no soportado: {name}")
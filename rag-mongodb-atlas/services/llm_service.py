@@ -1,39 +1,90 @@
 """
 Servicio de integración con Groq API para generación de texto
 """
-from groq import Groq
-from typing import List, Dict, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple, Callable
+from collections import deque
+import asyncio
 import logging
+import random
+import time
 
 from config.settings import settings
+from services.llm_providers import (
+    LLMProvider,
+    LLMProviderError,
+    LLMConnectionError,
+    create_provider
+)
+from services.model_router import ModelRouter, EXPLICIT_ROUTE
+from services.usage_tracker import usage_tracker
+from utils.helpers import split_sentences
+from utils.rate_limiter import RateLimiter
+from utils.tokens import count_tokens, tokenizer_name, truncate_to_tokens
 
 logger = logging.getLogger(__name__)
 
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMRateLimitError(Exception):
+    """El LLM sigue limitando la tasa después de agotar los reintentos"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
 
 class LLMService:
     """Servicio para interactuar con Groq API"""
 
-    def __init__(self):
-        """Inicializa el cliente de Groq"""
-        self.client = None
-        self._initialize_client()
+    def __init__(self, provider: Optional[LLMProvider] = None):
+        """
+        Inicializa el proveedor de LLM, el limitador y las métricas
+
+        Args:
+            provider: Backend de LLM (por defecto el de settings.LLM_PROVIDER)
+        """
+        self.provider = provider
+        self.limiter = RateLimiter(settings.GROQ_RPM_LIMIT, settings.GROQ_TPM_LIMIT)
+        self.router = ModelRouter()
+        self._latencies = deque(maxlen=500)
+        self.metrics = {
+            "requests": 0,
+            "failures": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "hedged": 0,
+            "hedge_wins": 0
+        }
+        if self.provider is None:
+            self._initialize_client()
 
     def _initialize_client(self):
-        """Inicializa el cliente de Groq"""
+        """Crea el proveedor configurado (Groq o compatible con OpenAI)"""
         try:
-            self.client = Groq(api_key=settings.GROQ_API_KEY)
-            logger.info("✅ Cliente Groq inicializado")
+            self.provider = create_provider()
+            logger.info(
+                f"✅ Cliente LLM inicializado: {self.provider.name} "
+                f"(pool async: {settings.GROQ_MAX_CONNECTIONS} conexiones)"
+            )
         except Exception as e:
-            logger.error(f"❌ Error inicializando Groq: {e}")
+            logger.error(f"❌ Error inicializando el cliente LLM: {e}")
             raise
 
+    async def close(self):
+        """Cierra el pool de conexiones del proveedor"""
+        if self.provider:
+            await self.provider.close()
+
     def generate_response(
         self,
         prompt: str,
         system_message: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: int = 1024,
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        task: Optional[str] = None,
+        retrieval_confidence: Optional[float] = None
     ) -> str:
         """
         Genera una respuesta usando Groq
@@ -43,40 +94,409 @@ class LLMService:
             system_message: Mensaje de sistema (opcional)
             temperature: Temperatura del modelo (0-2)
             max_tokens: Máximo de tokens a generar
-            model: Modelo a usar (usa el default si no se especifica)
+            model: Modelo a usar (si se omite, lo elige el enrutador)
+            task: Tipo de tarea para el enrutado (rag, format, summary...)
+            retrieval_confidence: Score vectorial del mejor documento (tareas RAG)
 
         Returns:
             Respuesta generada por el modelo
         """
         try:
-            messages = []
+            messages = self._build_messages(prompt, system_message)
+            route, model_to_use = self._select_model(model, task, messages, retrieval_confidence)
+
+            request = {
+                "model": model_to_use,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            }
+
+            start = time.perf_counter()
+            try:
+                result = self._call_with_retries(
+                    lambda: self.provider.complete(request),
+                    self._estimate_tokens(messages, max_tokens)
+                )
+            except Exception:
+                self.router.record(route, model_to_use, time.perf_counter() - start, failed=True)
+                raise
+
+            self._record_usage(route, model_to_use, task, time.perf_counter() - start, result.get("usage"))
+            return result["content"]
 
-            if system_message:
-                messages.append({
-                    "role": "system",
-                    "content": system_message
-                })
+        except Exception as e:
+            logger.error(f"Error generando respuesta: {e}")
+            raise
 
-            messages.append({
-                "role": "user",
-                "content": prompt
-            })
+    def generate_response_stream(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        model: Optional[str] = None,
+        task: Optional[str] = None,
+        retrieval_confidence: Optional[float] = None
+    ) -> Iterator[str]:
+        """
+        Genera una respuesta en streaming (stream=True), fragmento a fragmento
 
-            model_to_use = model or settings.GROQ_MODEL
+        Args:
+            prompt: Prompt del usuario
+            system_message: Mensaje de sistema (opcional)
+            temperature: Temperatura del modelo (0-2)
+            max_tokens: Máximo de tokens a generar
+            model: Modelo a usar (si se omite, lo elige el enrutador)
+            task: Tipo de tarea para el enrutado (rag, format, summary...)
+            retrieval_confidence: Score vectorial del mejor documento (tareas RAG)
 
-            response = self.client.chat.completions.create(
-                model=model_to_use,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
+        Yields:
+            Fragmentos de texto a medida que Groq los produce
+        """
+        try:
+            messages = self._build_messages(prompt, system_message)
+            route, model_to_use = self._select_model(model, task, messages, retrieval_confidence)
+            start = time.perf_counter()
+
+            # Solo se reintenta la apertura del stream, nunca a mitad de respuesta
+            stream = self._call_with_retries(
+                lambda: self.provider.open_stream({
+                    "model": model_to_use,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                }),
+                self._estimate_tokens(messages, max_tokens)
             )
 
-            return response.choices[0].message.content
+            for text in stream:
+                yield text
+
+            self._record_usage(route, model_to_use, task, time.perf_counter() - start, stream.usage)
+
+        except Exception as e:
+            logger.error(f"Error generando respuesta en streaming: {e}")
+            raise
+
+    async def generate_response_async(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        model: Optional[str] = None,
+        task: Optional[str] = None,
+        retrieval_confidence: Optional[float] = None
+    ) -> str:
+        """
+        Versión asíncrona de generate_response() para las rutas de la API
+
+        Args:
+            prompt: Prompt del usuario
+            system_message: Mensaje de sistema (opcional)
+            temperature: Temperatura del modelo (0-2)
+            max_tokens: Máximo de tokens a generar
+            model: Modelo a usar (si se omite, lo elige el enrutador)
+            task: Tipo de tarea para el enrutado (rag, format, summary...)
+            retrieval_confidence: Score vectorial del mejor documento (tareas RAG)
+
+        Returns:
+            Respuesta generada por el modelo
+        """
+        try:
+            messages = self._build_messages(prompt, system_message)
+            route, model_to_use = self._select_model(model, task, messages, retrieval_confidence)
+
+            request = {
+                "model": model_to_use,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            }
+            estimated_tokens = self._estimate_tokens(messages, max_tokens)
+
+            start = time.perf_counter()
+            try:
+                result = await self._call_with_retries_async(
+                    lambda: self._create_hedged(request, estimated_tokens),
+                    estimated_tokens
+                )
+            except Exception:
+                self.router.record(route, model_to_use, time.perf_counter() - start, failed=True)
+                raise
+
+            self._record_usage(route, model_to_use, task, time.perf_counter() - start, result.get("usage"))
+            return result["content"]
 
         except Exception as e:
             logger.error(f"Error generando respuesta: {e}")
             raise
 
+    async def generate_response_stream_async(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        model: Optional[str] = None,
+        task: Optional[str] = None,
+        retrieval_confidence: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """
+        Versión asíncrona de generate_response_stream()
+
+        Args:
+            prompt: Prompt del usuario
+            system_message: Mensaje de sistema (opcional)
+            temperature: Temperatura del modelo (0-2)
+            max_tokens: Máximo de tokens a generar
+            model: Modelo a usar (si se omite, lo elige el enrutador)
+            task: Tipo de tarea para el enrutado (rag, format, summary...)
+            retrieval_confidence: Score vectorial del mejor documento (tareas RAG)
+
+        Yields:
+            Fragmentos de texto a medida que Groq los produce
+        """
+        try:
+            messages = self._build_messages(prompt, system_message)
+            route, model_to_use = self._select_model(model, task, messages, retrieval_confidence)
+            start = time.perf_counter()
+
+            # Solo se reintenta la apertura del stream, nunca a mitad de respuesta
+            stream = await self._call_with_retries_async(
+                lambda: self.provider.open_stream_async({
+                    "model": model_to_use,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                }),
+                self._estimate_tokens(messages, max_tokens)
+            )
+
+            async for text in stream:
+                yield text
+
+            self._record_usage(route, model_to_use, task, time.perf_counter() - start, stream.usage)
+
+        except Exception as e:
+            logger.error(f"Error generando respuesta en streaming: {e}")
+            raise
+
+    def _select_model(
+        self,
+        model: Optional[str],
+        task: Optional[str],
+        messages: List[Dict[str, str]],
+        retrieval_confidence: Optional[float]
+    ) -> Tuple[str, str]:
+        """Ruta y modelo de una petición (un modelo explícito tiene prioridad)"""
+        if model:
+            return EXPLICIT_ROUTE, model
+
+        prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+        return self.router.route(task, prompt_tokens, retrieval_confidence)
+
+    def _record_usage(
+        self,
+        route: str,
+        model: str,
+        task: Optional[str],
+        elapsed: float,
+        usage: Optional[Dict[str, Any]]
+    ):
+        """Registra una llamada terminada en las métricas de ruta y de consumo"""
+        self.router.record(route, model, elapsed, usage)
+        usage_tracker.record(model, usage, elapsed, task=task)
+
+    def _estimate_tokens(self, messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Tokens que consumirá una petición en el peor caso (prompt + max_tokens)"""
+        return sum(count_tokens(message["content"]) for message in messages) + max_tokens
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Segundos a esperar antes de reintentar, o None si el error no es transitorio
+
+        Usa backoff exponencial con jitter completo y nunca espera menos de lo
+        que indique la cabecera retry-after del backend.
+
+        Args:
+            error: Excepción de la llamada
+            attempt: Número de intento (0 = primera llamada)
+        """
+        if isinstance(error, LLMProviderError):
+            if error.status_code not in RETRYABLE_STATUS_CODES:
+                return None
+        elif not isinstance(error, LLMConnectionError):
+            return None
+
+        backoff = min(settings.GROQ_BACKOFF_MAX, settings.GROQ_BACKOFF_BASE * (2 ** attempt))
+        delay = random.uniform(0, backoff)
+
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        return delay
+
+    def _record_failure(self, error: Exception, attempt: int, delay: Optional[float]):
+        """Actualiza métricas de un intento fallido y decide si se abandona"""
+        if getattr(error, "status_code", None) == 429:
+            self.metrics["rate_limited"] += 1
+
+        if delay is None or attempt >= settings.GROQ_MAX_RETRIES:
+            self.metrics["failures"] += 1
+            if getattr(error, "status_code", None) == 429:
+                raise LLMRateLimitError(
+                    f"Límite de tasa del LLM tras {attempt + 1} intentos",
+                    retry_after=error.retry_after
+                ) from error
+            raise error
+
+        self.metrics["retries"] += 1
+        logger.warning(f"LLM: intento {attempt + 1} fallido ({error}), reintentando en {delay:.2f}s")
+
+    def _call_with_retries(self, call: Callable[[], Any], estimated_tokens: int) -> Any:
+        """
+        Ejecuta una llamada síncrona al LLM con limitador y reintentos
+
+        Args:
+            call: Función que realiza la petición
+            estimated_tokens: Tokens reservados en el limitador
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire_sync(estimated_tokens)
+            self.metrics["requests"] += 1
+            start = time.perf_counter()
+            try:
+                response = call()
+                self._record_success(response, estimated_tokens, time.perf_counter() - start)
+                return response
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                self._record_failure(e, attempt, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    async def _call_with_retries_async(self, call: Callable[[], Any], estimated_tokens: int) -> Any:
+        """
+        Versión asíncrona de _call_with_retries()
+
+        Args:
+            call: Función que retorna la corrutina de la petición
+            estimated_tokens: Tokens reservados en el limitador
+        """
+        attempt = 0
+        while True:
+            await self.limiter.acquire(estimated_tokens)
+            self.metrics["requests"] += 1
+            start = time.perf_counter()
+            try:
+                response = await call()
+                self._record_success(response, estimated_tokens, time.perf_counter() - start)
+                return response
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                self._record_failure(e, attempt, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def _record_success(self, result: Any, estimated_tokens: int, elapsed: float):
+        """Registra la latencia y devuelve al limitador los tokens no usados"""
+        if not isinstance(result, dict):
+            # Streams: la latencia de apertura no es comparable ni hay usage
+            return
+
+        self._latencies.append(elapsed)
+        total_tokens = (result.get("usage") or {}).get("total_tokens")
+        if total_tokens is not None:
+            self.limiter.refund(estimated_tokens - total_tokens)
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Latencia p95 observada, o None si el hedging no aplica todavía"""
+        if not settings.GROQ_HEDGE_ENABLED or len(self._latencies) < settings.GROQ_HEDGE_MIN_SAMPLES:
+            return None
+        return self._percentile(0.95)
+
+    def _percentile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    async def _create_hedged(self, request: Dict[str, Any], estimated_tokens: int) -> Any:
+        """
+        Petición con cobertura: si no responde en el p95, se lanza un duplicado
+
+        Gana la primera respuesta correcta y la otra se cancela, devolviendo
+        al limitador su reserva. El duplicado solo se envía si el limitador
+        tiene capacidad inmediata, de modo que la cobertura nunca provoca
+        esperas por limitación.
+
+        Args:
+            request: Petición de chat completions
+            estimated_tokens: Tokens a reservar para el duplicado
+        """
+        primary = asyncio.ensure_future(self.provider.complete_async(request))
+        delay = self._hedge_delay()
+
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.limiter.try_acquire(estimated_tokens):
+            return await primary
+
+        self.metrics["hedged"] += 1
+        hedge = asyncio.ensure_future(self.provider.complete_async(request))
+        pending = {primary, hedge}
+        first_error = None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.metrics["hedge_wins"] += 1
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in pending:
+                task.cancel()
+                # Ambas reservas son de estimated_tokens: se devuelve la del perdedor
+                self.limiter.refund(estimated_tokens, requests=1)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas del cliente: peticiones, reintentos, limitación y latencia"""
+        p50, p95 = self._percentile(0.5), self._percentile(0.95)
+        return {
+            **self.metrics,
+            **self.limiter.stats(),
+            "latency_p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+            "routes": self.router.stats()
+        }
+
+    def _build_messages(self, prompt: str, system_message: Optional[str] = None) -> List[Dict[str, str]]:
+        """Construye la lista de mensajes para chat completions"""
+        messages = []
+
+        if system_message:
+            messages.append({
+                "role": "system",
+                "content": system_message
+            })
+
+        messages.append({
+            "role": "user",
+            "content": prompt
+        })
+
+        return messages
+
     def generate_rag_response(
         self,
         question: str,
@@ -97,54 +517,246 @@ class LLMService:
             Respuesta generada
         """
         try:
-            # Construir contexto
-            context_text = self._build_context(context_documents)
-
-            # System message para RAG
-            system_message = (
-                "Eres un asistente útil que responde preguntas basándose "
-                "en el contexto proporcionado. Si la respuesta no está en "
-                "el contexto, indícalo claramente. No inventes información."
+            rag_prompt = self.build_rag_prompt(question, context_documents)
+
+            return self.generate_response(
+                prompt=rag_prompt["user"],
+                system_message=rag_prompt["system"],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                task="rag"
             )
 
-            # Prompt con contexto
-            prompt = f"""Contexto:
-{context_text}
+        except Exception as e:
+            logger.error(f"Error generando respuesta RAG: {e}")
+            raise
 
-Pregunta: {question}
+    async def generate_rag_response_async(
+        self,
+        question: str,
+        context_documents: List[Dict],
+        temperature: float = 0.7,
+        max_tokens: int = 1024
+    ) -> str:
+        """
+        Versión asíncrona de generate_rag_response()
 
-Respuesta basada en el contexto:"""
+        Args:
+            question: Pregunta del usuario
+            context_documents: Documentos de contexto
+            temperature: Temperatura del modelo
+            max_tokens: Tokens máximos
 
-            return self.generate_response(
-                prompt=prompt,
-                system_message=system_message,
+        Returns:
+            Respuesta generada
+        """
+        try:
+            rag_prompt = self.build_rag_prompt(question, context_documents)
+
+            return await self.generate_response_async(
+                prompt=rag_prompt["user"],
+                system_message=rag_prompt["system"],
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                task="rag"
             )
 
         except Exception as e:
             logger.error(f"Error generando respuesta RAG: {e}")
             raise
 
-    def _build_context(self, documents: List[Dict]) -> str:
+    def build_rag_prompt(
+        self,
+        question: str,
+        context_documents: List[Dict],
+        token_budget: Optional[int] = None,
+        conversation_history: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
-        Construye el contexto a partir de documentos
+        Construye los mensajes de sistema y usuario para una consulta RAG
+
+        Args:
+            question: Pregunta del usuario
+            context_documents: Documentos de contexto
+            token_budget: Tokens máximos de contexto (CONTEXT_TOKEN_BUDGET por defecto)
+            conversation_history: Historial acotado de la conversación (opcional)
+
+        Returns:
+            Dict con system y user prompts y las estadísticas del empaquetado
+        """
+        # Construir contexto
+        context_text, context_stats = self._build_context(context_documents, token_budget)
+
+        # System message para RAG
+        system_message = (
+            "Eres un asistente útil que responde preguntas basándose "
+            "en el contexto proporcionado. Si la respuesta no está en "
+            "el contexto, indícalo claramente. No inventes información."
+        )
+
+        # Prompt con contexto
+        prompt = f"""Contexto:
+{context_text}
+
+Pregunta: {question}
+
+Respuesta basada en el contexto:"""
+
+        if conversation_history:
+            prompt = f"Historial de la conversación:\n{conversation_history}\n\n{prompt}"
+
+        return {
+            "system": system_message,
+            "user": prompt,
+            "context_stats": context_stats
+        }
+
+    def _build_context(
+        self,
+        documents: List[Dict],
+        token_budget: Optional[int] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Construye el contexto a partir de documentos, dentro de un presupuesto de tokens
+
+        El presupuesto se reparte en proporción al score de recuperación; un
+        documento que necesita menos que su parte cede el sobrante al resto.
+        El contenido se recorta en límites de oración; si ni la primera
+        oración cabe en su parte, se corta esa oración en lugar de perder el
+        documento. Solo se descarta un documento cuya parte no alcanza ni
+        para el título.
 
         Args:
             documents: Lista de documentos
+            token_budget: Tokens máximos (0 = sin límite)
 
         Returns:
-            Texto de contexto formateado
+            Tupla (texto de contexto formateado, estadísticas del empaquetado)
         """
-        context_parts = []
+        budget = settings.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
 
-        for i, doc in enumerate(documents, 1):
+        entries = []
+        for doc in documents:
             title = doc.get("title", "Sin título")
             content = doc.get("content", "")
+            header_tokens = count_tokens(f"[Documento {len(documents)}] {title}\n")
+            entries.append({
+                "title": title,
+                "content": content,
+                "score": doc.get("score", 0) or 0,
+                "header_tokens": header_tokens,
+                "tokens": header_tokens + count_tokens(content)
+            })
+
+        original_tokens = sum(entry["tokens"] for entry in entries)
+        packed_contents: List[Optional[str]] = [entry["content"] for entry in entries]
+        truncated = 0
+
+        if budget and original_tokens > budget:
+            remaining = budget
+            pending = sorted(range(len(entries)), key=lambda i: entries[i]["score"], reverse=True)
+
+            while pending:
+                shares = self._allocate_token_budget(
+                    [entries[i]["tokens"] for i in pending],
+                    [max(entries[i]["score"], 1e-6) for i in pending],
+                    remaining
+                )
+                idx = pending.pop(0)
+                entry = entries[idx]
+
+                if shares[0] >= entry["tokens"]:
+                    remaining -= entry["tokens"]
+                    continue
+
+                # Recortar por oraciones completas hasta agotar su parte
+                content_budget = shares[0] - entry["header_tokens"]
+                sentences = split_sentences(entry["content"])
+                kept, used = [], 0
+                for sentence in sentences:
+                    sentence_tokens = count_tokens(sentence)
+                    if used + sentence_tokens > content_budget:
+                        break
+                    kept.append(sentence)
+                    used += sentence_tokens
+
+                if not kept and sentences:
+                    head = truncate_to_tokens(sentences[0], content_budget)
+                    if head:
+                        kept, used = [head], count_tokens(head)
+
+                if kept:
+                    packed_contents[idx] = " ".join(kept)
+                    remaining -= entry["header_tokens"] + used
+                    truncated += 1
+                else:
+                    packed_contents[idx] = None
 
-            context_parts.append(f"[Documento {i}] {title}\n{content}")
+        context_parts = []
+        packed_tokens = 0
+        for entry, content in zip(entries, packed_contents):
+            if content is None:
+                continue
+            part = f"[Documento {len(context_parts) + 1}] {entry['title']}\n{content}"
+            context_parts.append(part)
+            packed_tokens += count_tokens(part)
+
+        dropped_documents = sum(1 for content in packed_contents if content is None)
+        stats = {
+            "token_budget": budget,
+            "tokenizer": tokenizer_name(),
+            "original_tokens": original_tokens,
+            "packed_tokens": packed_tokens,
+            "dropped_tokens": max(0, original_tokens - packed_tokens),
+            "documents_packed": len(context_parts),
+            "documents_truncated": truncated,
+            "documents_dropped": dropped_documents
+        }
+
+        return "\n\n".join(context_parts), stats
+
+    def _allocate_token_budget(
+        self,
+        needs: List[int],
+        weights: List[float],
+        budget: int
+    ) -> List[int]:
+        """
+        Reparte un presupuesto de tokens en proporción a los pesos
 
-        return "\n\n".join(context_parts)
+        Los elementos que necesitan menos que su parte reciben solo lo que
+        necesitan y el sobrante se redistribuye entre los demás.
+
+        Args:
+            needs: Tokens que necesita cada elemento completo
+            weights: Peso de cada elemento (score de recuperación)
+            budget: Tokens disponibles
+
+        Returns:
+            Tokens asignados a cada elemento
+        """
+        allocation = [0] * len(needs)
+        active = list(range(len(needs)))
+        remaining = max(budget, 0)
+
+        while active:
+            total_weight = sum(weights[i] for i in active)
+            satisfied = [
+                i for i in active
+                if needs[i] <= remaining * weights[i] / total_weight
+            ]
+
+            if not satisfied:
+                for i in active:
+                    allocation[i] = int(remaining * weights[i] / total_weight)
+                break
+
+            for i in satisfied:
+                allocation[i] = needs[i]
+                remaining -= needs[i]
+            active = [i for i in active if i not in satisfied]
+
+        return allocation
 
     def generate_summary(
         self,
@@ -167,7 +779,8 @@ Respuesta basada en el contexto:"""
             return self.generate_response(
                 prompt=prompt,
                 temperature=0.5,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                task="summary"
             )
 
         except Exception as e:
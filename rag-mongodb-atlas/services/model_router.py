@@ -0,0 +1,125 @@
+"""
+Enrutado entre un modelo rápido y uno grande según la tarea
+
+Las tareas mecánicas (formatear resultados, resumir el historial, reescribir
+una pregunta) van al modelo rápido. La síntesis RAG va al rápido solo si el
+prompt es corto y la recuperación es fiable; el resto, al modelo grande.
+Cada ruta lleva sus métricas de latencia y tokens para verificar el ahorro.
+"""
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+import logging
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+FAST_ROUTE = "fast"
+LARGE_ROUTE = "large"
+EXPLICIT_ROUTE = "explicit"
+
+
+def _parse_tasks(value: str) -> set:
+    return {task.strip() for task in value.split(",") if task.strip()}
+
+
+class ModelRouter:
+    """Elige modelo por tarea, tamaño del prompt y confianza de la recuperación"""
+
+    def __init__(self):
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def route(
+        self,
+        task: Optional[str],
+        prompt_tokens: int,
+        retrieval_confidence: Optional[float] = None
+    ) -> Tuple[str, str]:
+        """
+        Decide la ruta de una petición
+
+        Args:
+            task: Tipo de tarea (rag, format, summary, rewrite, query_plan...)
+            prompt_tokens: Tokens del prompt
+            retrieval_confidence: Score vectorial del mejor documento (0-1)
+
+        Returns:
+            Tupla (ruta, modelo)
+        """
+        if not settings.MODEL_ROUTING_ENABLED or not task:
+            return LARGE_ROUTE, settings.GROQ_MODEL
+
+        if task in _parse_tasks(settings.ROUTING_FAST_TASKS):
+            return FAST_ROUTE, settings.GROQ_FAST_MODEL
+
+        if task in _parse_tasks(settings.ROUTING_CONFIDENCE_TASKS):
+            short_prompt = prompt_tokens <= settings.ROUTING_FAST_MAX_PROMPT_TOKENS
+            confident = (
+                retrieval_confidence is not None
+                and retrieval_confidence >= settings.ROUTING_FAST_MIN_CONFIDENCE
+            )
+            if short_prompt and confident:
+                return FAST_ROUTE, settings.GROQ_FAST_MODEL
+
+        return LARGE_ROUTE, settings.GROQ_MODEL
+
+    def record(
+        self,
+        route: str,
+        model: str,
+        elapsed: float,
+        usage: Optional[Dict[str, Any]] = None,
+        failed: bool = False
+    ):
+        """
+        Registra una llamada en las métricas de su ruta
+
+        Args:
+            route: Ruta elegida
+            model: Modelo usado
+            elapsed: Segundos de la llamada
+            usage: Uso de tokens devuelto por el proveedor
+            failed: La llamada terminó en error
+        """
+        stats = self._routes.setdefault(route, {
+            "calls": 0,
+            "failures": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "models": {},
+            "latencies": deque(maxlen=500)
+        })
+
+        stats["calls"] += 1
+        stats["models"][model] = stats["models"].get(model, 0) + 1
+        if failed:
+            stats["failures"] += 1
+            return
+
+        stats["latencies"].append(elapsed)
+        usage = usage or {}
+        stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        stats["completion_tokens"] += usage.get("completion_tokens") or 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas por ruta: llamadas, modelos, tokens y latencia"""
+        result = {}
+        for route, stats in self._routes.items():
+            latencies = sorted(stats["latencies"])
+
+            def percentile(q: float) -> Optional[float]:
+                if not latencies:
+                    return None
+                return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2)
+
+            result[route] = {
+                "calls": stats["calls"],
+                "failures": stats["failures"],
+                "models": dict(stats["models"]),
+                "prompt_tokens": stats["prompt_tokens"],
+                "completion_tokens": stats["completion_tokens"],
+                "latency_avg_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+                "latency_p50_ms": percentile(0.5),
+                "latency_p95_ms": percentile(0.95)
+            }
+        return result
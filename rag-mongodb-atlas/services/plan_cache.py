@@ -0,0 +1,406 @@
+"""
+Caché de planes de /api/query como plantillas parametrizadas
+
+Preguntas que solo difieren en un valor ("ventas de marzo" / "ventas de
+abril") comparten plan. De la pregunta se extraen los literales (meses, años,
+números y textos entre comillas) y la clave es la pregunta normalizada con
+esos literales sustituidos por su tipo ("ventas de {month}"). Un plan que se
+ejecutó sin error se guarda como plantilla: cada aparición de un literal en
+el plan (p. ej. "^2024-03", "2024-04-01", 10) se sustituye por una ranura.
+Una pregunta con la misma clave reutiliza la plantilla con sus propios
+literales y se ahorra la llamada al LLM que genera el plan.
+
+Solo se guardan plantillas seguras: todos los literales de la pregunta deben
+aparecer en el plan, ningún valor del plan puede corresponder a dos
+literales a la vez y los números solo se parametrizan como operandos de una
+comparación o de $limit (nunca en un $sum, un $sort o una proyección).
+"""
+from calendar import monthrange
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import copy
+import json
+import logging
+import re
+import time
+
+from config.settings import settings
+from services.answer_cache import AnswerCache
+
+logger = logging.getLogger(__name__)
+
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12
+}
+MONTH_NAMES = {number: name for name, number in reversed(MONTHS.items())}
+
+LITERAL_PATTERN = re.compile(
+    r'"(?P<dq>[^"]+)"|“(?P<cq>[^”]+)”|\'(?P<sq>[^\']+)\''
+    r"|\b(?P<month>" + "|".join(MONTHS) + r")\b"
+    r"(?:(?:\s+(?:de|del))?(?:\s+año)?\s+(?P<month_year>(?:19|20)\d{2})\b)?"
+    r"|(?<![\w.,])(?P<year>(?:19|20)\d{2})(?![\w]|[.,]\d)"
+    r"|(?<![\w.,])(?P<number>\d+(?:[.,]\d+)?)(?![\w]|[.,]\d)",
+    re.IGNORECASE
+)
+
+# Operadores cuyo valor se compara con los datos: solo ahí un número de la
+# pregunta puede ser una ranura
+OPERAND_OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin", "$size", "$limit", "$skip")
+
+# Ranura que ocupa un valor completo del plan (conserva el tipo numérico)
+LEAF_SLOT = re.compile(r"^\{\{=(\w+)\}\}$")
+TEXT_SLOT = re.compile(r"\{\{(\w+)\.(\w+)\}\}")
+
+
+def extract_literals(question: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Separa los literales de una pregunta
+
+    Args:
+        question: Pregunta del usuario
+
+    Returns:
+        (plantilla normalizada de la pregunta, literales en orden)
+    """
+    literals: List[Dict[str, Any]] = []
+
+    def replace(match: re.Match) -> str:
+        if match.group("month"):
+            year = match.group("month_year")
+            kind = "month_year" if year else "month"
+            value = {"month": MONTHS[match.group("month").lower()], "year": int(year) if year else None}
+        elif match.group("year"):
+            kind, value = "year", int(match.group("year"))
+        elif match.group("number"):
+            raw = match.group("number").replace(",", ".")
+            kind, value = "number", float(raw) if "." in raw else int(raw)
+        else:
+            kind = "text"
+            value = match.group("dq") or match.group("cq") or match.group("sq")
+
+        literals.append({"slot": f"s{len(literals)}", "kind": kind, "value": value})
+        return f"{{{kind}}}"
+
+    template = LITERAL_PATTERN.sub(replace, question)
+    return AnswerCache.normalize_question(template), literals
+
+
+def _next_month(year: int, month: int) -> Tuple[int, int]:
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _renderings(literal: Dict[str, Any]) -> Tuple[Dict[str, str], Optional[Any]]:
+    """
+    Formas en que un literal puede aparecer en el plan
+
+    Returns:
+        ({forma: texto dentro de strings}, valor que puede ocupar un campo completo)
+    """
+    kind, value = literal["kind"], literal["value"]
+
+    if kind in ("month", "month_year"):
+        year, month = value["year"], value["month"]
+        next_year, next_month = _next_month(year, month)
+        return {
+            "ym": f"{year}-{month:02d}",
+            "start": f"{year}-{month:02d}-01",
+            "end": f"{year}-{month:02d}-{monthrange(year, month)[1]:02d}",
+            "next": f"{next_year}-{next_month:02d}-01",
+            "name": MONTH_NAMES[month]
+        }, None
+
+    if kind == "year":
+        # Un rango de un año termina en el siguiente: [2024-01-01, 2025-01-01)
+        return {"value": str(value), "next": str(value + 1)}, value
+
+    if kind == "number":
+        text = repr(value) if isinstance(value, float) else str(value)
+        return {"value": text}, value
+
+    return {"value": value}, None
+
+
+def _text_pattern(form: str, text: str) -> str:
+    if form == "name":
+        return rf"(?i:\b{re.escape(text)}\b)"
+    if form == "ym":
+        # "2024-03" suelto o como prefijo de regex, no el de una fecha completa
+        return rf"(?<!\d){re.escape(text)}(?!\d)(?!-\d)"
+    if form in ("start", "end", "next") or text.replace(".", "").isdigit():
+        return rf"(?<![\d.]){re.escape(text)}(?!\d)(?!\.\d)"
+    return re.escape(text)
+
+
+class PlanTemplateError(ValueError):
+    """El plan no se puede convertir en una plantilla segura"""
+
+
+def build_template(query_plan: Dict[str, Any], literals: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Convierte un plan en plantilla sustituyendo los literales por ranuras
+
+    Los meses sin año en la pregunta toman el año que eligió el LLM en el
+    plan; ese año queda en la plantilla como valor por defecto.
+
+    Args:
+        query_plan: Plan validado (ya ejecutado sin error)
+        literals: Literales de la pregunta (extract_literals)
+
+    Returns:
+        {"plan": plantilla, "defaults": {ranura: año por defecto}}
+
+    Raises:
+        PlanTemplateError: Si algún literal no aparece en el plan o es ambiguo
+    """
+    serialized = json.dumps(query_plan, ensure_ascii=False)
+    if "{{" in serialized:
+        raise PlanTemplateError("El plan ya contiene marcadores de ranura")
+
+    literals = copy.deepcopy(literals)
+    defaults: Dict[str, int] = {}
+    for literal in literals:
+        if literal["kind"] == "month":
+            month = literal["value"]["month"]
+            found = re.search(rf"(?<!\d)((?:19|20)\d{{2}})-{month:02d}(?!\d)", serialized)
+            if not found:
+                raise PlanTemplateError(f"El mes {month} no aparece en el plan")
+            literal["value"]["year"] = defaults[literal["slot"]] = int(found.group(1))
+
+    text_forms: Dict[str, List[str]] = {}
+    leaf_values: List[Tuple[Any, str]] = []
+    for literal in literals:
+        forms, leaf = _renderings(literal)
+        for form, text in forms.items():
+            text_forms.setdefault(text.lower() if form == "name" else text, []).append(f"{literal['slot']}.{form}")
+        if leaf is not None:
+            leaf_values.append((leaf, literal["slot"]))
+
+    # El más largo primero: "2024-03-01" antes que "2024-03"
+    texts = sorted(text_forms, key=len, reverse=True)
+    patterns = [
+        _text_pattern(text_forms[text][0].split(".")[1], text)
+        for text in texts
+    ]
+    combined = re.compile("|".join(f"({pattern})" for pattern in patterns)) if patterns else None
+    used: set = set()
+
+    def slot_for_text(match: re.Match) -> str:
+        text = texts[match.lastindex - 1]
+        slots = text_forms[text]
+        if len({slot.split(".")[0] for slot in slots}) > 1:
+            raise PlanTemplateError(f"'{text}' corresponde a varios literales")
+        used.add(slots[0])
+        return "{{" + slots[0] + "}}"
+
+    def visit(value: Any, operand: bool = False) -> Any:
+        """operand: el valor se compara con los datos (no es un flag ni un acumulador)"""
+        if isinstance(value, dict):
+            return {
+                key: visit(child, operand=key in OPERAND_OPERATORS)
+                for key, child in value.items()
+            }
+        if isinstance(value, list):
+            return [visit(child, operand) for child in value]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            matches = [slot for leaf, slot in leaf_values if leaf == value]
+            if len(matches) > 1:
+                raise PlanTemplateError(f"{value} corresponde a varios literales")
+            if matches and not operand:
+                # $sum: 1, dirección de $sort, flag de proyección...: cambiarlo
+                # con el literal daría resultados erróneos sin ningún error
+                raise PlanTemplateError(f"{value} aparece fuera de una comparación")
+            if matches:
+                used.add(f"{matches[0]}.value")
+                return "{{=" + matches[0] + "}}"
+            return value
+        if isinstance(value, str) and combined is not None:
+            return combined.sub(slot_for_text, value)
+        return value
+
+    def visit_filter(filter_: Any) -> Any:
+        """Filtro de consulta: el valor de un campo es un operando"""
+        if not isinstance(filter_, dict):
+            return visit(filter_)
+        visited = {}
+        for key, child in filter_.items():
+            if key in ("$and", "$or", "$nor") and isinstance(child, list):
+                visited[key] = [visit_filter(condition) for condition in child]
+            elif key.startswith("$"):
+                visited[key] = visit({key: child})[key]
+            elif isinstance(child, dict) and any(str(op).startswith("$") for op in child):
+                visited[key] = visit(child)
+            else:
+                visited[key] = visit(child, operand=True)
+        return visited
+
+    def visit_stage(stage: Any) -> Any:
+        if not isinstance(stage, dict):
+            return visit(stage)
+        return {
+            key: visit_filter(child) if key == "$match" else visit(child, operand=key in ("$limit", "$skip"))
+            for key, child in stage.items()
+        }
+
+    template = {}
+    for key, value in query_plan.items():
+        if key == "query" and isinstance(value, list):
+            template[key] = [visit_stage(stage) for stage in value]
+        elif key == "query":
+            template[key] = visit_filter(value)
+        else:
+            template[key] = visit(value, operand=key in ("limit", "skip"))
+
+    for literal in literals:
+        slot = literal["slot"]
+        if not any(name.startswith(f"{slot}.") and not name.endswith(".name") for name in used):
+            raise PlanTemplateError(f"El literal {literal['value']} no aparece en el plan")
+        if literal["kind"] in ("month", "month_year"):
+            # Un día concreto del mes que no sea inicio/fin no se puede trasladar
+            residual = _renderings(literal)[0]["ym"]
+            if residual in json.dumps(template, ensure_ascii=False):
+                raise PlanTemplateError(f"El plan usa {residual} de forma no parametrizable")
+
+    return {"plan": template, "defaults": defaults}
+
+
+def fill_template(template: Dict[str, Any], literals: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Instancia una plantilla con los literales de una pregunta nueva
+
+    Args:
+        template: Resultado de build_template
+        literals: Literales de la nueva pregunta (mismos tipos y orden)
+
+    Returns:
+        Plan listo para ejecutar
+    """
+    forms: Dict[str, Dict[str, str]] = {}
+    leaves: Dict[str, Any] = {}
+    for literal in literals:
+        literal = copy.deepcopy(literal)
+        if literal["kind"] == "month":
+            literal["value"]["year"] = template["defaults"][literal["slot"]]
+        forms[literal["slot"]], leaves[literal["slot"]] = _renderings(literal)
+
+    def visit(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {key: visit(child) for key, child in value.items()}
+        if isinstance(value, list):
+            return [visit(child) for child in value]
+        if isinstance(value, str):
+            leaf = LEAF_SLOT.match(value)
+            if leaf:
+                return leaves[leaf.group(1)]
+            return TEXT_SLOT.sub(lambda match: forms[match.group(1)][match.group(2)], value)
+        return value
+
+    return visit(template["plan"])
+
+
+class PlanCache:
+    """Caché LRU con TTL de plantillas de planes de /api/query"""
+
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None):
+        """
+        Args:
+            max_entries: Número máximo de plantillas
+            ttl_seconds: Vida de cada plantilla en segundos
+        """
+        self.max_entries = max_entries or settings.PLAN_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or settings.PLAN_CACHE_TTL_SECONDS
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.uncacheable = 0
+        self.evictions = 0
+        self.failures = 0
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Plan para una pregunta a partir de una plantilla cacheada
+
+        Args:
+            question: Pregunta del usuario
+
+        Returns:
+            Plan instanciado o None si no hay plantilla
+        """
+        if not settings.PLAN_CACHE_ENABLED:
+            return None
+
+        key, literals = extract_literals(question)
+        entry = self._entries.get(key)
+        if entry is None or entry["expires_at"] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return fill_template(entry["template"], literals)
+
+    def store(self, question: str, query_plan: Dict[str, Any]) -> bool:
+        """
+        Guarda un plan validado como plantilla
+
+        Args:
+            question: Pregunta que produjo el plan
+            query_plan: Plan ejecutado sin error
+
+        Returns:
+            True si se guardó
+        """
+        if not settings.PLAN_CACHE_ENABLED:
+            return False
+
+        key, literals = extract_literals(question)
+        try:
+            template = build_template(query_plan, literals)
+        except PlanTemplateError as e:
+            logger.debug(f"Plan no cacheable para '{question}': {e}")
+            self.uncacheable += 1
+            return False
+
+        self._entries[key] = {
+            "template": template,
+            "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        self._entries.move_to_end(key)
+        self.stored += 1
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def discard(self, question: str):
+        """Descarta la plantilla de una pregunta cuyo plan instanciado falló"""
+        key, _ = extract_literals(question)
+        if self._entries.pop(key, None) is not None:
+            self.failures += 1
+
+    def clear(self):
+        """Vacía la caché"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Plantillas, aciertos y planes no parametrizables"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stored": self.stored,
+            "uncacheable": self.uncacheable,
+            "evictions": self.evictions,
+            "failures": self.failures
+        }
+
+
+# Singleton instance
+plan_cache = PlanCache()
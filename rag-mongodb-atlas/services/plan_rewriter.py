@@ -0,0 +1,257 @@
+"""
+Reescritura de filtros de fecha en los planes de /api/query
+
+Las fechas de negocio (ventas.fecha, clientes.fecha_registro...) se guardan
+como fechas BSON, pero el LLM tiende a filtrarlas como texto: un prefijo de
+regex ("^2024-03") o una cadena ISO ("2024-03-01"). Ninguno de los dos
+encuentra fechas BSON, y la regex obliga a comparar cadenas documento a
+documento. Con el esquema inferido (SchemaCache) se sabe qué campos son
+fechas, y cada plan generado se reescribe:
+
+- {"$regex": "^2024-03"} pasa a {"$gte": 2024-03-01, "$lt": 2024-04-01}
+  (año, mes o día), un rango que recorre el índice del campo. Sobre campos
+  de texto el prefijo pasa al rango de cadenas equivalente.
+- Las cadenas ISO comparadas con un campo de fecha pasan a fecha.
+
+Las fechas se escriben en Extended JSON ({"$date": "2024-03-01T00:00:00Z"}),
+así el plan sigue siendo JSON (respuesta, caché de planes, formas de
+consulta) y decode_dates las convierte a datetime justo antes de ejecutarlo.
+"""
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import re
+
+from services.schema_cache import schema_cache
+
+logger = logging.getLogger(__name__)
+
+# "^2024", "^2024-03", "^2024-03-15" (con guion final o escapado opcional)
+DATE_PREFIX = re.compile(r"^\^(\d{4})(?:\\?-(\d{2})(?:\\?-(\d{2}))?)?(?:\\?-)?$")
+# Prefijo literal de texto: sin metacaracteres de regex
+LITERAL_PREFIX = re.compile(r"^\^([^\\.^$|?*+()\[\]{}]+)$")
+ISO_DATE = re.compile(
+    r"^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?(?:Z|[+-]\d{2}:?\d{2})?$"
+)
+
+COMPARISON_OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte")
+LIST_OPERATORS = ("$in", "$nin")
+LOGICAL_OPERATORS = ("$and", "$or", "$nor")
+# Etapas tras las que los campos ya no son los de la colección
+RESHAPING_STAGES = (
+    "$group", "$project", "$addFields", "$set", "$unset", "$replaceRoot",
+    "$replaceWith", "$bucket", "$bucketAuto", "$facet", "$sortByCount"
+)
+
+
+def period_range(year: int, month: Optional[int] = None, day: Optional[int] = None) -> Tuple[datetime, datetime]:
+    """Inicio y fin (exclusivo) de un año, mes o día"""
+    if day is not None:
+        start = datetime(year, month, day)
+        return start, start + timedelta(days=1)
+    if month is not None:
+        start = datetime(year, month, 1)
+        return start, datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+
+def extended_date(value: datetime) -> Dict[str, str]:
+    """Fecha en Extended JSON"""
+    return {"$date": value.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+
+def parse_iso_date(text: str) -> datetime:
+    """Cadena ISO (fecha o fecha y hora) a datetime UTC sin zona, como lo devuelve pymongo"""
+    value = datetime.fromisoformat(text.replace("Z", "+00:00").replace(" ", "T"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def decode_dates(value: Any) -> Any:
+    """
+    Convierte {"$date": ...} a datetime en cualquier nivel
+
+    Args:
+        value: Filtro, pipeline o plan
+
+    Returns:
+        Copia con las fechas listas para MongoDB
+    """
+    if isinstance(value, dict):
+        if len(value) == 1 and "$date" in value:
+            raw = value["$date"]
+            if isinstance(raw, str):
+                return parse_iso_date(raw)
+            if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+                return datetime.utcfromtimestamp(raw / 1000)
+        return {key: decode_dates(child) for key, child in value.items()}
+    if isinstance(value, list):
+        return [decode_dates(child) for child in value]
+    return value
+
+
+def sort_keys(sort: Any) -> List[Tuple[str, int]]:
+    """
+    Normaliza un sort ({campo: 1} o [[campo, -1]]) a pares (campo, dirección)
+
+    Args:
+        sort: Valor de "sort" de un plan find o de una etapa $sort
+
+    Returns:
+        Lista de pares en orden; vacía si el sort no es válido
+    """
+    if isinstance(sort, dict):
+        items = sort.items()
+    elif isinstance(sort, list):
+        items = [tuple(item) for item in sort if isinstance(item, (list, tuple)) and len(item) == 2]
+    else:
+        return []
+    return [(field, -1 if direction == -1 else 1) for field, direction in items if direction in (1, -1)]
+
+
+def _field_kind(types: Dict[str, int]) -> Optional[str]:
+    """date / string si todos los valores muestreados lo son (admite null)"""
+    names = {name.replace("array<", "").rstrip(">") for name in types} - {"null"}
+    if names == {"date"}:
+        return "date"
+    if names == {"string"}:
+        return "string"
+    return None
+
+
+class PlanRewriter:
+    """Reescribe filtros de fecha de los planes según el esquema inferido"""
+
+    def __init__(self):
+        self.rewrites: Counter = Counter()
+
+    def _rewrite_condition(self, condition: Any, kind: Optional[str]) -> Any:
+        """Condición de un campo: valor directo o {operador: valor}"""
+        if kind == "date" and isinstance(condition, str) and ISO_DATE.match(condition):
+            self.rewrites["iso_date"] += 1
+            return extended_date(parse_iso_date(condition))
+
+        if not isinstance(condition, dict) or not any(str(key).startswith("$") for key in condition):
+            return condition
+
+        condition = dict(condition)
+        pattern = condition.get("$regex")
+        if isinstance(pattern, str) and kind is not None:
+            date_match = DATE_PREFIX.match(pattern) if kind == "date" else None
+            text_match = LITERAL_PREFIX.match(pattern) if kind == "string" else None
+            bounds = None
+            if date_match:
+                try:
+                    start, end = period_range(*(int(part) if part else None for part in date_match.groups()))
+                    bounds = {"$gte": extended_date(start), "$lt": extended_date(end)}
+                except ValueError:
+                    # Mes o día inexistente: se deja la regex tal cual
+                    pass
+            elif text_match and not condition.get("$options"):
+                # Cadenas con el prefijo p: [p, p con el último carácter siguiente)
+                prefix = text_match.group(1)
+                bounds = {"$gte": prefix, "$lt": prefix[:-1] + chr(ord(prefix[-1]) + 1)}
+
+            if bounds is not None and not set(bounds) & set(condition):
+                condition.pop("$regex")
+                condition.pop("$options", None)
+                condition.update(bounds)
+                self.rewrites["regex_range"] += 1
+
+        if kind == "date":
+            for operator in COMPARISON_OPERATORS:
+                value = condition.get(operator)
+                if isinstance(value, str) and ISO_DATE.match(value):
+                    condition[operator] = extended_date(parse_iso_date(value))
+                    self.rewrites["iso_date"] += 1
+            for operator in LIST_OPERATORS:
+                values = condition.get(operator)
+                if isinstance(values, list):
+                    condition[operator] = [self._rewrite_condition(value, kind) for value in values]
+
+        return condition
+
+    def rewrite_filter(self, filter_: Any, field_kinds: Dict[str, str]) -> Any:
+        """
+        Reescribe un filtro de consulta (find, count o $match)
+
+        Args:
+            filter_: Filtro del plan
+            field_kinds: {campo: "date" | "string"} de la colección
+
+        Returns:
+            Filtro nuevo (el del plan no se modifica)
+        """
+        if not isinstance(filter_, dict):
+            return filter_
+
+        rewritten = {}
+        for key, value in filter_.items():
+            if key in LOGICAL_OPERATORS and isinstance(value, list):
+                rewritten[key] = [self.rewrite_filter(condition, field_kinds) for condition in value]
+            elif key.startswith("$"):
+                rewritten[key] = value
+            else:
+                rewritten[key] = self._rewrite_condition(value, field_kinds.get(key))
+        return rewritten
+
+    async def _field_kinds(self, collection_name: str) -> Dict[str, str]:
+        try:
+            schema = (await schema_cache.get()).get(collection_name)
+        except Exception as e:
+            logger.warning(f"Esquema no disponible para reescribir el plan: {e}")
+            return {}
+        if not schema:
+            return {}
+
+        kinds = {}
+        for path, info in schema["fields"].items():
+            kind = _field_kind(info["types"])
+            if kind is not None:
+                kinds[path] = kind
+        return kinds
+
+    async def rewrite(self, query_plan: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Reescribe los filtros de fecha de un plan generado por el LLM
+
+        En un pipeline se reescriben los $match anteriores a la primera
+        etapa que cambia la forma de los documentos ($group, $project...).
+
+        Args:
+            query_plan: Plan generado por el LLM
+
+        Returns:
+            Plan nuevo con rangos de fechas en Extended JSON
+        """
+        field_kinds = await self._field_kinds(query_plan.get("collection"))
+        if not field_kinds:
+            return query_plan
+
+        query_plan = dict(query_plan)
+        query = query_plan.get("query", {})
+
+        if query_plan.get("operation") == "aggregate" and isinstance(query, list):
+            pipeline = []
+            original_fields = True
+            for stage in query:
+                if original_fields and isinstance(stage, dict) and "$match" in stage:
+                    stage = {**stage, "$match": self.rewrite_filter(stage["$match"], field_kinds)}
+                elif isinstance(stage, dict) and any(name in stage for name in RESHAPING_STAGES):
+                    original_fields = False
+                pipeline.append(stage)
+            query_plan["query"] = pipeline
+        else:
+            query_plan["query"] = self.rewrite_filter(query, field_kinds)
+
+        return query_plan
+
+    def stats(self) -> Dict[str, Any]:
+        """Regex convertidas en rangos y cadenas ISO convertidas en fechas"""
+        return dict(self.rewrites)
+
+
+# Singleton instance
+plan_rewriter = PlanRewriter()
@@ -0,0 +1,170 @@
+"""
+Ejecución acotada de los planes de /api/query
+
+Los planes los genera el LLM, así que el límite se impone aquí y no se deja
+en manos del plan: a los pipelines se les añade una etapa $limit (MongoDB
+corta el pipeline en el servidor y, tras un $sort, lo convierte en un top-k)
+y a los find un limit, después del sort del plan si lo trae. Los cursores
+leen en lotes de QUERY_BATCH_SIZE y los documentos se entregan uno a uno,
+sin materializar el resultado completo.
+Toda consulta lleva maxTimeMS y la política de allowDiskUse de la
+configuración (QUERY_MAX_TIME_MS, QUERY_ALLOW_DISK_USE). Las fechas del plan
+en Extended JSON ({"$date": ...}) se convierten a datetime al ejecutar.
+Los planes con etapas de escritura ($out, $merge) o JavaScript ($where,
+$function, $accumulator) se rechazan siempre, con o sin QUERY_GUARD_ENABLED.
+"""
+from typing import Any, AsyncIterator, Dict, List
+import copy
+import logging
+
+from config.database import mongodb
+from config.settings import settings
+from services.plan_rewriter import decode_dates, sort_keys
+from services.query_guard import check_read_only
+from utils.serialization import to_jsonable
+
+logger = logging.getLogger(__name__)
+
+# Límite cuando el plan no indica ninguno
+DEFAULT_LIMITS = {"find": 20, "aggregate": 100}
+
+
+class QueryExecutor:
+    """Ejecuta planes de /api/query con límite y lectura por lotes"""
+
+    def __init__(self, batch_size: int = None):
+        """
+        Args:
+            batch_size: Documentos por lote del cursor
+        """
+        self.batch_size = batch_size or settings.QUERY_BATCH_SIZE
+
+    @staticmethod
+    def effective_limit(query_plan: Dict[str, Any], max_results: int, default_limit: int = None) -> int:
+        """
+        Límite a aplicar: el del plan (o el por defecto) sin pasar de max_results
+
+        Args:
+            query_plan: Plan generado por el LLM
+            max_results: Máximo de documentos permitido
+            default_limit: Límite si el plan no trae uno (DEFAULT_LIMITS por defecto)
+
+        Returns:
+            Número máximo de documentos a devolver
+        """
+        operation = query_plan.get("operation", "find")
+        default_limit = default_limit or DEFAULT_LIMITS.get(operation, max_results)
+        try:
+            limit = int(query_plan.get("limit") or default_limit)
+        except (TypeError, ValueError):
+            limit = default_limit
+        return max(1, min(limit, max_results))
+
+    @staticmethod
+    def limit_pipeline(pipeline: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        """
+        Añade $limit al final del pipeline si no lo acota ya
+
+        Args:
+            pipeline: Pipeline de agregación del plan
+            limit: Máximo de documentos
+
+        Returns:
+            Pipeline nuevo (el del plan no se modifica)
+        """
+        pipeline = copy.deepcopy(pipeline)
+        last = pipeline[-1] if pipeline else {}
+
+        if isinstance(last.get("$limit"), int) and last["$limit"] <= limit:
+            return pipeline
+
+        pipeline.append({"$limit": limit})
+        return pipeline
+
+    async def stream(
+        self,
+        query_plan: Dict[str, Any],
+        max_results: int = None,
+        default_limit: int = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ejecuta un plan find/aggregate entregando los documentos por lotes
+
+        Args:
+            query_plan: Plan generado por el LLM
+            max_results: Máximo de documentos (QUERY_MAX_RESULTS por defecto)
+            default_limit: Límite si el plan no trae uno
+
+        Yields:
+            Documentos tal como los devuelve el cursor (tipos BSON)
+
+        Raises:
+            QueryGuardError: Si el plan escribe o ejecuta JavaScript
+        """
+        check_read_only(query_plan)
+
+        collection = mongodb.get_collection(query_plan.get("collection"))
+        operation = query_plan.get("operation", "find")
+        query = decode_dates(query_plan.get("query", {}))
+        limit = self.effective_limit(query_plan, max_results or settings.QUERY_MAX_RESULTS, default_limit)
+        batch_size = min(self.batch_size, limit)
+
+        if operation == "find":
+            cursor = collection.find(query, query_plan.get("projection"))
+            sort = sort_keys(query_plan.get("sort"))
+            if sort:
+                cursor = cursor.sort(sort)
+            cursor = (
+                cursor.limit(limit)
+                .batch_size(batch_size)
+                .max_time_ms(settings.QUERY_MAX_TIME_MS)
+                .allow_disk_use(settings.QUERY_ALLOW_DISK_USE)
+            )
+        elif operation == "aggregate":
+            cursor = collection.aggregate(
+                self.limit_pipeline(query, limit),
+                batchSize=batch_size,
+                maxTimeMS=settings.QUERY_MAX_TIME_MS,
+                allowDiskUse=settings.QUERY_ALLOW_DISK_USE
+            )
+        else:
+            raise ValueError(f"Operación no soportada en streaming: {operation}")
+
+        async for doc in cursor:
+            yield doc
+
+    async def execute(self, query_plan: Dict[str, Any], max_results: int = None) -> Any:
+        """
+        Ejecuta un plan completo
+
+        Args:
+            query_plan: Plan generado por el LLM
+            max_results: Máximo de documentos (QUERY_MAX_RESULTS por defecto)
+
+        Returns:
+            Lista de documentos convertidos a JSON, o el número de documentos
+            para count_documents
+
+        Raises:
+            QueryGuardError: Si el plan escribe o ejecuta JavaScript
+        """
+        check_read_only(query_plan)
+        operation = query_plan.get("operation", "find")
+
+        if operation == "count_documents":
+            collection = mongodb.get_collection(query_plan.get("collection"))
+            return await collection.count_documents(
+                decode_dates(query_plan.get("query", {})),
+                maxTimeMS=settings.QUERY_MAX_TIME_MS
+            )
+
+        if operation not in ("find", "aggregate"):
+            raise ValueError(f"Operación no soportada: {operation}")
+
+        documents = [doc async for doc in self.stream(query_plan, max_results)]
+        # Una sola pasada convierte los tipos BSON anidados (items[].producto_id...)
+        return to_jsonable(documents)
+
+
+# Singleton instance
+query_executor = QueryExecutor()
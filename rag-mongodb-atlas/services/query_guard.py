@@ -0,0 +1,293 @@
+"""
+Control de coste de los planes de /api/query
+
+Antes de ejecutar un plan generado por el LLM se revisa:
+
+- Estáticamente: operación permitida, sin etapas de escritura ($out, $merge)
+  ni JavaScript ($where, $function, $accumulator), número de etapas del
+  pipeline y de $lookup acotado.
+- Con explain (verbosidad queryPlanner, que no ejecuta la consulta): si el
+  plan ganador recorre la colección completa (COLLSCAN) y esta supera
+  QUERY_COLLSCAN_MAX_DOCS, se rechaza. Los $lookup sobre colecciones grandes
+  deben cruzar por un campo indexado.
+
+Un plan rechazado vuelve al LLM con el motivo y los índices disponibles para
+que proponga uno más barato (QueryService). Además, toda consulta se ejecuta
+con maxTimeMS y la política de allowDiskUse (QueryExecutor), así que una
+pregunta mala no puede saturar el clúster.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Set
+import logging
+
+from config.database import mongodb
+from config.settings import settings
+from services.plan_rewriter import decode_dates, sort_keys
+from utils.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_OPERATIONS = ("find", "aggregate", "count_documents")
+WRITE_STAGES = ("$out", "$merge")
+JAVASCRIPT_OPERATORS = ("$where", "$function", "$accumulator")
+
+
+class QueryGuardError(ValueError):
+    """Plan rechazado por su coste o por usar operaciones no permitidas"""
+
+    def __init__(self, reason: str, detail: str, feedback: str = ""):
+        """
+        Args:
+            reason: Motivo corto (para métricas): collscan, stages, lookup...
+            detail: Descripción legible del rechazo
+            feedback: Pistas para que el LLM reescriba el plan
+        """
+        super().__init__(detail)
+        self.reason = reason
+        self.feedback = feedback
+
+
+def _operators(value: Any) -> Set[str]:
+    """Claves que empiezan por $ en cualquier nivel del plan"""
+    found: Set[str] = set()
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if isinstance(key, str) and key.startswith("$"):
+                found.add(key)
+            found |= _operators(child)
+    elif isinstance(value, list):
+        for child in value:
+            found |= _operators(child)
+    return found
+
+
+def check_read_only(query_plan: Dict[str, Any]):
+    """
+    Rechaza etapas de escritura y JavaScript en cualquier nivel del plan
+
+    Lo aplica también QueryExecutor antes de ejecutar, así que rige aunque
+    QUERY_GUARD_ENABLED=false desactive el resto de comprobaciones.
+
+    Raises:
+        QueryGuardError: Si el plan usa alguno de esos operadores
+    """
+    operators = _operators(query_plan.get("query", {})) | _operators(query_plan.get("projection") or {})
+    forbidden = sorted(operators & set(WRITE_STAGES + JAVASCRIPT_OPERATORS))
+    if forbidden:
+        raise QueryGuardError(
+            "forbidden",
+            f"Operadores no permitidos: {', '.join(forbidden)}",
+            "No uses etapas de escritura ni JavaScript; solo operadores de consulta y agregación."
+        )
+
+
+def winning_stages(explain: Any) -> List[Dict[str, Any]]:
+    """
+    Etapas de los planes ganadores de un explain (find, aggregate, sharded)
+
+    Recorre todo el documento salvo rejectedPlans, así que cubre tanto el
+    formato clásico como SBE (queryPlan) y los $cursor de las agregaciones.
+    """
+    stages: List[Dict[str, Any]] = []
+    if isinstance(explain, dict):
+        if isinstance(explain.get("stage"), str):
+            stages.append(explain)
+        for key, child in explain.items():
+            if key != "rejectedPlans":
+                stages.extend(winning_stages(child))
+    elif isinstance(explain, list):
+        for child in explain:
+            stages.extend(winning_stages(child))
+    return stages
+
+
+class QueryGuard:
+    """Revisa el coste de un plan antes de ejecutarlo"""
+
+    def __init__(self):
+        self.checked = 0
+        self.rejected: Counter = Counter()
+        self.rewrites = 0
+        self.rewrites_accepted = 0
+
+    def static_check(self, query_plan: Dict[str, Any]):
+        """
+        Reglas que no necesitan consultar MongoDB
+
+        Raises:
+            QueryGuardError: Si el plan incumple alguna
+        """
+        operation = query_plan.get("operation", "find")
+        if operation not in ALLOWED_OPERATIONS:
+            raise QueryGuardError("operation", f"Operación no permitida: {operation}")
+
+        check_read_only(query_plan)
+
+        query = query_plan.get("query", {})
+
+        if operation != "aggregate":
+            return
+
+        if not isinstance(query, list):
+            raise QueryGuardError("pipeline", "El pipeline de aggregate debe ser una lista de etapas")
+
+        stage_count = self._count_stages(query)
+        if stage_count > settings.QUERY_MAX_PIPELINE_STAGES:
+            raise QueryGuardError(
+                "stages",
+                f"Pipeline de {stage_count} etapas (máximo {settings.QUERY_MAX_PIPELINE_STAGES})",
+                f"Usa como máximo {settings.QUERY_MAX_PIPELINE_STAGES} etapas; combina $match y $project."
+            )
+
+        lookups = sum(1 for stage in query if isinstance(stage, dict) and "$lookup" in stage)
+        if lookups > settings.QUERY_MAX_LOOKUPS:
+            raise QueryGuardError(
+                "lookup",
+                f"{lookups} $lookup (máximo {settings.QUERY_MAX_LOOKUPS})",
+                f"Usa como máximo {settings.QUERY_MAX_LOOKUPS} $lookup, después de filtrar con $match."
+            )
+
+    def _count_stages(self, pipeline: List[Any]) -> int:
+        """Etapas del pipeline, incluidas las de los sub-pipelines de $lookup/$facet"""
+        count = 0
+        for stage in pipeline:
+            count += 1
+            if not isinstance(stage, dict):
+                continue
+            lookup = stage.get("$lookup")
+            if isinstance(lookup, dict) and isinstance(lookup.get("pipeline"), list):
+                count += self._count_stages(lookup["pipeline"])
+            facet = stage.get("$facet")
+            if isinstance(facet, dict):
+                count += sum(self._count_stages(sub) for sub in facet.values() if isinstance(sub, list))
+        return count
+
+    async def explain(self, query_plan: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        explain en modo queryPlanner (elige plan, no lo ejecuta)
+
+        Returns:
+            Documento de explain del servidor
+        """
+        collection_name = query_plan.get("collection")
+        operation = query_plan.get("operation", "find")
+        query = decode_dates(query_plan.get("query", {}))
+
+        if operation == "aggregate":
+            command = {"aggregate": collection_name, "pipeline": query, "cursor": {}}
+        elif operation == "count_documents":
+            command = {"count": collection_name, "query": query}
+        else:
+            command = {"find": collection_name, "filter": query}
+            if query_plan.get("projection"):
+                command["projection"] = query_plan["projection"]
+            sort = sort_keys(query_plan.get("sort"))
+            if sort:
+                command["sort"] = dict(sort)
+
+        return await mongodb.db.command({"explain": command, "verbosity": "queryPlanner"})
+
+    async def index_summary(self, collection_name: str) -> str:
+        """Índices de una colección en texto para el prompt de reescritura"""
+        try:
+            indexes = await mongodb.get_collection(collection_name).index_information()
+        except Exception as e:
+            logger.warning(f"No se pudieron leer los índices de {collection_name}: {e}")
+            return "desconocidos"
+        return "; ".join(
+            ", ".join(f"{field} ({direction})" for field, direction in index["key"])
+            for index in indexes.values()
+        )
+
+    async def _collection_size(self, collection_name: str) -> int:
+        return await mongodb.get_collection(collection_name).estimated_document_count()
+
+    async def _check_lookups(self, pipeline: List[Any]):
+        """Los $lookup sobre colecciones grandes deben cruzar por un campo indexado"""
+        for stage in pipeline:
+            lookup = stage.get("$lookup") if isinstance(stage, dict) else None
+            if not isinstance(lookup, dict) or not lookup.get("foreignField"):
+                continue
+
+            target, field = lookup.get("from"), lookup["foreignField"]
+            if field == "_id" or await self._collection_size(target) <= settings.QUERY_COLLSCAN_MAX_DOCS:
+                continue
+
+            indexes = await mongodb.get_collection(target).index_information()
+            if not any(index["key"][0][0] == field for index in indexes.values()):
+                raise QueryGuardError(
+                    "lookup",
+                    f"$lookup sobre {target}.{field} sin índice",
+                    f"Índices de {target}: {await self.index_summary(target)}. "
+                    f"Cruza por un campo indexado o filtra antes del $lookup."
+                )
+
+    async def check(self, query_plan: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Revisa un plan completo (reglas estáticas + explain)
+
+        Args:
+            query_plan: Plan generado por el LLM
+
+        Returns:
+            Resumen: etapas del plan ganador e índices usados
+
+        Raises:
+            QueryGuardError: Si el plan se rechaza
+        """
+        if not settings.QUERY_GUARD_ENABLED:
+            return {}
+
+        self.checked += 1
+        try:
+            self.static_check(query_plan)
+
+            collection_name = query_plan.get("collection")
+            if query_plan.get("operation") == "aggregate":
+                await self._check_lookups(query_plan.get("query", []))
+
+            stages = winning_stages(await self.explain(query_plan))
+            report = {
+                "stages": sorted({stage["stage"] for stage in stages}),
+                "indexes": sorted({stage["indexName"] for stage in stages if stage.get("indexName")})
+            }
+
+            if "COLLSCAN" in report["stages"]:
+                size = await self._collection_size(collection_name)
+                if size > settings.QUERY_COLLSCAN_MAX_DOCS:
+                    raise QueryGuardError(
+                        "collscan",
+                        f"El plan recorre la colección completa {collection_name} (~{size} documentos)",
+                        f"Índices de {collection_name}: {await self.index_summary(collection_name)}. "
+                        f"Filtra por un campo indexado (igualdad o rango) al principio de la consulta."
+                    )
+
+            return report
+
+        except QueryGuardError as e:
+            self.rejected[e.reason] += 1
+            logger.warning(f"Plan rechazado ({e.reason}): {e}")
+            raise
+
+    def rewrite_feedback(self, query_plan: Dict[str, Any], error: QueryGuardError) -> str:
+        """Texto para pedir al LLM un plan más barato"""
+        self.rewrites += 1
+        return (
+            f"El plan {dumps(query_plan)} fue rechazado: {error}. "
+            f"{error.feedback} Genera un plan equivalente más barato."
+        ).strip()
+
+    def stats(self) -> Dict[str, Any]:
+        """Planes revisados, rechazados por motivo y reescrituras"""
+        return {
+            "checked": self.checked,
+            "rejected": dict(self.rejected),
+            "rewrites": self.rewrites,
+            "rewrites_accepted": self.rewrites_accepted,
+            "max_time_ms": settings.QUERY_MAX_TIME_MS,
+            "allow_disk_use": settings.QUERY_ALLOW_DISK_USE
+        }
+
+
+# Singleton instance
+query_guard = QueryGuard()
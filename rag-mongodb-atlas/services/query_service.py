@@ -1,18 +1,33 @@
 """
 Servicio para traducir lenguaje natural a consultas MongoDB
 """
-from typing import Dict, List, Any
+from typing import Any, AsyncIterator, Dict
 import json
-from bson import json_util
-from datetime import datetime
-from services.llm_service import LLMService
-from config.database import mongodb
+import logging
+from services.llm_service import llm_service
+from services.answer_cache import answer_cache
+from services.usage_tracker import current_usage
+from services.schema_cache import schema_cache
+from services.plan_cache import plan_cache
+from services.query_executor import query_executor
+from services.query_guard import query_guard, QueryGuardError
+from services.index_advisor import index_advisor
+from services.plan_rewriter import plan_rewriter
+from config.settings import settings
+from utils.serialization import dumps
+from utils.singleflight import SingleFlight, request_key
+
+logger = logging.getLogger(__name__)
+
 
 class QueryService:
     """Servicio de consultas en lenguaje natural"""
 
     def __init__(self):
-        self.llm_service = LLMService()
+        # Comparte el pool de conexiones de Groq con el resto de la API
+        self.llm_service = llm_service
+        # Preguntas idénticas concurrentes comparten el plan, la consulta y la respuesta
+        self.singleflight = SingleFlight("query")
 
     async def natural_language_query(self, question: str) -> Dict[str, Any]:
         """
@@ -24,6 +39,100 @@ class QueryService:
         Returns:
             Dict con la respuesta y los datos consultados
         """
+        if not settings.SINGLEFLIGHT_ENABLED:
+            return await self._natural_language_query(question)
+
+        key = request_key({"question": answer_cache.normalize_question(question)})
+        return await self.singleflight.do(key, lambda: self._natural_language_query(question))
+
+    async def _natural_language_query(self, question: str) -> Dict[str, Any]:
+        """Traducción y ejecución de natural_language_query(), sin agrupar peticiones"""
+
+        try:
+            # Plantilla cacheada de una pregunta igual salvo en los valores
+            plan_cached = False
+            query_plan = plan_cache.lookup(question)
+            if query_plan is not None:
+                try:
+                    await query_guard.check(query_plan)
+                    results = await self._execute_query(query_plan)
+                    plan_cached = True
+                except Exception as e:
+                    logger.warning(f"Plan cacheado inválido, se regenera: {e}")
+                    plan_cache.discard(question)
+
+            if not plan_cached:
+                query_plan = await self._guarded_query_plan(question)
+                results = await self._execute_query(query_plan)
+                # Solo se guardan planes que se ejecutaron sin error
+                plan_cache.store(question, query_plan)
+
+            # Forma de la consulta para el asesor de índices
+            index_advisor.record(query_plan)
+
+            # El consumo de la petición se agrega por la colección consultada
+            request_usage = current_usage()
+            if request_usage is not None:
+                request_usage.collection = query_plan.get("collection")
+
+            # Generar respuesta en lenguaje natural
+            natural_response = await self._generate_natural_response(
+                question, query_plan, results
+            )
+
+            return {
+                "question": question,
+                "query_plan": query_plan,
+                "results": results,
+                "answer": natural_response,
+                "count": len(results) if isinstance(results, list) else results,
+                "plan_cached": plan_cached
+            }
+
+        except Exception as e:
+            print(f"Error en consulta natural: {e}")
+            return {
+                "question": question,
+                "error": str(e),
+                "answer": f"Lo siento, hubo un error al procesar tu consulta: {str(e)}"
+            }
+
+    async def _guarded_query_plan(self, question: str) -> Dict[str, Any]:
+        """
+        Plan del LLM que supera el control de coste (QueryGuard)
+
+        Un plan rechazado vuelve al LLM con el motivo y los índices de la
+        colección, hasta QUERY_GUARD_MAX_REWRITES veces.
+
+        Raises:
+            QueryGuardError: Si ningún plan resulta aceptable
+        """
+        feedback = None
+        for attempt in range(settings.QUERY_GUARD_MAX_REWRITES + 1):
+            query_plan = await self._generate_query_plan(question, feedback)
+            try:
+                await query_guard.check(query_plan)
+            except QueryGuardError as e:
+                if e.reason in ("collscan", "lookup"):
+                    # Justo las consultas que más ganarían con un índice
+                    index_advisor.record(query_plan)
+                if attempt == settings.QUERY_GUARD_MAX_REWRITES:
+                    raise
+                feedback = query_guard.rewrite_feedback(query_plan, e)
+                continue
+
+            if attempt:
+                query_guard.rewrites_accepted += 1
+            return query_plan
+
+    async def _generate_query_plan(self, question: str, feedback: str = None) -> Dict[str, Any]:
+        """
+        Pide al LLM el plan (colección, operación y consulta) de una pregunta
+
+        Args:
+            question: Pregunta del usuario
+            feedback: Motivo del rechazo del plan anterior, si lo hubo
+        """
 
         # Obtener esquema de las colecciones
         schema_info = await self._get_database_schema()
@@ -41,13 +150,15 @@ INSTRUCCIONES:
 1. Analiza la pregunta y determina qué colección(es) consultar
 2. Genera la consulta MongoDB apropiada (find, aggregate, count, etc.)
 3. La consulta debe ser un objeto JSON válido
-4. Devuelve tu respuesta en el siguiente formato JSON:
+4. Los campos de tipo date se filtran por rango ($gte/$lt) con fechas {{"$date": "AAAA-MM-DDT00:00:00Z"}}, nunca con $regex; para agrupar por mes o año usa $dateToString sobre el campo
+5. Devuelve tu respuesta en el siguiente formato JSON:
 
 {{
     "collection": "nombre_de_coleccion",
     "operation": "find|aggregate|count_documents",
     "query": {{}},
     "projection": {{}},
+    "sort": {{}},
     "limit": 10,
     "explanation": "Explicación breve de qué datos se están consultando"
 }}
@@ -60,132 +171,157 @@ Pregunta: "Muéstrame los productos con bajo stock"
 Respuesta: {{"collection": "productos", "operation": "find", "query": {{"estado": "bajo_stock"}}, "limit": 10, "explanation": "Buscando productos con stock bajo"}}
 
 Pregunta: "¿Cuál es el total de ventas de marzo?"
-Respuesta: {{"collection": "ventas", "operation": "aggregate", "query": [{{"$match": {{"fecha": {{"$regex": "^2024-03"}}}}}}, {{"$group": {{"_id": null, "total": {{"$sum": "$total"}}}}}}], "explanation": "Sumando el total de todas las ventas de marzo 2024"}}
-
-Ahora responde con el JSON para la pregunta del usuario."""
+Respuesta: {{"collection": "ventas", "operation": "aggregate", "query": [{{"$match": {{"fecha": {{"$gte": {{"$date": "2024-03-01T00:00:00Z"}}, "$lt": {{"$date": "2024-04-01T00:00:00Z"}}}}}}}}, {{"$group": {{"_id": null, "total": {{"$sum": "$total"}}}}}}], "explanation": "Sumando el total de todas las ventas de marzo 2024"}}
 
-        try:
-            # Obtener respuesta del LLM
-            llm_response = self.llm_service.generate_response(prompt, temperature=0.3)
+Pregunta: "¿Cuánto se vendió cada mes de 2024?"
+Respuesta: {{"collection": "ventas", "operation": "aggregate", "query": [{{"$match": {{"fecha": {{"$gte": {{"$date": "2024-01-01T00:00:00Z"}}, "$lt": {{"$date": "2025-01-01T00:00:00Z"}}}}}}}}, {{"$group": {{"_id": {{"$dateToString": {{"format": "%Y-%m", "date": "$fecha"}}}}, "total": {{"$sum": "$total"}}}}}}, {{"$sort": {{"_id": 1}}}}], "explanation": "Total de ventas por mes de 2024"}}
 
-            # Parsear la respuesta JSON
-            # Extraer JSON del texto (puede venir con markdown)
-            response_text = llm_response.strip()
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
+Ahora responde con el JSON para la pregunta del usuario."""
 
-            query_plan = json.loads(response_text)
+        if feedback:
+            prompt += f"""
 
-            # Ejecutar la consulta
-            results = await self._execute_query(query_plan)
+PLAN ANTERIOR RECHAZADO POR SU COSTE:
+{feedback}"""
 
-            # Generar respuesta en lenguaje natural
-            natural_response = await self._generate_natural_response(
-                question, query_plan, results
-            )
+        # Obtener respuesta del LLM
+        llm_response = await self.llm_service.generate_response_async(
+            prompt,
+            temperature=0.3,
+            task="query_plan"
+        )
 
-            return {
-                "question": question,
-                "query_plan": query_plan,
-                "results": results,
-                "answer": natural_response,
-                "count": len(results) if isinstance(results, list) else results
-            }
+        # Parsear la respuesta JSON
+        # Extraer JSON del texto (puede venir con markdown)
+        response_text = llm_response.strip()
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif "```" in response_text:
+            response_text = response_text.split("```")[1].split("```")[0].strip()
 
-        except Exception as e:
-            print(f"Error en consulta natural: {e}")
-            return {
-                "question": question,
-                "error": str(e),
-                "answer": f"Lo siento, hubo un error al procesar tu consulta: {str(e)}"
-            }
+        # Prefijos de regex y cadenas ISO sobre campos de fecha pasan a rangos
+        return await plan_rewriter.rewrite(json.loads(response_text))
 
     async def _get_database_schema(self) -> str:
-        """Obtiene información del esquema de la base de datos dinámicamente"""
+        """Esquema de la base de datos para el prompt (desde la caché, sin consultas)"""
+        return await schema_cache.prompt_text()
 
-        db = mongodb.db
-        schema_parts = ["COLECCIONES DISPONIBLES:\n"]
-
-        # Obtener todas las colecciones
-        collection_names = await db.list_collection_names()
-
-        for idx, coll_name in enumerate(collection_names, 1):
-            collection = mongodb.get_collection(coll_name)
+    async def _execute_query(self, query_plan: Dict) -> Any:
+        """Ejecuta la consulta MongoDB (con $limit y lectura por lotes)"""
+        return await query_executor.execute(query_plan)
 
-            # Obtener documento de muestra para inferir campos
-            sample = await collection.find_one({})
+    async def stream_query(self, question: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Variante en streaming de natural_language_query()
 
-            schema_parts.append(f"\n{idx}. {coll_name}:")
+        Los documentos se entregan a medida que el cursor los lee (hasta
+        QUERY_STREAM_MAX_RESULTS); solo los primeros QUERY_SUMMARY_ROWS
+        entran en el prompt de la respuesta final.
 
-            if sample:
-                for key, value in sample.items():
-                    if key != '_id':
-                        field_type = type(value).__name__
-                        schema_parts.append(f"   - {key} ({field_type})")
-            else:
-                schema_parts.append("   (Colección vacía)")
+        Args:
+            question: Pregunta del usuario en lenguaje natural
 
-        return "\n".join(schema_parts)
+        Yields:
+            Eventos {"type": "plan" | "result" | "answer", ...}
+        """
+        query_plan = plan_cache.lookup(question)
+        plan_cached = query_plan is not None
+        if plan_cached:
+            rows, first = await self._open_stream(query_plan, check=True)
+            if rows is None:
+                # La plantilla cacheada no sirve: se descarta y se pide el plan
+                plan_cache.discard(question)
+                plan_cached = False
+
+        if not plan_cached:
+            query_plan = await self._guarded_query_plan(question)
+            rows, first = await self._open_stream(query_plan, raise_errors=True)
+
+        index_advisor.record(query_plan)
+
+        request_usage = current_usage()
+        if request_usage is not None:
+            request_usage.collection = query_plan.get("collection")
+
+        yield {"type": "plan", "query_plan": query_plan, "plan_cached": plan_cached}
+
+        if query_plan.get("operation") == "count_documents":
+            results = total = first
+            yield {"type": "result", "data": {"count": total}}
+        else:
+            results, total = [], 0
+            row = first
+            while row is not None:
+                total += 1
+                if len(results) < settings.QUERY_SUMMARY_ROWS:
+                    results.append(row)
+                yield {"type": "result", "data": row}
+                row = await self._next_row(rows)
+
+        if not plan_cached:
+            plan_cache.store(question, query_plan)
+
+        answer = await self._generate_natural_response(question, query_plan, results, total=total)
+        yield {"type": "answer", "answer": answer, "count": total}
+
+    async def _open_stream(self, query_plan: Dict, raise_errors: bool = False, check: bool = False):
+        """
+        Abre el cursor de un plan y lee el primer documento
 
-    async def _execute_query(self, query_plan: Dict) -> Any:
-        """Ejecuta la consulta MongoDB"""
-
-        collection_name = query_plan.get("collection")
-        operation = query_plan.get("operation", "find")
-        query = query_plan.get("query", {})
-        projection = query_plan.get("projection")
-        limit = query_plan.get("limit", 20)
-
-        collection = mongodb.get_collection(collection_name)
-
-        if operation == "find":
-            cursor = collection.find(query, projection)
-            if limit:
-                cursor = cursor.limit(limit)
-            results = await cursor.to_list(length=limit)
-
-            # Convertir ObjectId y datetime a string
-            for doc in results:
-                if '_id' in doc:
-                    doc['_id'] = str(doc['_id'])
-                # Convertir datetime a ISO string
-                for key, value in list(doc.items()):
-                    if isinstance(value, datetime):
-                        doc[key] = value.isoformat()
-
-            return results
-
-        elif operation == "count_documents":
-            count = await collection.count_documents(query)
-            return count
-
-        elif operation == "aggregate":
-            cursor = collection.aggregate(query)  # query es el pipeline
-            results = await cursor.to_list(length=100)
-
-            # Convertir ObjectId y datetime a string
-            for doc in results:
-                if '_id' in doc and doc['_id'] is not None:
-                    doc['_id'] = str(doc['_id'])
-                # Convertir datetime a ISO string
-                for key, value in list(doc.items()):
-                    if isinstance(value, datetime):
-                        doc[key] = value.isoformat()
-
-            return results
+        Args:
+            query_plan: Plan a ejecutar
+            raise_errors: Propagar los errores en lugar de devolver (None, None)
+            check: Pasar antes el plan por QueryGuard (planes cacheados)
 
-        else:
-            raise ValueError(f"Operación no soportada: {operation}")
+        Returns:
+            (iterador, primer documento o None); para count_documents,
+            (iterador vacío, total). (None, None) si falla y no se propaga
+        """
+        try:
+            if check:
+                await query_guard.check(query_plan)
+            if query_plan.get("operation") == "count_documents":
+                return iter(()), await query_executor.execute(query_plan)
+
+            rows = query_executor.stream(
+                query_plan,
+                max_results=settings.QUERY_STREAM_MAX_RESULTS,
+                default_limit=settings.QUERY_STREAM_MAX_RESULTS
+            )
+            return rows, await self._next_row(rows)
+        except Exception as e:
+            if raise_errors:
+                raise
+            logger.warning(f"Plan cacheado inválido, se regenera: {e}")
+            return None, None
+
+    @staticmethod
+    async def _next_row(rows: AsyncIterator[Dict[str, Any]]):
+        """Siguiente documento del cursor o None al terminar"""
+        try:
+            return await rows.__anext__()
+        except StopAsyncIteration:
+            return None
 
     async def _generate_natural_response(
         self,
         question: str,
         query_plan: Dict,
-        results: Any
+        results: Any,
+        total: int = None
     ) -> str:
-        """Genera una respuesta en lenguaje natural basada en los resultados"""
+        """
+        Genera una respuesta en lenguaje natural basada en los resultados
+
+        Solo los primeros QUERY_SUMMARY_ROWS documentos entran en el prompt;
+        total indica cuántos devolvió la consulta en realidad.
+        """
+        if isinstance(results, list):
+            total = len(results) if total is None else total
+            results = results[:settings.QUERY_SUMMARY_ROWS]
+            shown = f"{len(results)} de {total} documentos" if total > len(results) else f"{total} documentos"
+        else:
+            shown = "valor único"
 
         prompt = f"""Eres un asistente que presenta resultados de consultas de base de datos de forma clara y profesional.
 
@@ -195,8 +331,8 @@ PREGUNTA DEL USUARIO:
 CONSULTA EJECUTADA:
 {query_plan.get('explanation', 'Consulta a la base de datos')}
 
-RESULTADOS:
-{json.dumps(results, indent=2, ensure_ascii=False)[:2000]}
+RESULTADOS ({shown}):
+{dumps(results)[:2000]}
 
 INSTRUCCIONES:
 1. Responde la pregunta del usuario con los datos obtenidos
@@ -208,8 +344,17 @@ INSTRUCCIONES:
 RESPUESTA:"""
 
         try:
-            response = self.llm_service.generate_response(prompt, temperature=0.3)
+            # Presentar resultados ya calculados no requiere el modelo grande
+            response = await self.llm_service.generate_response_async(
+                prompt,
+                temperature=0.3,
+                task="format"
+            )
             return response
         except Exception as e:
             print(f"Error generando respuesta: {e}")
-            return f"Resultados obtenidos: {json.dumps(results, indent=2, ensure_ascii=False)[:500]}"
+            return f"Resultados obtenidos: {dumps(results)[:500]}"
+
+
+# Singleton instance
+query_service = QueryService()
@@ -1,19 +1,39 @@
 """
 Servicio RAG (Retrieval-Augmented Generation) completo
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+from contextlib import nullcontext
+import asyncio
+import time
 import logging
 
+from config.settings import settings
 from services.search_service import search_service
 from services.llm_service import llm_service
+from services.embedding_service import embedding_service
+from services.answer_cache import answer_cache
+from services.context_compressor import context_compressor
+from services.session_store import session_store
+from services.relevance_gate import relevance_gate
 from models.schemas import SearchType
+from utils.profiling import RequestProfiler, profile_stage
+from utils.helpers import combine_embeddings_with_decay
+from utils.prompts import PromptTemplates
+from utils.serialization import to_jsonable
+from utils.singleflight import SingleFlight, request_key
 
 logger = logging.getLogger(__name__)
 
+NO_CONTEXT_ANSWER = "No se encontraron documentos relevantes para responder la pregunta."
+
 
 class RAGService:
     """Servicio para pipeline RAG completo"""
 
+    def __init__(self):
+        # Preguntas idénticas concurrentes comparten recuperación y llamada al LLM
+        self.singleflight = SingleFlight("rag")
+
     async def generate_answer(
         self,
         question: str,
@@ -21,7 +41,12 @@ class RAGService:
         search_type: SearchType = SearchType.HYBRID,
         temperature: float = 0.7,
         max_tokens: int = 1024,
-        collection_name: str = None
+        collection_name: str = None,
+        profiler: Optional[RequestProfiler] = None,
+        query_embedding: Optional[List[float]] = None,
+        llm_semaphore: Optional[asyncio.Semaphore] = None,
+        context_docs: Optional[List[Dict[str, Any]]] = None,
+        conversation_history: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Genera una respuesta usando RAG
@@ -33,62 +58,162 @@ class RAGService:
             temperature: Temperatura del modelo
             max_tokens: Tokens máximos de respuesta
             collection_name: Colección a buscar
+            profiler: Perfil de la petición (opcional)
+            query_embedding: Embedding ya calculado de la pregunta (opcional)
+            llm_semaphore: Semáforo que acota las llamadas concurrentes al LLM
+            context_docs: Documentos ya recuperados (se omite la búsqueda)
+            conversation_history: Historial acotado a incluir en el prompt
 
         Returns:
             Dict con respuesta, pregunta y contexto usado
         """
+        async def generate() -> Dict[str, Any]:
+            return await self._generate_answer(
+                question, context_limit, search_type, temperature, max_tokens, collection_name,
+                profiler, query_embedding, llm_semaphore, context_docs, conversation_history
+            )
+
+        # Con perfil o contexto ya calculado la petición no es intercambiable con otras
+        if (
+            not settings.SINGLEFLIGHT_ENABLED
+            or profiler is not None
+            or context_docs is not None
+            or query_embedding is not None
+        ):
+            return await generate()
+
+        key = request_key({
+            "question": answer_cache.normalize_question(question),
+            "history": conversation_history,
+            "context_limit": context_limit,
+            "search_type": search_type,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "collection": collection_name
+        })
+        return await self.singleflight.do(key, generate)
+
+    async def _generate_answer(
+        self,
+        question: str,
+        context_limit: int,
+        search_type: SearchType,
+        temperature: float,
+        max_tokens: int,
+        collection_name: Optional[str],
+        profiler: Optional[RequestProfiler],
+        query_embedding: Optional[List[float]],
+        llm_semaphore: Optional[asyncio.Semaphore],
+        context_docs: Optional[List[Dict[str, Any]]],
+        conversation_history: Optional[str]
+    ) -> Dict[str, Any]:
+        """Pipeline RAG de generate_answer(), sin agrupar peticiones"""
         try:
             logger.info(f"RAG Query: '{question}'")
 
             # 1. Recuperar documentos relevantes
-            context_docs = await search_service.search(
-                query=question,
-                search_type=search_type,
-                collection_name=collection_name,
-                limit=context_limit
-            )
+            if context_docs is None:
+                context_docs = await search_service.search(
+                    query=question,
+                    search_type=search_type,
+                    collection_name=collection_name,
+                    limit=context_limit,
+                    profiler=profiler,
+                    query_embedding=query_embedding
+                )
 
             if not context_docs:
                 return {
-                    "answer": "No se encontraron documentos relevantes para responder la pregunta.",
+                    "answer": NO_CONTEXT_ANSWER,
                     "question": question,
                     "context": [],
                     "model": "N/A"
                 }
 
-            # 2. Preparar contexto para el LLM
-            context_for_llm = [
-                {
-                    "title": doc.get("title", "Sin título"),
-                    "content": doc.get("content", ""),
-                    "score": doc.get("score", 0)
+            # 2. Compuerta de relevancia: sin documentos relevantes no se llama al LLM
+            relevance = relevance_gate.evaluate(context_docs, search_type, collection_name)
+
+            if profiler:
+                profiler.record("relevance_top_score", relevance["top_score"])
+                profiler.record("relevance_gated", not relevance["passed"])
+
+            if not relevance["passed"]:
+                logger.info(
+                    f"RAG sin LLM: top score {relevance['top_score']:.3f} < "
+                    f"umbral {relevance['threshold']:.3f}"
+                )
+                return {
+                    "answer": relevance_gate.fallback_answer(question, context_docs),
+                    "question": question,
+                    "context": self._format_context(context_docs),
+                    "model": "N/A",
+                    "gated": True,
+                    "relevance": relevance
                 }
-                for doc in context_docs
-            ]
 
-            # 3. Generar respuesta usando LLM
-            answer = llm_service.generate_rag_response(
-                question=question,
-                context_documents=context_for_llm,
-                temperature=temperature,
-                max_tokens=max_tokens
+            # 3. Consultar la caché de respuestas
+            cache_key = self._answer_cache_key(
+                question, context_docs, temperature, max_tokens, conversation_history
             )
-
-            # 4. Preparar respuesta completa
+            answer = answer_cache.get(cache_key) if cache_key else None
+
+            if profiler:
+                profiler.record("answer_cache", "hit" if answer is not None else "miss")
+
+            if answer is None:
+                # 4. Preparar y comprimir el contexto para el LLM
+                with profile_stage(profiler, "compression"):
+                    context_for_llm, compression = await context_compressor.compress(
+                        question,
+                        self._prepare_llm_context(context_docs),
+                        query_embedding=query_embedding
+                    )
+
+                # 5. Generar respuesta usando LLM
+                with profile_stage(profiler, "prompt_build"):
+                    rag_prompt = llm_service.build_rag_prompt(
+                        question,
+                        context_for_llm,
+                        conversation_history=conversation_history
+                    )
+
+                context_stats = {**rag_prompt["context_stats"], "compression": compression}
+
+                if profiler:
+                    profiler.record("context_documents", context_stats["documents_packed"])
+                    profiler.record("prompt_chars", len(rag_prompt["system"]) + len(rag_prompt["user"]))
+                    profiler.record("prompt_tokens", context_stats["packed_tokens"])
+                    profiler.record("compression_tokens_saved", compression["tokens_saved"])
+
+                async with llm_semaphore or nullcontext():
+                    with profile_stage(profiler, "llm"):
+                        answer = await llm_service.generate_response_async(
+                            prompt=rag_prompt["user"],
+                            system_message=rag_prompt["system"],
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            task="rag",
+                            retrieval_confidence=self._retrieval_confidence(context_docs)
+                        )
+
+                if cache_key:
+                    answer_cache.set(cache_key, answer, [doc.get("_id") for doc in context_docs])
+
+                cached = False
+            else:
+                # En un acierto de caché no se construye el prompt
+                context_stats = None
+                cached = True
+
+            # 6. Preparar respuesta completa
             result = {
                 "answer": answer,
                 "question": question,
-                "context": [
-                    {
-                        "id": str(doc.get("_id", "")),
-                        "title": doc.get("title", ""),
-                        "content": doc.get("content", "")[:500] + "...",  # Truncar para respuesta
-                        "score": doc.get("score", 0),
-                        "metadata": doc.get("metadata", {})
-                    }
-                    for doc in context_docs
-                ],
-                "model": "groq"
+                "context": self._format_context(context_docs),
+                "model": "groq",
+                "cached": cached,
+                "context_stats": context_stats,
+                "relevance": relevance
             }
 
             logger.info(f"RAG Answer generado con {len(context_docs)} contextos")
@@ -98,35 +223,266 @@ class RAGService:
             logger.error(f"Error en RAG pipeline: {e}")
             raise
 
+    async def generate_answer_stream(
+        self,
+        question: str,
+        context_limit: int = 5,
+        search_type: SearchType = SearchType.HYBRID,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        collection_name: str = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Variante en streaming de generate_answer()
+
+        Emite primero el contexto recuperado y después los tokens a medida
+        que el LLM los genera, para minimizar el tiempo hasta el primer token.
+
+        Args:
+            question: Pregunta del usuario
+            context_limit: Número de documentos de contexto
+            search_type: Tipo de búsqueda para recuperar contexto
+            temperature: Temperatura del modelo
+            max_tokens: Tokens máximos de respuesta
+            collection_name: Colección a buscar
+
+        Yields:
+            Eventos {"event": "context" | "token" | "done", "data": {...}}
+        """
+        start = time.perf_counter()
+        logger.info(f"RAG Stream Query: '{question}'")
+
+        context_docs = await search_service.search(
+            query=question,
+            search_type=search_type,
+            collection_name=collection_name,
+            limit=context_limit
+        )
+
+        yield {
+            "event": "context",
+            "data": {
+                "question": question,
+                "context": self._format_context(context_docs)
+            }
+        }
+
+        if not context_docs:
+            yield {"event": "token", "data": {"text": NO_CONTEXT_ANSWER}}
+            yield {"event": "done", "data": {"model": "N/A", "first_token_ms": None}}
+            return
+
+        relevance = relevance_gate.evaluate(context_docs, search_type, collection_name)
+        if not relevance["passed"]:
+            yield {"event": "token", "data": {"text": relevance_gate.fallback_answer(question, context_docs)}}
+            yield {
+                "event": "done",
+                "data": {
+                    "model": "N/A",
+                    "gated": True,
+                    "first_token_ms": round((time.perf_counter() - start) * 1000, 2),
+                    "total_ms": round((time.perf_counter() - start) * 1000, 2)
+                }
+            }
+            return
+
+        cache_key = self._answer_cache_key(question, context_docs, temperature, max_tokens)
+        cached_answer = answer_cache.get(cache_key) if cache_key else None
+
+        if cached_answer is not None:
+            yield {"event": "token", "data": {"text": cached_answer}}
+            yield {
+                "event": "done",
+                "data": {
+                    "model": "groq",
+                    "cached": True,
+                    "first_token_ms": round((time.perf_counter() - start) * 1000, 2),
+                    "total_ms": round((time.perf_counter() - start) * 1000, 2)
+                }
+            }
+            return
+
+        context_for_llm, _ = await context_compressor.compress(
+            question,
+            self._prepare_llm_context(context_docs)
+        )
+        rag_prompt = llm_service.build_rag_prompt(question, context_for_llm)
+
+        first_token_ms = None
+        answer_parts = []
+        async for text in llm_service.generate_response_stream_async(
+            prompt=rag_prompt["user"],
+            system_message=rag_prompt["system"],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            task="rag",
+            retrieval_confidence=self._retrieval_confidence(context_docs)
+        ):
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - start) * 1000, 2)
+            answer_parts.append(text)
+            yield {"event": "token", "data": {"text": text}}
+
+        if cache_key:
+            answer_cache.set(cache_key, "".join(answer_parts), [doc.get("_id") for doc in context_docs])
+
+        yield {
+            "event": "done",
+            "data": {
+                "model": "groq",
+                "cached": False,
+                "first_token_ms": first_token_ms,
+                "total_ms": round((time.perf_counter() - start) * 1000, 2)
+            }
+        }
+
+    def _answer_cache_key(
+        self,
+        question: str,
+        context_docs: List[Dict[str, Any]],
+        temperature: float,
+        max_tokens: int,
+        conversation_history: Optional[str] = None
+    ) -> Optional[str]:
+        """Clave de la caché de respuestas, o None si la petición no es cacheable"""
+        if not answer_cache.is_cacheable(temperature):
+            return None
+
+        # Con historial la respuesta depende de la conversación: se incluye en la clave
+        if conversation_history:
+            question = f"{conversation_history}\n{question}"
+
+        return answer_cache.make_key(
+            question=question,
+            context_docs=context_docs,
+            model=settings.GROQ_MODEL,
+            params={
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "fast_model": settings.GROQ_FAST_MODEL if settings.MODEL_ROUTING_ENABLED else None,
+                "context_token_budget": settings.CONTEXT_TOKEN_BUDGET,
+                "context_compression_ratio": (
+                    settings.CONTEXT_COMPRESSION_RATIO if settings.CONTEXT_COMPRESSION_ENABLED else None
+                )
+            }
+        )
+
+    def _retrieval_confidence(self, context_docs: List[Dict[str, Any]]) -> Optional[float]:
+        """
+        Confianza de la recuperación: score vectorial del mejor documento
+
+        En híbrida el score combinado está normalizado por el máximo de cada
+        lista, así que se usa el vector_score original si está disponible.
+        """
+        scores = [
+            doc.get("vector_score", doc.get("score"))
+            for doc in context_docs
+            if doc.get("vector_score", doc.get("score")) is not None
+        ]
+        return max(scores) if scores else None
+
+    def _prepare_llm_context(self, context_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Reduce los documentos recuperados a lo que necesita el prompt"""
+        return [
+            {
+                "title": doc.get("title", "Sin título"),
+                "content": doc.get("content", ""),
+                "score": doc.get("score", 0)
+            }
+            for doc in context_docs
+        ]
+
+    def _format_context(self, context_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Formatea el contexto recuperado para la respuesta de la API"""
+        return [
+            {
+                "id": str(doc.get("_id", "")),
+                "title": doc.get("title", ""),
+                "content": doc.get("content", "")[:500] + "...",  # Truncar para respuesta
+                "score": doc.get("score", 0),
+                "metadata": to_jsonable(doc.get("metadata", {}))
+            }
+            for doc in context_docs
+        ]
+
     async def multi_query_rag(
         self,
         questions: List[str],
         context_limit: int = 5,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        concurrency: int = None
     ) -> List[Dict[str, Any]]:
         """
-        Procesa múltiples preguntas con RAG
+        Procesa múltiples preguntas con RAG de forma concurrente
+
+        Los embeddings de todas las preguntas se calculan en un único batch;
+        la recuperación (RAG_BATCH_RETRIEVAL_CONCURRENCY) y las llamadas al
+        LLM (concurrency) se acotan con semáforos separados, para que las
+        búsquedas de unas preguntas se solapen con el LLM de otras sin lanzar
+        todas a la vez. Un fallo en una pregunta no afecta al resto: su
+        resultado lleva el campo "error".
 
         Args:
             questions: Lista de preguntas
             context_limit: Documentos de contexto por pregunta
             temperature: Temperatura del modelo
+            max_tokens: Tokens máximos de respuesta
+            concurrency: Máximo de llamadas simultáneas al LLM
 
         Returns:
-            Lista de respuestas RAG
+            Lista de respuestas RAG, en el mismo orden que las preguntas
         """
         try:
-            results = []
+            if not questions:
+                return []
 
-            for question in questions:
-                result = await self.generate_answer(
-                    question=question,
-                    context_limit=context_limit,
-                    temperature=temperature
-                )
-                results.append(result)
+            # Un solo batch de embeddings para todas las preguntas
+            query_embeddings = await asyncio.to_thread(
+                embedding_service.generate_text_embeddings_batch,
+                questions
+            )
+
+            llm_semaphore = asyncio.Semaphore(concurrency or settings.RAG_BATCH_CONCURRENCY)
+            retrieval_semaphore = asyncio.Semaphore(settings.RAG_BATCH_RETRIEVAL_CONCURRENCY)
+
+            async def answer_one(question: str, query_embedding: List[float]) -> Dict[str, Any]:
+                try:
+                    async with retrieval_semaphore:
+                        context_docs = await search_service.search(
+                            query=question,
+                            search_type=SearchType.HYBRID,
+                            limit=context_limit,
+                            query_embedding=query_embedding
+                        )
+
+                    return await self.generate_answer(
+                        question=question,
+                        context_limit=context_limit,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        query_embedding=query_embedding,
+                        llm_semaphore=llm_semaphore,
+                        context_docs=context_docs
+                    )
+                except Exception as e:
+                    logger.warning(f"Multi-query RAG: fallo en '{question}': {e}")
+                    return {
+                        "answer": None,
+                        "question": question,
+                        "context": [],
+                        "model": "N/A",
+                        "error": str(e)
+                    }
+
+            results = await asyncio.gather(*[
+                answer_one(question, query_embedding)
+                for question, query_embedding in zip(questions, query_embeddings)
+            ])
 
-            return results
+            failed = sum(1 for result in results if result.get("error"))
+            logger.info(f"Multi-query RAG: {len(results)} preguntas, {failed} fallidas")
+            return list(results)
 
         except Exception as e:
             logger.error(f"Error en multi-query RAG: {e}")
@@ -135,39 +491,108 @@ class RAGService:
     async def conversational_rag(
         self,
         question: str,
-        conversation_history: List[Dict[str, str]],
+        conversation_history: Optional[List[Dict[str, str]]] = None,
         context_limit: int = 5,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        session_id: Optional[str] = None,
+        max_tokens: int = 1024
     ) -> Dict[str, Any]:
         """
         RAG conversacional que considera el historial
 
+        Con session_id el historial vive en el servidor (ventana de turnos +
+        resumen acumulado), así que ni la petición ni el prompt crecen con la
+        conversación. conversation_history se mantiene para clientes que
+        envían el historial completo; de él solo se usa la última ventana.
+
+        La recuperación no reescribe el texto de la pregunta: el vector de
+        búsqueda combina el embedding de la pregunta con los de los turnos
+        recientes (con peso decreciente) y la búsqueda de texto usa la
+        pregunta tal cual. Opcionalmente, una reformulación con el LLM corre
+        en paralelo y solo se usa si llega dentro del presupuesto.
+
         Args:
             question: Pregunta actual
-            conversation_history: Historial de conversación
+            conversation_history: Historial enviado por el cliente (opcional)
             context_limit: Documentos de contexto
             temperature: Temperatura del modelo
+            session_id: Id de la sesión de servidor (se crea si no existe)
+            max_tokens: Tokens máximos de respuesta
 
         Returns:
             Respuesta RAG con contexto conversacional
         """
         try:
-            # Reformular pregunta considerando el historial
-            reformulated_query = self._reformulate_with_history(
-                question,
-                conversation_history
+            start = time.perf_counter()
+
+            if conversation_history is not None and session_id is None:
+                session = None
+                turns = conversation_history[-settings.SESSION_WINDOW_TURNS:]
+                history_text = PromptTemplates.format_history(
+                    turns,
+                    max_answer_chars=settings.SESSION_TURN_MAX_CHARS
+                )
+            else:
+                session = await session_store.get_or_create(session_id)
+                turns = session["turns"]
+                history_text = session_store.history_text(session)
+
+            # Reformulación especulativa con el LLM, en paralelo con la recuperación
+            rewrite_task = None
+            if settings.CONVERSATION_LLM_REWRITE and history_text:
+                rewrite_task = asyncio.create_task(
+                    self._reformulate_with_history(question, history_text)
+                )
+
+            question_embedding, query_embedding = await self._conversation_embedding(question, turns)
+
+            context_docs = await search_service.search(
+                query=question,
+                search_type=SearchType.HYBRID,
+                limit=context_limit,
+                query_embedding=query_embedding
             )
 
-            # Generar respuesta con query reformulada
+            search_query = question
+            if rewrite_task is not None:
+                budget = settings.CONVERSATION_REWRITE_BUDGET_MS / 1000
+                remaining = budget - (time.perf_counter() - start)
+                done, _ = await asyncio.wait({rewrite_task}, timeout=max(0.0, remaining))
+
+                if done and rewrite_task.result() != question:
+                    search_query = rewrite_task.result()
+                    context_docs = await search_service.search(
+                        query=search_query,
+                        search_type=SearchType.HYBRID,
+                        limit=context_limit
+                    )
+                elif not done:
+                    rewrite_task.cancel()
+                    logger.debug("Reformulación descartada: fuera de presupuesto")
+
             result = await self.generate_answer(
-                question=reformulated_query,
+                question=question,
                 context_limit=context_limit,
-                temperature=temperature
+                temperature=temperature,
+                max_tokens=max_tokens,
+                context_docs=context_docs,
+                conversation_history=history_text or None
             )
 
             # Mantener la pregunta original en la respuesta
             result["original_question"] = question
-            result["reformulated_query"] = reformulated_query
+            result["reformulated_query"] = search_query
+
+            if session is not None:
+                session = await session_store.add_turn(
+                    session["_id"],
+                    question,
+                    result["answer"],
+                    embedding=question_embedding
+                )
+                result["session_id"] = session["_id"]
+                result["turns"] = session["total_turns"]
+                result["history_chars"] = len(history_text)
 
             return result
 
@@ -175,44 +600,70 @@ class RAGService:
             logger.error(f"Error en conversational RAG: {e}")
             raise
 
-    def _reformulate_with_history(
+    async def _conversation_embedding(
         self,
         question: str,
-        history: List[Dict[str, str]]
-    ) -> str:
+        turns: List[Dict[str, Any]]
+    ) -> Tuple[List[float], List[float]]:
         """
-        Reformula la pregunta considerando el historial
+        Embedding de la pregunta y vector de recuperación conversacional
+
+        Los turnos de sesión traen su embedding cacheado; solo se calculan
+        (en un único batch con la pregunta) los que falten.
 
         Args:
             question: Pregunta actual
-            history: Historial de conversación
+            turns: Turnos recientes, del más antiguo al más reciente
 
         Returns:
-            Pregunta reformulada
+            Tupla (embedding de la pregunta, vector combinado con el historial)
         """
-        if not history:
-            return question
-
-        # Tomar las últimas 3 interacciones
-        recent_history = history[-3:]
-
-        # Construir contexto de historial
-        history_context = "\n".join([
-            f"Usuario: {h.get('question', '')}\nAsistente: {h.get('answer', '')}"
-            for h in recent_history
-        ])
+        missing = [turn.get("question", "") for turn in turns if not turn.get("embedding")]
+        embeddings = await asyncio.to_thread(
+            embedding_service.generate_text_embeddings_batch,
+            [question] + missing
+        )
+        question_embedding, computed = embeddings[0], iter(embeddings[1:])
+
+        history = [turn.get("embedding") or next(computed) for turn in turns]
+        combined = combine_embeddings_with_decay(
+            question_embedding,
+            history,
+            history_weight=settings.CONVERSATION_HISTORY_WEIGHT,
+            decay=settings.CONVERSATION_HISTORY_DECAY
+        )
+        return question_embedding, combined
+
+    async def _reformulate_with_history(self, question: str, history: str) -> str:
+        """
+        Reformula la pregunta como consulta autónoma usando el historial
 
-        # Reformular considerando el contexto
-        reformulated = f"""Historial de conversación:
-{history_context}
+        Args:
+            question: Pregunta actual
+            history: Historial formateado (resumen + últimos turnos)
 
-Pregunta actual: {question}
+        Returns:
+            Pregunta reformulada (la original si no hay historial o falla el LLM)
+        """
+        if not history:
+            return question
 
-Pregunta reformulada considerando el contexto:"""
+        try:
+            reformulated = await llm_service.generate_response_async(
+                prompt=PromptTemplates.format_reformulation_prompt(question, history),
+                system_message=(
+                    "Reescribe la pregunta para que se entienda sin el historial. "
+                    "Responde solo con la pregunta reformulada."
+                ),
+                temperature=0.0,
+                max_tokens=128,
+                task="rewrite"
+            )
+            return reformulated.strip().strip('"') or question
 
-        # Nota: En una implementación completa, usarías el LLM para reformular
-        # Por ahora, retornamos la pregunta original con algo de contexto
-        return f"{question} (contexto: {history[-1].get('question', '') if history else ''})"
+        except Exception as e:
+            logger.warning(f"No se pudo reformular la pregunta: {e}")
+            return question
 
 
 # Singleton instance
@@ -0,0 +1,199 @@
+"""
+Compuerta de relevancia antes de generar con el LLM
+
+Si la recuperación no trae ningún documento suficientemente parecido a la
+pregunta, llamar a Groq solo sirve para que responda "no está en el
+contexto". La compuerta compara la distribución de scores vectoriales con
+un umbral calibrado por colección y, por debajo, responde de inmediato (o
+con fragmentos extractivos de los documentos más cercanos).
+
+Umbrales, por orden de prioridad:
+    1. RELEVANCE_THRESHOLDS (JSON en settings) {"coleccion": umbral}
+    2. RELEVANCE_THRESHOLDS_FILE, generado por scripts/calibrate_relevance.py
+    3. SIMILARITY_THRESHOLD
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import re
+
+from config.settings import settings
+from models.schemas import SearchType
+from utils.helpers import split_sentences
+
+logger = logging.getLogger(__name__)
+
+NO_RELEVANT_ANSWER = (
+    "No encontré información suficientemente relevante en los documentos "
+    "para responder a esta pregunta."
+)
+
+
+def calibrate_threshold(positive_scores: List[float], negative_scores: List[float]) -> float:
+    """
+    Umbral que mejor separa preguntas con y sin respuesta en la colección
+
+    Prueba como corte cada score observado y elige el que maximiza la
+    exactitud balanceada (media de aciertos en ambos grupos).
+
+    Args:
+        positive_scores: Top score de preguntas que sí tienen respuesta
+        negative_scores: Top score de preguntas sin respuesta en la colección
+
+    Returns:
+        Umbral calibrado
+    """
+    if not positive_scores or not negative_scores:
+        raise ValueError("Se necesitan preguntas con y sin respuesta para calibrar")
+
+    best_threshold, best_accuracy = settings.SIMILARITY_THRESHOLD, -1.0
+    for candidate in sorted(set(positive_scores) | set(negative_scores)):
+        true_positive = sum(score >= candidate for score in positive_scores) / len(positive_scores)
+        true_negative = sum(score < candidate for score in negative_scores) / len(negative_scores)
+        accuracy = (true_positive + true_negative) / 2
+        if accuracy > best_accuracy:
+            best_threshold, best_accuracy = candidate, accuracy
+
+    return best_threshold
+
+
+class RelevanceGate:
+    """Decide si merece la pena llamar al LLM con el contexto recuperado"""
+
+    def __init__(self, thresholds_file: str = None):
+        """
+        Args:
+            thresholds_file: JSON de umbrales calibrados por colección
+        """
+        self.thresholds_file = Path(thresholds_file or settings.RELEVANCE_THRESHOLDS_FILE)
+        self._file_thresholds: Optional[Dict[str, float]] = None
+        self._file_mtime: Optional[float] = None
+        self.evaluated = 0
+        self.gated = 0
+        self.extractive_answers = 0
+
+    def _calibrated_thresholds(self) -> Dict[str, float]:
+        """Umbrales del archivo de calibración (se recargan si cambia)"""
+        try:
+            mtime = self.thresholds_file.stat().st_mtime
+        except OSError:
+            return {}
+
+        if mtime != self._file_mtime:
+            with open(self.thresholds_file, "r", encoding="utf-8") as f:
+                self._file_thresholds = json.load(f).get("thresholds", {})
+            self._file_mtime = mtime
+
+        return self._file_thresholds or {}
+
+    def threshold_for(self, collection_name: str = None) -> float:
+        """Umbral de relevancia de una colección"""
+        collection_name = collection_name or settings.DOCUMENTS_COLLECTION
+
+        overrides = json.loads(settings.RELEVANCE_THRESHOLDS or "{}")
+        if collection_name in overrides:
+            return float(overrides[collection_name])
+
+        calibrated = self._calibrated_thresholds()
+        if collection_name in calibrated:
+            return float(calibrated[collection_name])
+
+        return settings.SIMILARITY_THRESHOLD
+
+    def evaluate(
+        self,
+        context_docs: List[Dict[str, Any]],
+        search_type: SearchType = SearchType.HYBRID,
+        collection_name: str = None
+    ) -> Dict[str, Any]:
+        """
+        Evalúa la distribución de scores de la recuperación
+
+        Solo se usan scores vectoriales (en híbrida, el vector_score
+        original): los de texto no son comparables con un umbral fijo.
+
+        Args:
+            context_docs: Documentos recuperados
+            search_type: Tipo de búsqueda usada
+            collection_name: Colección consultada
+
+        Returns:
+            Dict con passed, threshold y estadísticas de los scores
+        """
+        threshold = self.threshold_for(collection_name)
+
+        if search_type == SearchType.FULLTEXT:
+            scores = []
+        elif search_type == SearchType.HYBRID:
+            scores = [doc["vector_score"] for doc in context_docs if doc.get("vector_score") is not None]
+        else:
+            scores = [doc.get("score", 0) for doc in context_docs]
+
+        report = {
+            "threshold": threshold,
+            "top_score": max(scores) if scores else None,
+            "mean_score": round(sum(scores) / len(scores), 4) if scores else None,
+            "above_threshold": sum(score >= threshold for score in scores),
+            "passed": True
+        }
+
+        if not settings.RELEVANCE_GATE_ENABLED or not context_docs:
+            return report
+
+        self.evaluated += 1
+        # Sin scores vectoriales (solo texto) no hay evidencia para cortar
+        if scores and report["top_score"] < threshold:
+            report["passed"] = False
+            self.gated += 1
+
+        return report
+
+    def fallback_answer(self, question: str, context_docs: List[Dict[str, Any]]) -> str:
+        """
+        Respuesta sin LLM para consultas por debajo del umbral
+
+        En modo "extractive" añade, de los documentos más cercanos, la
+        oración que más palabras comparte con la pregunta.
+
+        Args:
+            question: Pregunta del usuario
+            context_docs: Documentos recuperados
+
+        Returns:
+            Texto de la respuesta
+        """
+        if settings.RELEVANCE_GATE_MODE != "extractive" or not context_docs:
+            return NO_RELEVANT_ANSWER
+
+        question_words = {word for word in re.findall(r"\w+", question.lower()) if len(word) > 3}
+        snippets = []
+
+        for doc in context_docs[:settings.RELEVANCE_GATE_SNIPPETS]:
+            sentences = split_sentences(doc.get("content", ""))
+            if not sentences:
+                continue
+            best = max(
+                sentences,
+                key=lambda sentence: len(question_words & set(re.findall(r"\w+", sentence.lower())))
+            )
+            snippets.append(f"- {doc.get('title', 'Sin título')}: {best}")
+
+        if not snippets:
+            return NO_RELEVANT_ANSWER
+
+        self.extractive_answers += 1
+        return NO_RELEVANT_ANSWER + " Fragmentos más cercanos:\n" + "\n".join(snippets)
+
+    def stats(self) -> Dict[str, Any]:
+        """Consultas evaluadas y llamadas al LLM evitadas"""
+        return {
+            "evaluated": self.evaluated,
+            "llm_calls_avoided": self.gated,
+            "gate_rate": round(self.gated / self.evaluated, 4) if self.evaluated else 0.0,
+            "extractive_answers": self.extractive_answers
+        }
+
+
+# Singleton instance
+relevance_gate = RelevanceGate()
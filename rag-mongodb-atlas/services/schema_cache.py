@@ -0,0 +1,301 @@
+"""
+Caché del esquema inferido de las colecciones
+
+El esquema se infiere de un $sample de SCHEMA_SAMPLE_SIZE documentos por
+colección: rutas anidadas (a.b.c, también dentro de arrays), unión de tipos
+por ruta y frecuencia con que aparece cada campo. Se calcula al arrancar y
+se refresca en segundo plano (periódicamente y, si hay change streams, solo
+las colecciones que cambian), de modo que /api/query y /api/database/schema
+no hacen ninguna consulta de esquema por petición.
+"""
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Set
+import asyncio
+import logging
+import time
+
+from bson import Binary, Decimal128, ObjectId
+
+from config.database import mongodb
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def bson_type_name(value: Any) -> str:
+    """Nombre del tipo BSON de un valor, como lo muestra MongoDB"""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int" if -2**31 <= value < 2**31 else "long"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, (Decimal, Decimal128)):
+        return "decimal"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, ObjectId):
+        return "objectId"
+    if isinstance(value, (bytes, Binary)):
+        return "binData"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, (list, tuple)):
+        return "array"
+    return type(value).__name__
+
+
+def infer_schema(documents: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Infiere el esquema de una muestra de documentos
+
+    Los subcampos de objetos, también dentro de arrays, usan notación de
+    puntos (items.producto_id), igual que en las consultas de MongoDB.
+
+    Args:
+        documents: Documentos de muestra
+
+    Returns:
+        {ruta: {"types": {tipo: apariciones}, "frequency": fracción de documentos}}
+    """
+    fields: Dict[str, Dict[str, Any]] = {}
+
+    def visit(value: Any, path: str, seen: Set[str]):
+        entry = fields.setdefault(path, {"types": {}, "documents": 0})
+        type_name = bson_type_name(value)
+        if type_name == "array":
+            element_types = sorted({bson_type_name(item) for item in value})
+            type_name = f"array<{'|'.join(element_types)}>" if element_types else "array"
+        entry["types"][type_name] = entry["types"].get(type_name, 0) + 1
+        if path not in seen:
+            seen.add(path)
+            entry["documents"] += 1
+
+        if isinstance(value, dict):
+            for key, child in value.items():
+                visit(child, f"{path}.{key}", seen)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                if isinstance(item, dict):
+                    for key, child in item.items():
+                        visit(child, f"{path}.{key}", seen)
+
+    for document in documents:
+        seen: Set[str] = set()
+        for key, value in document.items():
+            if key != "_id":
+                visit(value, key, seen)
+
+    total = len(documents) or 1
+    return {
+        path: {
+            "types": dict(sorted(entry["types"].items(), key=lambda item: -item[1])),
+            "frequency": round(entry["documents"] / total, 3)
+        }
+        for path, entry in fields.items()
+    }
+
+
+class SchemaCache:
+    """Esquemas por colección, refrescados en segundo plano"""
+
+    def __init__(self, sample_size: int = None):
+        """
+        Args:
+            sample_size: Documentos muestreados por colección
+        """
+        self.sample_size = sample_size or settings.SCHEMA_SAMPLE_SIZE
+        self._schemas: Dict[str, Dict[str, Any]] = {}
+        self._refreshed_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._dirty: Set[str] = set()
+        self._dirty_task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.collection_refreshes = 0
+
+    @staticmethod
+    def _internal_collections() -> Set[str]:
+        """Colecciones de la propia aplicación, que no se ofrecen al LLM"""
+        return {
+            settings.SESSIONS_COLLECTION,
+            settings.ANSWER_STORE_COLLECTION,
+            settings.QUERY_LOG_COLLECTION,
+            settings.ANSWER_STORE_LEASES_COLLECTION,
+            settings.QUERY_SHAPES_COLLECTION
+        }
+
+    def _is_visible(self, collection_name: str) -> bool:
+        return not collection_name.startswith("system.") and collection_name not in self._internal_collections()
+
+    async def _sample_collection(self, collection_name: str) -> Dict[str, Any]:
+        """Muestrea una colección e infiere su esquema"""
+        collection = mongodb.get_collection(collection_name)
+        documents = await collection.aggregate([{"$sample": {"size": self.sample_size}}]).to_list(length=None)
+        return {
+            # Estimación por metadatos: no recorre la colección
+            "count": await collection.estimated_document_count(),
+            "sample_size": len(documents),
+            "fields": infer_schema(documents),
+            "refreshed_at": datetime.utcnow()
+        }
+
+    async def refresh(self, collection_names: Optional[Iterable[str]] = None):
+        """
+        Vuelve a muestrear las colecciones indicadas (o todas)
+
+        Args:
+            collection_names: Colecciones a refrescar; None = todas
+        """
+        start = time.perf_counter()
+
+        full = collection_names is None
+        if full:
+            names = [name for name in await mongodb.db.list_collection_names() if self._is_visible(name)]
+        else:
+            names = [name for name in collection_names if self._is_visible(name)]
+
+        schemas = await asyncio.gather(*(self._sample_collection(name) for name in names))
+        self._schemas.update(zip(names, schemas))
+        self.collection_refreshes += len(names)
+
+        if full:
+            # Las colecciones eliminadas desaparecen del esquema
+            for name in set(self._schemas) - set(names):
+                self._schemas.pop(name, None)
+            self.refreshes += 1
+            # Solo ahora: get() no debe ver la caché como lista a medio muestrear
+            self._refreshed_at = time.monotonic()
+
+        logger.info(
+            f"Esquema refrescado: {len(names)} colecciones en "
+            f"{(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+    async def get(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Esquemas cacheados; solo consulta MongoDB la primera vez
+
+        Returns:
+            {coleccion: {"count", "sample_size", "fields", "refreshed_at"}}
+        """
+        if self._refreshed_at is None:
+            async with self._lock:
+                if self._refreshed_at is None:
+                    await self.refresh()
+        return self._schemas
+
+    async def prompt_text(self) -> str:
+        """Esquema en texto para el prompt de /api/query"""
+        schemas = await self.get()
+        parts = ["COLECCIONES DISPONIBLES:\n"]
+
+        for idx, (name, schema) in enumerate(sorted(schemas.items()), 1):
+            parts.append(f"\n{idx}. {name} (~{schema['count']} documentos):")
+            if not schema["fields"]:
+                parts.append("   (Colección vacía)")
+                continue
+
+            fields = list(schema["fields"].items())[:settings.SCHEMA_PROMPT_MAX_FIELDS]
+            for path, info in fields:
+                types = "|".join(info["types"])
+                optional = f", en el {info['frequency']:.0%}" if info["frequency"] < 1 else ""
+                parts.append(f"   - {path} ({types}{optional})")
+
+            omitted = len(schema["fields"]) - len(fields)
+            if omitted > 0:
+                parts.append(f"   - ... y {omitted} campos más")
+
+        return "\n".join(parts)
+
+    async def collections_info(self) -> List[Dict[str, Any]]:
+        """Resumen por colección para /api/database/schema"""
+        schemas = await self.get()
+        return [
+            {
+                "name": name,
+                "count": schema["count"],
+                "sample_size": schema["sample_size"],
+                "fields": [
+                    {"name": path, "type": "|".join(info["types"]), "frequency": info["frequency"]}
+                    for path, info in schema["fields"].items()
+                ],
+                "refreshed_at": schema["refreshed_at"]
+            }
+            for name, schema in sorted(schemas.items())
+        ]
+
+    async def run(self):
+        """
+        Tarea de fondo: refresco periódico completo y, con change streams,
+        refresco de las colecciones que cambian (agrupando ráfagas)
+        """
+        watcher = None
+        if settings.SCHEMA_CACHE_WATCH_CHANGES:
+            watcher = asyncio.create_task(self._watch_changes())
+
+        try:
+            while True:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.warning(f"Error refrescando el esquema: {e}")
+                await asyncio.sleep(settings.SCHEMA_CACHE_REFRESH_SECONDS)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if self._dirty_task is not None:
+                self._dirty_task.cancel()
+
+    async def _watch_changes(self):
+        """Marca las colecciones modificadas y las vuelve a muestrear"""
+        pipeline = [{"$match": {"ns.coll": {"$nin": sorted(self._internal_collections())}}}]
+
+        try:
+            async with mongodb.db.watch(pipeline) as stream:
+                logger.info("👀 Caché de esquema observando cambios")
+                async for change in stream:
+                    collection_name = change.get("ns", {}).get("coll")
+                    if not collection_name or not self._is_visible(collection_name):
+                        continue
+
+                    if change["operationType"] in ("drop", "rename"):
+                        self._schemas.pop(collection_name, None)
+                        continue
+
+                    if not self._dirty:
+                        self._dirty_task = asyncio.create_task(self._refresh_dirty())
+                    self._dirty.add(collection_name)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Caché de esquema sin change streams ({e}); solo refresco periódico")
+
+    async def _refresh_dirty(self):
+        await asyncio.sleep(settings.SCHEMA_CACHE_CHANGE_DELAY_SECONDS)
+        names, self._dirty = sorted(self._dirty), set()
+        try:
+            await self.refresh(names)
+        except Exception as e:
+            logger.warning(f"Error refrescando el esquema de {names}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Colecciones cacheadas, refrescos y antigüedad"""
+        return {
+            "collections": len(self._schemas),
+            "full_refreshes": self.refreshes,
+            "collection_refreshes": self.collection_refreshes,
+            "age_seconds": (
+                round(time.monotonic() - self._refreshed_at, 1)
+                if self._refreshed_at is not None else None
+            )
+        }
+
+
+# Singleton instance
+schema_cache = SchemaCache()
@@ -1,13 +1,15 @@
 """
 Servicio de búsqueda vectorial e híbrida usando MongoDB Atlas
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import logging
 
 from config.database import mongodb
 from config.settings import settings
 from services.embedding_service import embedding_service
+from services.exact_search_service import exact_search_service
 from models.schemas import SearchType
+from utils.profiling import RequestProfiler, profile_stage
 
 logger = logging.getLogger(__name__)
 
@@ -15,12 +17,107 @@ logger = logging.getLogger(__name__)
 class SearchService:
     """Servicio para búsqueda vectorial e híbrida en MongoDB Atlas"""
 
-    async def vector_search(
+    def _vector_search_pipeline(
+        self,
+        query_embedding: List[float],
+        limit: int = 10,
+        min_score: float = None
+    ) -> List[Dict[str, Any]]:
+        """Construye el pipeline de agregación para Atlas Vector Search"""
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": "vector_index",
+                    "path": "embedding",
+                    "queryVector": query_embedding,
+                    "numCandidates": limit * 10,
+                    "limit": limit
+                }
+            },
+            {
+                "$project": {
+                    "_id": 1,
+                    "title": 1,
+                    "content": 1,
+                    "metadata": 1,
+                    "tags": 1,
+                    "updated_at": 1,
+                    "score": {"$meta": "vectorSearchScore"}
+                }
+            }
+        ]
+
+        # Agregar filtro de score mínimo si se especifica
+        if min_score:
+            pipeline.append({
+                "$match": {
+                    "score": {"$gte": min_score}
+                }
+            })
+
+        return pipeline
+
+    def _vector_search_cursor(
         self,
         query: str,
         collection_name: str = None,
         limit: int = 10,
         min_score: float = None
+    ):
+        """Construye el cursor de agregación para Atlas Vector Search"""
+        # Generar embedding del query
+        query_embedding = embedding_service.generate_text_embedding(query)
+
+        # Obtener colección
+        coll_name = collection_name or settings.DOCUMENTS_COLLECTION
+        collection = mongodb.get_collection(coll_name)
+
+        pipeline = self._vector_search_pipeline(query_embedding, limit, min_score)
+        return collection.aggregate(pipeline)
+
+    def _fulltext_search_cursor(
+        self,
+        query: str,
+        collection_name: str = None,
+        limit: int = 10
+    ):
+        """Construye el cursor de búsqueda $text ordenado por textScore"""
+        # Obtener colección
+        coll_name = collection_name or settings.DOCUMENTS_COLLECTION
+        collection = mongodb.get_collection(coll_name)
+
+        # Búsqueda de texto
+        return collection.find(
+            {"$text": {"$search": query}},
+            {"score": {"$meta": "textScore"}}
+        ).sort(
+            [("score", {"$meta": "textScore"})]
+        ).limit(limit)
+
+    async def _explain(self, profiler: RequestProfiler, stage: str, command: Dict[str, Any]):
+        """
+        Ejecuta explain (executionStats) y lo adjunta al perfil
+
+        Un fallo de explain no debe romper la búsqueda perfilada.
+        """
+        try:
+            explain = await mongodb.db.command({
+                "explain": command,
+                "verbosity": "executionStats"
+            })
+            profiler.add_explain(stage, explain)
+        except Exception as e:
+            logger.warning(f"No se pudo obtener explain de {stage}: {e}")
+            profiler.add_explain(stage, {"error": str(e)})
+
+    async def vector_search(
+        self,
+        query: str,
+        collection_name: str = None,
+        limit: int = 10,
+        min_score: float = None,
+        profiler: Optional[RequestProfiler] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
         """
         Búsqueda vectorial usando Atlas Vector Search
@@ -30,52 +127,36 @@ class SearchService:
             collection_name: Nombre de la colección
             limit: Número máximo de resultados
             min_score: Score mínimo de similitud
+            profiler: Perfil de la petición (opcional)
+            query_embedding: Embedding ya calculado del query (opcional)
 
         Returns:
             Lista de documentos con scores
         """
         try:
             # Generar embedding del query
-            query_embedding = embedding_service.generate_text_embedding(query)
+            if query_embedding is None:
+                with profile_stage(profiler, "embedding"):
+                    query_embedding = embedding_service.generate_text_embedding(query)
 
             # Obtener colección
             coll_name = collection_name or settings.DOCUMENTS_COLLECTION
             collection = mongodb.get_collection(coll_name)
 
-            # Pipeline de agregación para vector search
-            pipeline = [
-                {
-                    "$vectorSearch": {
-                        "index": "vector_index",
-                        "path": "embedding",
-                        "queryVector": query_embedding,
-                        "numCandidates": limit * 10,
-                        "limit": limit
-                    }
-                },
-                {
-                    "$project": {
-                        "_id": 1,
-                        "title": 1,
-                        "content": 1,
-                        "metadata": 1,
-                        "tags": 1,
-                        "score": {"$meta": "vectorSearchScore"}
-                    }
-                }
-            ]
-
-            # Agregar filtro de score mínimo si se especifica
-            if min_score:
-                pipeline.append({
-                    "$match": {
-                        "score": {"$gte": min_score}
-                    }
-                })
+            pipeline = self._vector_search_pipeline(query_embedding, limit, min_score)
 
             # Ejecutar búsqueda
-            cursor = collection.aggregate(pipeline)
-            results = await cursor.to_list(length=limit)
+            with profile_stage(profiler, "vector_search"):
+                cursor = collection.aggregate(pipeline)
+                results = await cursor.to_list(length=limit)
+
+            if profiler:
+                profiler.record("vector_candidates", len(results))
+                await self._explain(profiler, "vector_search", {
+                    "aggregate": coll_name,
+                    "pipeline": pipeline,
+                    "cursor": {}
+                })
 
             logger.info(f"Vector search: {len(results)} resultados para '{query}'")
             return results
@@ -84,37 +165,100 @@ class SearchService:
             logger.error(f"Error en vector search: {e}")
             raise
 
-    async def fulltext_search(
+    async def exact_search(
         self,
         query: str,
         collection_name: str = None,
-        limit: int = 10
+        limit: int = 10,
+        min_score: float = None,
+        profiler: Optional[RequestProfiler] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
         """
-        Búsqueda de texto completo usando índices de texto de MongoDB
+        Búsqueda vectorial exacta (fuerza bruta) sobre la matriz exportada
+
+        Pensada para colecciones pequeñas y medianas, donde el producto punto
+        contra todos los embeddings es más rápido que $vectorSearch y exacto.
+        Si la colección no tiene matriz exportada se usa vector search.
 
         Args:
             query: Query de búsqueda
             collection_name: Nombre de la colección
             limit: Número máximo de resultados
+            min_score: Score mínimo de similitud
+            profiler: Perfil de la petición (opcional)
+            query_embedding: Embedding ya calculado del query (opcional)
 
         Returns:
             Lista de documentos con scores
         """
         try:
-            # Obtener colección
             coll_name = collection_name or settings.DOCUMENTS_COLLECTION
-            collection = mongodb.get_collection(coll_name)
 
-            # Búsqueda de texto
-            cursor = collection.find(
-                {"$text": {"$search": query}},
-                {"score": {"$meta": "textScore"}}
-            ).sort(
-                [("score", {"$meta": "textScore"})]
-            ).limit(limit)
+            if not exact_search_service.has_index(coll_name):
+                logger.warning(
+                    f"Sin matriz exportada para '{coll_name}', usando vector search "
+                    f"(ejecuta scripts/export_embeddings.py)"
+                )
+                return await self.vector_search(
+                    query, coll_name, limit, min_score, profiler, query_embedding
+                )
+
+            if query_embedding is None:
+                with profile_stage(profiler, "embedding"):
+                    query_embedding = embedding_service.generate_text_embedding(query)
+
+            with profile_stage(profiler, "exact_search"):
+                results = await exact_search_service.search(
+                    query_embedding=query_embedding,
+                    collection_name=coll_name,
+                    limit=limit,
+                    min_score=min_score
+                )
+
+            if profiler:
+                profiler.record("exact_candidates", len(results))
+
+            logger.info(f"Exact search: {len(results)} resultados para '{query}'")
+            return results
 
-            results = await cursor.to_list(length=limit)
+        except Exception as e:
+            logger.error(f"Error en exact search: {e}")
+            raise
+
+    async def fulltext_search(
+        self,
+        query: str,
+        collection_name: str = None,
+        limit: int = 10,
+        profiler: Optional[RequestProfiler] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Búsqueda de texto completo usando índices de texto de MongoDB
+
+        Args:
+            query: Query de búsqueda
+            collection_name: Nombre de la colección
+            limit: Número máximo de resultados
+            profiler: Perfil de la petición (opcional)
+
+        Returns:
+            Lista de documentos con scores
+        """
+        try:
+            with profile_stage(profiler, "text_search"):
+                cursor = self._fulltext_search_cursor(query, collection_name, limit)
+                results = await cursor.to_list(length=limit)
+
+            if profiler:
+                profiler.record("text_candidates", len(results))
+                await self._explain(profiler, "text_search", {
+                    "find": collection_name or settings.DOCUMENTS_COLLECTION,
+                    "filter": {"$text": {"$search": query}},
+                    "projection": {"score": {"$meta": "textScore"}},
+                    "sort": {"score": {"$meta": "textScore"}},
+                    "limit": limit
+                })
 
             logger.info(f"Fulltext search: {len(results)} resultados para '{query}'")
             return results
@@ -128,7 +272,9 @@ class SearchService:
         query: str,
         collection_name: str = None,
         limit: int = 10,
-        vector_weight: float = 0.7
+        vector_weight: float = 0.7,
+        profiler: Optional[RequestProfiler] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
         """
         Búsqueda híbrida combinando vector search y fulltext search
@@ -138,21 +284,32 @@ class SearchService:
             collection_name: Nombre de la colección
             limit: Número máximo de resultados
             vector_weight: Peso de la búsqueda vectorial (0-1)
+            profiler: Perfil de la petición (opcional)
+            query_embedding: Embedding ya calculado del query (opcional)
 
         Returns:
             Lista de documentos con scores combinados
         """
         try:
             # Realizar ambas búsquedas en paralelo
-            vector_results = await self.vector_search(query, collection_name, limit * 2)
-            text_results = await self.fulltext_search(query, collection_name, limit * 2)
+            vector_results = await self.vector_search(
+                query, collection_name, limit * 2,
+                profiler=profiler, query_embedding=query_embedding
+            )
+            text_results = await self.fulltext_search(
+                query, collection_name, limit * 2, profiler=profiler
+            )
 
             # Combinar resultados
-            combined_results = self._combine_search_results(
-                vector_results,
-                text_results,
-                vector_weight
-            )
+            with profile_stage(profiler, "fusion"):
+                combined_results = self._combine_search_results(
+                    vector_results,
+                    text_results,
+                    vector_weight
+                )
+
+            if profiler:
+                profiler.record("fused_candidates", len(combined_results))
 
             # Limitar resultados
             final_results = combined_results[:limit]
@@ -191,7 +348,8 @@ class SearchService:
             normalized_score = result.get("score", 0) / max_vector_score
             combined[doc_id] = {
                 "document": result,
-                "score": normalized_score * vector_weight
+                "score": normalized_score * vector_weight,
+                "vector_score": result.get("score", 0)
             }
 
         # Normalizar y combinar scores de text search
@@ -217,9 +375,14 @@ class SearchService:
             reverse=True
         )
 
-        # Retornar documentos con score combinado
+        # Retornar documentos con score combinado (y el vectorial original,
+        # comparable entre consultas, cuando el documento vino de vector search)
         return [
-            {**item["document"], "score": item["score"]}
+            {
+                **item["document"],
+                "score": item["score"],
+                **({"vector_score": item["vector_score"]} if "vector_score" in item else {})
+            }
             for item in sorted_results
         ]
 
@@ -228,7 +391,9 @@ class SearchService:
         query: str,
         search_type: SearchType = SearchType.VECTOR,
         collection_name: str = None,
-        limit: int = 10
+        limit: int = 10,
+        profiler: Optional[RequestProfiler] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
         """
         Método unificado de búsqueda
@@ -238,19 +403,68 @@ class SearchService:
             search_type: Tipo de búsqueda
             collection_name: Nombre de la colección
             limit: Número máximo de resultados
+            profiler: Perfil de la petición (opcional)
+            query_embedding: Embedding ya calculado del query (opcional)
 
         Returns:
             Lista de resultados
         """
         if search_type == SearchType.VECTOR:
-            return await self.vector_search(query, collection_name, limit)
+            return await self.vector_search(
+                query, collection_name, limit,
+                profiler=profiler, query_embedding=query_embedding
+            )
         elif search_type == SearchType.FULLTEXT:
-            return await self.fulltext_search(query, collection_name, limit)
+            return await self.fulltext_search(query, collection_name, limit, profiler=profiler)
         elif search_type == SearchType.HYBRID:
-            return await self.hybrid_search(query, collection_name, limit)
+            return await self.hybrid_search(
+                query, collection_name, limit,
+                profiler=profiler, query_embedding=query_embedding
+            )
+        elif search_type == SearchType.EXACT:
+            return await self.exact_search(
+                query, collection_name, limit,
+                profiler=profiler, query_embedding=query_embedding
+            )
         else:
             raise ValueError(f"Tipo de búsqueda no soportado: {search_type}")
 
+    async def search_stream(
+        self,
+        query: str,
+        search_type: SearchType = SearchType.VECTOR,
+        collection_name: str = None,
+        limit: int = 10
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Variante en streaming de search(): entrega cada documento a medida
+        que el cursor de Motor lo produce
+
+        Vector y fulltext se leen directamente del cursor. Híbrida y exacta
+        necesitan el conjunto completo para ordenar, así que se entregan tras
+        la fusión.
+
+        Args:
+            query: Query de búsqueda
+            search_type: Tipo de búsqueda
+            collection_name: Nombre de la colección
+            limit: Número máximo de resultados
+
+        Yields:
+            Documentos con score, en orden de relevancia
+        """
+        if search_type == SearchType.VECTOR:
+            cursor = self._vector_search_cursor(query, collection_name, limit)
+        elif search_type == SearchType.FULLTEXT:
+            cursor = self._fulltext_search_cursor(query, collection_name, limit)
+        else:
+            for doc in await self.search(query, search_type, collection_name, limit):
+                yield doc
+            return
+
+        async for doc in cursor:
+            yield doc
+
 
 # Singleton instance
 search_service = SearchService()
@@ -0,0 +1,337 @@
+"""
+Sesiones de conversación del lado del servidor
+
+Cada sesión guarda una ventana acotada de turnos recientes y un resumen
+acumulado de los anteriores. Cuando la ventana se desborda, los turnos
+sobrantes quedan pendientes y una tarea en segundo plano los incorpora al
+resumen con el LLM, sin retrasar la respuesta. Así el cliente solo envía el
+session_id y el prompt de historial no crece con la conversación.
+
+Backends: memoria (un solo proceso) o MongoDB (compartido entre workers,
+con índice TTL sobre expires_at). Las escrituras son atómicas por campo
+($inc del contador, $push con $slice de la ventana, $pull de los turnos ya
+resumidos) y el resumen se guarda con una condición sobre el último turno
+resumido, así que dos workers que escriben a la vez la misma sesión no se
+pisan.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import copy
+import logging
+import time
+import uuid
+
+from pymongo import ReturnDocument
+
+from config.database import mongodb
+from config.settings import settings
+from services.llm_service import llm_service
+from utils.prompts import PromptTemplates
+
+logger = logging.getLogger(__name__)
+
+
+def new_session(session_id: Optional[str], ttl_seconds: float) -> Dict[str, Any]:
+    """Documento de una sesión vacía"""
+    now = datetime.utcnow()
+    return {
+        "_id": session_id or uuid.uuid4().hex,
+        "summary": "",
+        # Ventana de turnos recientes (con embedding)
+        "turns": [],
+        # Turnos aún no incorporados al resumen (sin embedding), acotados
+        "unsummarized": [],
+        "summarized_through": 0,
+        "total_turns": 0,
+        "created_at": now,
+        "updated_at": now,
+        "expires_at": now + timedelta(seconds=ttl_seconds)
+    }
+
+
+def _lite(turn: Dict[str, Any]) -> Dict[str, Any]:
+    # Los embeddings solo se usan dentro de la ventana
+    return {k: v for k, v in turn.items() if k != "embedding"}
+
+
+class MemorySessionBackend:
+    """Sesiones en un dict del proceso, con expiración perezosa"""
+
+    def __init__(self):
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session["expires_at"] < datetime.utcnow():
+            del self._sessions[session_id]
+            return None
+        return copy.deepcopy(session)
+
+    async def append_turn(
+        self,
+        session_id: str,
+        turn: Dict[str, Any],
+        window: int,
+        max_unsummarized: int,
+        ttl_seconds: float
+    ) -> Dict[str, Any]:
+        # Sin await entre lectura y escritura: atómico dentro del proceso
+        session = await self.load(session_id) or new_session(session_id, ttl_seconds)
+        session["total_turns"] += 1
+        turn = {**turn, "n": session["total_turns"]}
+        session["turns"] = (session["turns"] + [turn])[-window:]
+        session["unsummarized"] = (session["unsummarized"] + [_lite(turn)])[-max_unsummarized:]
+        now = datetime.utcnow()
+        session["updated_at"] = now
+        session["expires_at"] = now + timedelta(seconds=ttl_seconds)
+        self._sessions[session_id] = copy.deepcopy(session)
+        return session
+
+    async def save_summary(self, session_id: str, summary: str, expected_through: int, through: int) -> bool:
+        session = self._sessions.get(session_id)
+        if session is None or session["summarized_through"] != expected_through:
+            return False
+        session["summary"] = summary
+        session["summarized_through"] = through
+        session["unsummarized"] = [turn for turn in session["unsummarized"] if turn["n"] > through]
+        return True
+
+    async def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+
+class MongoSessionBackend:
+    """Sesiones en una colección de MongoDB (TTL index sobre expires_at)"""
+
+    def __init__(self, collection_name: str = None):
+        self.collection_name = collection_name or settings.SESSIONS_COLLECTION
+
+    @property
+    def collection(self):
+        return mongodb.get_collection(self.collection_name)
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        # El monitor TTL borra cada ~60 s: se filtra también al leer
+        return await self.collection.find_one({
+            "_id": session_id,
+            "expires_at": {"$gt": datetime.utcnow()}
+        })
+
+    async def append_turn(
+        self,
+        session_id: str,
+        turn: Dict[str, Any],
+        window: int,
+        max_unsummarized: int,
+        ttl_seconds: float
+    ) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        # Una sesión caducada que el monitor TTL aún no borró empieza de cero
+        await self.collection.delete_one({"_id": session_id, "expires_at": {"$lte": now}})
+
+        initial = new_session(session_id, ttl_seconds)
+        counted = await self.collection.find_one_and_update(
+            {"_id": session_id},
+            {
+                "$inc": {"total_turns": 1},
+                "$set": {"updated_at": now, "expires_at": now + timedelta(seconds=ttl_seconds)},
+                "$setOnInsert": {
+                    key: initial[key]
+                    for key in ("summary", "turns", "unsummarized", "summarized_through", "created_at")
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        turn = {**turn, "n": counted["total_turns"]}
+
+        # $sort por n: los turnos de dos workers quedan en orden aunque lleguen cruzados
+        return await self.collection.find_one_and_update(
+            {"_id": session_id},
+            {"$push": {
+                "turns": {"$each": [turn], "$sort": {"n": 1}, "$slice": -window},
+                "unsummarized": {"$each": [_lite(turn)], "$sort": {"n": 1}, "$slice": -max_unsummarized}
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def save_summary(self, session_id: str, summary: str, expected_through: int, through: int) -> bool:
+        result = await self.collection.update_one(
+            {"_id": session_id, "summarized_through": expected_through},
+            {
+                "$set": {"summary": summary, "summarized_through": through},
+                "$pull": {"unsummarized": {"n": {"$lte": through}}}
+            }
+        )
+        return result.modified_count > 0
+
+    async def delete(self, session_id: str) -> bool:
+        result = await self.collection.delete_one({"_id": session_id})
+        return result.deleted_count > 0
+
+
+class SessionStore:
+    """Ventana de turnos + resumen acumulado por sesión"""
+
+    def __init__(
+        self,
+        backend=None,
+        window_turns: int = None,
+        ttl_seconds: float = None,
+        summarizer: Optional[Callable[[str, List[Dict[str, str]]], Awaitable[str]]] = None
+    ):
+        """
+        Args:
+            backend: MemorySessionBackend o MongoSessionBackend (según SESSION_BACKEND)
+            window_turns: Turnos recientes que se conservan literalmente
+            ttl_seconds: Vida de una sesión inactiva
+            summarizer: Corrutina (resumen, turnos) -> nuevo resumen (LLM por defecto)
+        """
+        self.backend = backend or self._default_backend()
+        self.window_turns = window_turns or settings.SESSION_WINDOW_TURNS
+        self.ttl_seconds = ttl_seconds or settings.SESSION_TTL_SECONDS
+        self.summarizer = summarizer or self._summarize_with_llm
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _default_backend():
+        if settings.SESSION_BACKEND == "mongo":
+            return MongoSessionBackend()
+        return MemorySessionBackend()
+
+    def _with_pending(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        """Añade "pending": turnos fuera de la ventana aún sin resumir"""
+        first_in_window = session["total_turns"] - self.window_turns
+        session["pending"] = [turn for turn in session["unsummarized"] if turn["n"] <= first_in_window]
+        return session
+
+    async def get_or_create(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Recupera una sesión o crea una nueva
+
+        Args:
+            session_id: Id de la sesión (se genera uno si no existe o expiró)
+
+        Returns:
+            Documento de sesión
+        """
+        if session_id:
+            session = await self.backend.load(session_id)
+            if session is not None:
+                return self._with_pending(session)
+        return self._with_pending(new_session(session_id, self.ttl_seconds))
+
+    async def add_turn(
+        self,
+        session_id: str,
+        question: str,
+        answer: str,
+        embedding: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """
+        Añade un turno y, si la ventana se desborda, programa el resumen
+
+        Args:
+            session_id: Id de la sesión
+            question: Pregunta del usuario
+            answer: Respuesta generada
+            embedding: Embedding de la pregunta, para reutilizarlo en la recuperación
+
+        Returns:
+            Sesión actualizada
+        """
+        turn = {"question": question, "answer": answer}
+        if embedding is not None:
+            turn["embedding"] = embedding
+
+        # Si el resumen falla de forma persistente, los pendientes no crecen sin límite
+        session = await self.backend.append_turn(
+            session_id,
+            turn,
+            window=self.window_turns,
+            max_unsummarized=self.window_turns * 3,
+            ttl_seconds=self.ttl_seconds
+        )
+        session = self._with_pending(session)
+
+        if session["pending"]:
+            self._schedule_summary(session_id)
+
+        return session
+
+    def _schedule_summary(self, session_id: str):
+        """Lanza la tarea de resumen si no hay una en curso para la sesión"""
+        task = self._tasks.get(session_id)
+        if task is not None and not task.done():
+            return
+        self._tasks[session_id] = asyncio.create_task(self._summarize_pending(session_id))
+
+    async def _summarize_pending(self, session_id: str):
+        """Incorpora los turnos pendientes al resumen (en segundo plano)"""
+        try:
+            while True:
+                session = await self.backend.load(session_id)
+                if session is None:
+                    return
+                batch = self._with_pending(session)["pending"]
+                if not batch:
+                    return
+
+                start = time.perf_counter()
+                summary = await self.summarizer(session["summary"], batch)
+
+                # Solo se guarda si nadie resumió entretanto; si no, se recarga
+                saved = await self.backend.save_summary(
+                    session_id,
+                    summary.strip(),
+                    expected_through=session["summarized_through"],
+                    through=batch[-1]["n"]
+                )
+                if saved:
+                    logger.debug(
+                        f"Sesión {session_id}: {len(batch)} turnos resumidos en "
+                        f"{(time.perf_counter() - start) * 1000:.0f} ms"
+                    )
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Error resumiendo la sesión {session_id}: {e}")
+        finally:
+            self._tasks.pop(session_id, None)
+
+    async def _summarize_with_llm(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        return await llm_service.generate_response_async(
+            prompt=PromptTemplates.format_conversation_summary_prompt(summary, turns),
+            temperature=0.2,
+            max_tokens=settings.SESSION_SUMMARY_MAX_TOKENS,
+            task="summary"
+        )
+
+    def history_text(self, session: Dict[str, Any]) -> str:
+        """Historial acotado para prompts: resumen + ventana de turnos"""
+        return PromptTemplates.format_history(
+            session["turns"],
+            summary=session["summary"],
+            max_answer_chars=settings.SESSION_TURN_MAX_CHARS
+        )
+
+    async def delete(self, session_id: str) -> bool:
+        """Elimina una sesión"""
+        task = self._tasks.pop(session_id, None)
+        if task is not None:
+            task.cancel()
+        return await self.backend.delete(session_id)
+
+    async def wait_idle(self):
+        """Espera a que terminen los resúmenes en curso (apagado, tests)"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Singleton instance
+session_store = SessionStore()
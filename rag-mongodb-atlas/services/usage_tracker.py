@@ -0,0 +1,217 @@
+"""
+Contabilidad de tokens y coste de las llamadas al LLM
+
+Cada llamada registra el usage que devuelve Groq: tokens de prompt y de
+respuesta y los tiempos de cola, de procesado del prompt y de generación.
+Las rutas abren un ámbito por petición (usage_tracker.scope) con el endpoint
+y la colección; al cerrarlo, sus llamadas se agregan por endpoint, modelo y
+colección. El ámbito viaja en una ContextVar, así que las tareas lanzadas
+durante la petición (resúmenes, hedging) cuentan para ella sin pasarlo como
+argumento.
+
+El coste se calcula con LLM_PRICING (USD por millón de tokens de entrada y
+de salida por modelo).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+UNSCOPED_ENDPOINT = "other"
+
+TIME_FIELDS = ("queue_time", "prompt_time", "completion_time", "total_time")
+
+
+class RequestUsage:
+    """Llamadas al LLM hechas durante una petición"""
+
+    def __init__(self, endpoint: str, collection: Optional[str] = None):
+        """
+        Args:
+            endpoint: Endpoint de la API (rag, query...)
+            collection: Colección consultada (puede fijarse después)
+        """
+        self.endpoint = endpoint
+        self.collection = collection
+        self.calls: List[Dict[str, Any]] = []
+        self.closed = False
+
+    def summary(self) -> Dict[str, Any]:
+        """Totales de la petición: llamadas, tokens, tiempos y coste"""
+        totals = {
+            "calls": len(self.calls),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in self.calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in self.calls),
+            "latency_ms": round(sum(call["latency"] for call in self.calls) * 1000, 2),
+            "cost_usd": round(sum(call["cost_usd"] for call in self.calls), 6),
+            "models": sorted({call["model"] for call in self.calls})
+        }
+        for field in TIME_FIELDS:
+            totals[f"{field}_ms"] = round(sum(call[field] for call in self.calls) * 1000, 2)
+        return totals
+
+
+_current_usage: ContextVar[Optional[RequestUsage]] = ContextVar("llm_request_usage", default=None)
+
+
+def current_usage() -> Optional[RequestUsage]:
+    """Ámbito de la petición en curso, o None fuera de una petición"""
+    return _current_usage.get()
+
+
+class UsageTracker:
+    """Agrega el usage de las llamadas por endpoint, modelo y colección"""
+
+    def __init__(self):
+        self._aggregates: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    @staticmethod
+    def _pricing() -> Dict[str, List[float]]:
+        try:
+            return json.loads(settings.LLM_PRICING or "{}")
+        except ValueError:
+            logger.warning("LLM_PRICING no es JSON válido; costes a 0")
+            return {}
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """
+        Coste en USD de una llamada
+
+        Args:
+            model: Modelo usado
+            prompt_tokens: Tokens de entrada
+            completion_tokens: Tokens generados
+
+        Returns:
+            Coste según LLM_PRICING (0 si el modelo no tiene precio)
+        """
+        input_price, output_price = self._pricing().get(model, (0.0, 0.0))
+        return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+    def record(
+        self,
+        model: str,
+        usage: Optional[Dict[str, Any]],
+        latency: float,
+        task: Optional[str] = None
+    ):
+        """
+        Registra una llamada al LLM terminada
+
+        Args:
+            model: Modelo usado
+            usage: Bloque usage de la respuesta (puede faltar en algunos backends)
+            latency: Segundos de la llamada vistos por el cliente
+            task: Tipo de tarea (rag, format, summary...)
+        """
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        call = {
+            "model": model,
+            "task": task,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency": latency,
+            "cost_usd": self.cost(model, prompt_tokens, completion_tokens),
+            "usage_reported": bool(usage)
+        }
+        for field in TIME_FIELDS:
+            call[field] = usage.get(field) or 0.0
+
+        scope = _current_usage.get()
+        if scope is not None and not scope.closed:
+            scope.calls.append(call)
+        elif scope is not None:
+            # Tareas de fondo que terminan después de la petición
+            self._aggregate(scope.endpoint, scope.collection, call)
+        else:
+            self._aggregate(UNSCOPED_ENDPOINT, None, call)
+
+    @contextmanager
+    def scope(self, endpoint: str, collection: Optional[str] = None) -> Iterator[RequestUsage]:
+        """
+        Ámbito de una petición: sus llamadas se agregan al cerrarlo
+
+        Args:
+            endpoint: Endpoint de la API
+            collection: Colección consultada (la puede fijar el servicio después)
+
+        Yields:
+            RequestUsage de la petición
+        """
+        request_usage = RequestUsage(endpoint, collection)
+        token = _current_usage.set(request_usage)
+        try:
+            yield request_usage
+        finally:
+            request_usage.closed = True
+            for call in request_usage.calls:
+                self._aggregate(endpoint, request_usage.collection, call)
+            try:
+                _current_usage.reset(token)
+            except ValueError:
+                # Generador de streaming cerrado desde otro contexto (cliente desconectado)
+                pass
+
+    def _aggregate(self, endpoint: str, collection: Optional[str], call: Dict[str, Any]):
+        key = (endpoint, call["model"], collection or "-")
+        aggregate = self._aggregates.setdefault(key, {
+            "calls": 0,
+            "calls_without_usage": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "latency": 0.0,
+            "cost_usd": 0.0,
+            **{field: 0.0 for field in TIME_FIELDS}
+        })
+
+        aggregate["calls"] += 1
+        aggregate["calls_without_usage"] += not call["usage_reported"]
+        for field in ("prompt_tokens", "completion_tokens", "latency", "cost_usd", *TIME_FIELDS):
+            aggregate[field] += call[field]
+
+    def stats(self) -> Dict[str, Any]:
+        """Uso agregado por endpoint, modelo y colección, y totales"""
+        rows = []
+        for (endpoint, model, collection), aggregate in sorted(self._aggregates.items()):
+            calls = aggregate["calls"]
+            rows.append({
+                "endpoint": endpoint,
+                "model": model,
+                "collection": collection,
+                "calls": calls,
+                "calls_without_usage": aggregate["calls_without_usage"],
+                "prompt_tokens": aggregate["prompt_tokens"],
+                "completion_tokens": aggregate["completion_tokens"],
+                "avg_prompt_tokens": round(aggregate["prompt_tokens"] / calls, 1),
+                "avg_completion_tokens": round(aggregate["completion_tokens"] / calls, 1),
+                "avg_latency_ms": round(aggregate["latency"] / calls * 1000, 2),
+                "avg_queue_time_ms": round(aggregate["queue_time"] / calls * 1000, 2),
+                "avg_prompt_time_ms": round(aggregate["prompt_time"] / calls * 1000, 2),
+                "avg_completion_time_ms": round(aggregate["completion_time"] / calls * 1000, 2),
+                "completion_tokens_per_second": (
+                    round(aggregate["completion_tokens"] / aggregate["completion_time"], 1)
+                    if aggregate["completion_time"] else None
+                ),
+                "cost_usd": round(aggregate["cost_usd"], 6)
+            })
+
+        return {
+            "by_endpoint": rows,
+            "totals": {
+                "calls": sum(row["calls"] for row in rows),
+                "prompt_tokens": sum(row["prompt_tokens"] for row in rows),
+                "completion_tokens": sum(row["completion_tokens"] for row in rows),
+                "cost_usd": round(sum(row["cost_usd"] for row in rows), 6)
+            }
+        }
+
+
+# Singleton instance
+usage_tracker = UsageTracker()
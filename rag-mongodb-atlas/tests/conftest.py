@@ -0,0 +1,170 @@
+"""
+Configuración compartida de tests
+"""
+import os
+import sys
+import types
+
+import pytest
+
+# Settings exige credenciales; para tests unitarios bastan valores ficticios
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+
+
+class FakeEmbeddingService:
+    """Embeddings deterministas de 2 dimensiones, sin cargar el modelo"""
+
+    def generate_text_embedding(self, text):
+        return [float(len(text)), 1.0]
+
+    def generate_text_embeddings_batch(self, texts):
+        return [self.generate_text_embedding(text) for text in texts]
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    """
+    Sustituye services.embedding_service (sentence-transformers, no instalado
+    en CI) para poder importar rag_service y las rutas de la API
+    """
+    module = types.ModuleType("services.embedding_service")
+    module.embedding_service = FakeEmbeddingService()
+    loaded = set(sys.modules)
+    monkeypatch.setitem(sys.modules, "services.embedding_service", module)
+
+    yield module.embedding_service
+
+    # Los módulos importados con el falso no deben quedar para otros tests
+    # (ni como atributo del paquete, que `from services import x` reutilizaría)
+    for name in set(sys.modules) - loaded:
+        module = sys.modules.pop(name, None)
+        package, _, attribute = name.rpartition(".")
+        if package in sys.modules and getattr(sys.modules[package], attribute, None) is module:
+            delattr(sys.modules[package], attribute)
+
+
+@pytest.fixture
+def api_client(fake_embeddings):
+    """Cliente HTTP en proceso contra el router de la API (sin el lifespan de main)"""
+    import httpx
+    from fastapi import FastAPI
+    from api import routes
+
+    app = FastAPI()
+    app.include_router(routes.router, prefix="/api")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+class FakeCursor:
+    """Cursor asíncrono de Motor sobre una lista de documentos"""
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+        self.options = {}
+
+    def sort(self, keys):
+        self.options["sort"] = keys
+        for field, direction in reversed(keys):
+            self.documents.sort(key=lambda document: document[field], reverse=direction == -1)
+        return self
+
+    def limit(self, limit):
+        self.options["limit"] = limit
+        self.documents = self.documents[:limit]
+        return self
+
+    def batch_size(self, batch_size):
+        self.options["batch_size"] = batch_size
+        return self
+
+    def max_time_ms(self, max_time_ms):
+        self.options["max_time_ms"] = max_time_ms
+        return self
+
+    def allow_disk_use(self, allow_disk_use):
+        self.options["allow_disk_use"] = allow_disk_use
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+    async def to_list(self, length=None):
+        return self.documents[:length] if length else list(self.documents)
+
+
+class FakeCollection:
+    """Colección en memoria con lo que usan los servicios de /api/query"""
+
+    def __init__(self, name, documents=None, indexes=None, count=None):
+        """
+        Args:
+            name: Nombre de la colección
+            documents: Documentos que devuelven los cursores
+            indexes: Índices además de _id_, como los da index_information()
+            count: Resultado de estimated_document_count() (len(documents) por defecto)
+        """
+        self.name = name
+        self.documents = list(documents or [])
+        self.indexes = {"_id_": {"key": [("_id", 1)]}, **(indexes or {})}
+        self.count = len(self.documents) if count is None else count
+        self.calls = []
+
+    def aggregate(self, pipeline, **options):
+        self.calls.append({"pipeline": pipeline, **options})
+        documents = self.documents
+        if pipeline and isinstance(pipeline[-1].get("$limit"), int):
+            documents = documents[:pipeline[-1]["$limit"]]
+        return FakeCursor(documents)
+
+    def find(self, filter=None, projection=None):
+        cursor = FakeCursor(self.documents)
+        self.calls.append({"find": filter, "projection": projection, "cursor": cursor})
+        return cursor
+
+    async def find_one(self, filter=None):
+        return self.documents[0] if self.documents else None
+
+    async def count_documents(self, filter, **options):
+        return len(self.documents)
+
+    async def estimated_document_count(self):
+        return self.count
+
+    async def index_information(self):
+        return dict(self.indexes)
+
+
+class FakeDB:
+    """Base de datos falsa: colecciones por nombre y respuesta de explain configurable"""
+
+    def __init__(self):
+        self.collections = {}
+        self.explain = None
+        self.commands = []
+
+    def add(self, name, **options):
+        """Crea la colección `name` (ver FakeCollection) y la retorna"""
+        self.collections[name] = FakeCollection(name, **options)
+        return self.collections[name]
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection(name))
+
+    async def command(self, command):
+        self.commands.append(command)
+        return self.explain(command) if self.explain else {}
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Instala una FakeDB en mongodb.db (y por tanto en get_collection)"""
+    from config.database import mongodb
+
+    db = FakeDB()
+    monkeypatch.setattr(mongodb, "db", db)
+    return db
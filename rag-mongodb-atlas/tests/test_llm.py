@@ -0,0 +1,345 @@
+"""
+Tests para el servicio LLM (Groq)
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+from groq import AsyncGroq
+
+
+def make_completion(content: str, model: str = "test-model") -> dict:
+    """Respuesta mínima compatible con chat.completions"""
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }
+        ]
+    }
+
+
+def make_llm_service(handler):
+    """LLMService cuyo cliente asíncrono habla con un transporte simulado"""
+    from services.llm_service import LLMService
+    from services.llm_providers import GroqProvider
+
+    return LLMService(provider=GroqProvider(
+        api_key="test-key",
+        async_client=AsyncGroq(
+            api_key="test-key",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        )
+    ))
+
+
+@pytest.mark.asyncio
+async def test_generate_response_async_runs_concurrently():
+    """Las llamadas concurrentes no se serializan detrás del event loop"""
+
+    async def handler(request):
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json=make_completion("hola"))
+
+    service = make_llm_service(handler)
+
+    start = time.perf_counter()
+    answers = await asyncio.gather(*[
+        service.generate_response_async("pregunta") for _ in range(5)
+    ])
+    elapsed = time.perf_counter() - start
+
+    assert answers == ["hola"] * 5
+    assert elapsed < 0.6
+
+
+def test_build_context_respects_token_budget():
+    """El contexto se recorta en oraciones completas y por score"""
+    from services.llm_service import LLMService
+    from utils.tokens import count_tokens
+
+    sentence = "Esta es una oración de prueba bastante larga."
+    documents = [
+        {"title": "Alto", "content": " ".join([sentence] * 40), "score": 0.9},
+        {"title": "Bajo", "content": " ".join([sentence] * 40), "score": 0.3},
+    ]
+
+    context, stats = LLMService()._build_context(documents, token_budget=200)
+
+    assert count_tokens(context) <= 200
+    assert stats["packed_tokens"] <= 200
+    assert stats["documents_truncated"] == 2
+    assert stats["dropped_tokens"] == stats["original_tokens"] - stats["packed_tokens"]
+
+    high, low = context.split("\n\n")
+    assert high.startswith("[Documento 1] Alto") and high.endswith(".")
+    assert low.startswith("[Documento 2] Bajo") and low.endswith(".")
+    assert len(high) > len(low)
+
+
+def test_build_context_truncates_oversized_first_sentence():
+    """Un documento cuya primera oración no cabe se corta en lugar de descartarse"""
+    from services.llm_service import LLMService
+    from utils.tokens import count_tokens
+
+    long_sentence = " ".join(f"palabra{i}" for i in range(300)) + "."
+    documents = [
+        {"title": "Largo", "content": long_sentence + " Segunda oración.", "score": 0.9},
+        {"title": "Corto", "content": "Una oración breve.", "score": 0.5},
+    ]
+
+    context, stats = LLMService()._build_context(documents, token_budget=120)
+
+    assert count_tokens(context) <= 120
+    assert stats["documents_dropped"] == 0
+    assert stats["documents_truncated"] == 1
+    first, second = context.split("\n\n")
+    assert first.startswith("[Documento 1] Largo\npalabra0 palabra1")
+    assert "Segunda" not in first
+    assert second == "[Documento 2] Corto\nUna oración breve."
+
+
+def test_build_context_unlimited_budget_keeps_everything():
+    """Con presupuesto 0 no se recorta nada"""
+    from services.llm_service import LLMService
+
+    documents = [{"title": "Doc", "content": "Uno. Dos. Tres.", "score": 0.5}]
+    context, stats = LLMService()._build_context(documents, token_budget=0)
+
+    assert context == "[Documento 1] Doc\nUno. Dos. Tres."
+    assert stats["documents_truncated"] == 0
+    assert stats["dropped_tokens"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_request_is_retried_after_retry_after():
+    """Un 429 se reintenta respetando retry-after y cuenta en las métricas"""
+    calls = []
+
+    async def handler(request):
+        calls.append(time.perf_counter())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"retry-after": "0.2"}, json={"error": {"message": "slow down"}})
+        return httpx.Response(200, json=make_completion("hola"))
+
+    service = make_llm_service(handler)
+
+    assert await service.generate_response_async("pregunta") == "hola"
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.2
+    assert service.metrics["rate_limited"] == 1
+    assert service.metrics["retries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_persistent_rate_limit_raises_llm_rate_limit_error(monkeypatch):
+    """Agotados los reintentos, el 429 se expone como LLMRateLimitError"""
+    from config.settings import settings
+    from services.llm_service import LLMRateLimitError
+
+    monkeypatch.setattr(settings, "GROQ_MAX_RETRIES", 1)
+    monkeypatch.setattr(settings, "GROQ_BACKOFF_BASE", 0.01)
+
+    async def handler(request):
+        return httpx.Response(429, headers={"retry-after": "0"}, json={"error": {"message": "slow down"}})
+
+    service = make_llm_service(handler)
+
+    with pytest.raises(LLMRateLimitError):
+        await service.generate_response_async("pregunta")
+    assert service.metrics["failures"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_takes_first_reply(monkeypatch):
+    """Tras el p95, un duplicado rápido gana a la petición lenta"""
+    from config.settings import settings
+
+    monkeypatch.setattr(settings, "GROQ_HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "GROQ_HEDGE_MIN_SAMPLES", 1)
+
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(2.0 if len(calls) == 1 else 0.01)
+        return httpx.Response(200, json=make_completion(f"respuesta {len(calls)}"))
+
+    service = make_llm_service(handler)
+    service._latencies.append(0.05)
+
+    start = time.perf_counter()
+    answer = await service.generate_response_async("pregunta")
+
+    assert answer == "respuesta 2"
+    assert time.perf_counter() - start < 1.0
+    assert service.metrics["hedged"] == 1
+    assert service.metrics["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_refunds_cancelled_reservation(monkeypatch):
+    """La petición perdedora devuelve su reserva al limitador"""
+    from config.settings import settings
+    from utils.rate_limiter import RateLimiter
+
+    monkeypatch.setattr(settings, "GROQ_HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "GROQ_HEDGE_MIN_SAMPLES", 1)
+
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(2.0 if len(calls) == 1 else 0.01)
+        return httpx.Response(200, json=make_completion("respuesta"))
+
+    service = make_llm_service(handler)
+    service.limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=0)
+    service._latencies.append(0.05)
+
+    await service.generate_response_async("pregunta")
+
+    # Se enviaron dos peticiones pero solo se consume una (más la recarga de ~0.1 s)
+    assert len(calls) == 2
+    assert service.limiter.requests.level > 58.5
+
+
+def test_rate_limiter_throttles_by_tokens_per_minute():
+    """El limitador hace esperar cuando se agota el presupuesto de tokens"""
+    from utils.rate_limiter import RateLimiter
+
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=600)
+
+    assert limiter._reserve(600) == 0
+    wait = limiter._reserve(60)
+    assert 5.5 < wait <= 6.0
+    assert limiter.stats()["throttled_requests"] == 1
+    assert not limiter.try_acquire(10)
+
+
+def make_stub_service(**overrides):
+    """LLMService con el proveedor OpenAI-compatible apuntando al stub en proceso"""
+    import argparse
+    from scripts.llm_stub_server import StubConfig, create_app
+    from services.llm_providers import OpenAICompatibleProvider
+    from services.llm_service import LLMService
+
+    options = {
+        "latency_ms": 10.0,
+        "latency_dist": "fixed",
+        "latency_jitter": 0.5,
+        "tokens_per_second": 0.0,
+        "completion_tokens": 12,
+        "error_rate": 0.0,
+        "rate_limit_rpm": 0,
+        "seed": 1,
+        **overrides
+    }
+    app = create_app(StubConfig(argparse.Namespace(**options)))
+    provider = OpenAICompatibleProvider(
+        base_url="http://stub/v1",
+        transport=httpx.ASGITransport(app=app)
+    )
+    return LLMService(provider=provider)
+
+
+@pytest.mark.asyncio
+async def test_openai_provider_against_stub_is_deterministic():
+    """El stub responde igual al mismo prompt, también en streaming"""
+    service = make_stub_service()
+
+    first = await service.generate_response_async("¿Qué es Atlas?", max_tokens=8)
+    second = await service.generate_response_async("¿Qué es Atlas?", max_tokens=8)
+    streamed = [text async for text in service.generate_response_stream_async("¿Qué es Atlas?", max_tokens=8)]
+
+    assert first == second
+    assert len(first.split()) == 8
+    assert "".join(streamed) == first
+
+
+@pytest.mark.asyncio
+async def test_stub_rate_limit_is_surfaced_as_llm_rate_limit_error(monkeypatch):
+    """Los 429 del stub pasan por la misma política de reintentos que Groq"""
+    from config.settings import settings
+    from services.llm_service import LLMRateLimitError
+
+    monkeypatch.setattr(settings, "GROQ_MAX_RETRIES", 0)
+    service = make_stub_service(rate_limit_rpm=1)
+
+    await service.generate_response_async("pregunta")
+    with pytest.raises(LLMRateLimitError) as excinfo:
+        await service.generate_response_async("pregunta")
+
+    assert excinfo.value.retry_after > 0
+
+
+def test_model_router_sends_simple_tasks_to_fast_model():
+    """Tareas mecánicas y RAG corto y fiable van al modelo rápido"""
+    from config.settings import settings
+    from services.model_router import ModelRouter
+
+    router = ModelRouter()
+
+    assert router.route("format", 5000) == ("fast", settings.GROQ_FAST_MODEL)
+    assert router.route("rag", 800, retrieval_confidence=0.95) == ("fast", settings.GROQ_FAST_MODEL)
+    assert router.route("rag", 800, retrieval_confidence=0.6) == ("large", settings.GROQ_MODEL)
+    assert router.route("rag", 5000, retrieval_confidence=0.95) == ("large", settings.GROQ_MODEL)
+    assert router.route("query_plan", 100) == ("large", settings.GROQ_MODEL)
+    assert router.route(None, 100) == ("large", settings.GROQ_MODEL)
+
+
+@pytest.mark.asyncio
+async def test_routed_calls_report_per_route_metrics():
+    """Las métricas por ruta registran modelo, tokens y latencia"""
+    from config.settings import settings
+
+    service = make_stub_service()
+
+    await service.generate_response_async("resultados", task="format")
+    await service.generate_response_async("plan", task="query_plan")
+    await service.generate_response_async("explícito", model="otro-modelo")
+
+    routes = service.stats()["routes"]
+    assert routes["fast"]["models"] == {settings.GROQ_FAST_MODEL: 1}
+    assert routes["large"]["models"] == {settings.GROQ_MODEL: 1}
+    assert routes["explicit"]["models"] == {"otro-modelo": 1}
+    assert routes["fast"]["completion_tokens"] > 0
+    assert routes["fast"]["latency_p50_ms"] is not None
+
+
+@pytest.mark.asyncio
+async def test_usage_is_accounted_per_request_endpoint_and_collection():
+    """El usage de cada llamada (también en streaming) se agrega por endpoint"""
+    from config.settings import settings
+    from services.usage_tracker import usage_tracker
+
+    service = make_stub_service(latency_ms=20.0)
+
+    with usage_tracker.scope("test_usage", "documents") as request_usage:
+        await service.generate_response_async("¿Qué es Atlas?", max_tokens=8, model=settings.GROQ_MODEL)
+        async for _ in service.generate_response_stream_async("¿Y Groq?", max_tokens=5, model=settings.GROQ_MODEL):
+            pass
+
+    summary = request_usage.summary()
+    assert summary["calls"] == 2
+    assert summary["completion_tokens"] == 13
+    assert summary["prompt_tokens"] > 0
+    assert summary["queue_time_ms"] >= 40
+    assert summary["models"] == [settings.GROQ_MODEL]
+    assert summary["cost_usd"] == pytest.approx(
+        usage_tracker.cost(settings.GROQ_MODEL, summary["prompt_tokens"], 13), abs=1e-6
+    )
+
+    rows = [row for row in usage_tracker.stats()["by_endpoint"] if row["endpoint"] == "test_usage"]
+    assert len(rows) == 1
+    assert rows[0]["collection"] == "documents"
+    assert rows[0]["calls"] == 2
+    assert rows[0]["calls_without_usage"] == 0
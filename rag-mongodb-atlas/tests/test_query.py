@@ -0,0 +1,293 @@
+"""
+Tests para /api/query: caché de planes, ejecución, control de coste,
+asesor de índices y reescritura de planes
+"""
+import pytest
+
+
+# Tests de la caché de planes
+def test_plan_cache_reuses_template_with_new_literals():
+    """Una pregunta que solo cambia el mes y el número reutiliza el plan"""
+    from services.plan_cache import PlanCache
+
+    cache = PlanCache(max_entries=10, ttl_seconds=60)
+    plan = {
+        "collection": "ventas",
+        "operation": "find",
+        "query": {"fecha": {"$gte": "2024-03-01", "$lt": "2024-04-01"}, "total": {"$gt": 100}},
+        "limit": 10,
+        "explanation": "Ventas de marzo de más de 100"
+    }
+
+    assert cache.lookup("¿Ventas de marzo con total mayor a 100?") is None
+    assert cache.store("¿Ventas de marzo con total mayor a 100?", plan)
+
+    reused = cache.lookup("ventas de diciembre con total mayor a 250")
+    assert reused["query"] == {"fecha": {"$gte": "2024-12-01", "$lt": "2025-01-01"}, "total": {"$gt": 250}}
+    assert reused["limit"] == 10
+    assert reused["explanation"] == "Ventas de diciembre de más de 250"
+    assert cache.stats()["hit_rate"] == 0.5
+
+    # Un literal que no aparece en el plan no se puede parametrizar
+    assert not cache.store("ventas de más de 5 unidades", {"collection": "ventas", "query": {"unidades": {"$gt": 0}}})
+    assert cache.stats()["uncacheable"] == 1
+
+
+def test_plan_cache_only_parameterizes_comparison_operands():
+    """Un número de la pregunta que también es un $sum o un $sort no se parametriza"""
+    from services.plan_cache import PlanCache
+
+    cache = PlanCache(max_entries=10, ttl_seconds=60)
+    counted = {
+        "collection": "ventas",
+        "operation": "aggregate",
+        "query": [
+            {"$group": {"_id": "$cliente_id", "compras": {"$sum": 1}}},
+            {"$match": {"compras": {"$gt": 1}}}
+        ]
+    }
+    assert not cache.store("¿Qué clientes tienen más de 1 compras?", counted)
+    assert cache.lookup("¿Qué clientes tienen más de 5 compras?") is None
+
+    sorted_plan = {
+        "collection": "ventas",
+        "operation": "aggregate",
+        "query": [{"$match": {"total": {"$gt": 500}}}, {"$sort": {"total": -1}}, {"$limit": 3}],
+        "projection": {"total": 1}
+    }
+    assert cache.store("las 3 ventas de más de 500", sorted_plan)
+    reused = cache.lookup("las 1 ventas de más de 800")
+    assert reused["query"] == [{"$match": {"total": {"$gt": 800}}}, {"$sort": {"total": -1}}, {"$limit": 1}]
+    assert reused["projection"] == {"total": 1}
+
+
+# Tests de ejecución de consultas
+@pytest.mark.asyncio
+async def test_query_executor_injects_limit_and_streams(fake_db, monkeypatch):
+    """El pipeline del plan se acota con $limit y se lee en lotes"""
+    from bson import ObjectId
+    from config.settings import settings
+    from services.query_executor import QueryExecutor
+    from services.query_guard import QueryGuardError
+
+    ventas = fake_db.add("ventas", documents=[{"_id": ObjectId(), "n": i} for i in range(1000)])
+
+    executor = QueryExecutor(batch_size=50)
+    plan = {"collection": "ventas", "operation": "aggregate", "query": [{"$sort": {"total": -1}}]}
+
+    rows = [row async for row in executor.stream(plan, max_results=500, default_limit=500)]
+
+    call = ventas.calls[0]
+    assert call["pipeline"] == [{"$sort": {"total": -1}}, {"$limit": 500}]
+    assert call["batchSize"] == 50
+    assert call["maxTimeMS"] > 0 and call["allowDiskUse"] is False
+    assert len(rows) == 500
+    # El plan original no se modifica y un $limit menor se respeta
+    assert plan["query"] == [{"$sort": {"total": -1}}]
+    assert QueryExecutor.limit_pipeline([{"$limit": 5}], 100) == [{"$limit": 5}]
+    assert QueryExecutor.effective_limit({"operation": "find", "limit": 10**6}, 100) == 100
+
+    # Escritura y JavaScript se rechazan aunque el guard esté desactivado
+    monkeypatch.setattr(settings, "QUERY_GUARD_ENABLED", False)
+    writes = {"collection": "ventas", "operation": "aggregate", "query": [{"$merge": {"into": "copia"}}]}
+    with pytest.raises(QueryGuardError, match=r"\$merge"):
+        [row async for row in executor.stream(writes)]
+    javascript = {"collection": "ventas", "operation": "count_documents", "query": {"$where": "true"}}
+    with pytest.raises(QueryGuardError, match=r"\$where"):
+        await executor.execute(javascript)
+    assert len(ventas.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_query_executor_applies_find_sort_before_limit(fake_db):
+    """El sort de un plan find se aplica en el cursor y en el explain del guard"""
+    from services.query_executor import QueryExecutor
+    from services.query_guard import QueryGuard
+
+    productos = fake_db.add("productos", documents=[{"nombre": n, "precio": p} for n, p in [("a", 5), ("b", 30), ("c", 12)]])
+    plan = {
+        "collection": "productos",
+        "operation": "find",
+        "query": {},
+        "sort": {"precio": -1},
+        "limit": 2
+    }
+
+    rows = [row async for row in QueryExecutor().stream(plan)]
+
+    assert [row["nombre"] for row in rows] == ["b", "c"]
+    assert productos.calls[0]["cursor"].options["sort"] == [("precio", -1)]
+
+    await QueryGuard().explain({**plan, "sort": [["precio", -1], ["nombre", 1]]})
+    assert fake_db.commands[0]["explain"]["sort"] == {"precio": -1, "nombre": 1}
+
+
+# Tests del control de coste
+@pytest.mark.asyncio
+async def test_query_guard_rejects_collscan_and_asks_for_rewrite(fake_db, monkeypatch):
+    """Un COLLSCAN sobre una colección grande vuelve al LLM con los índices"""
+    from services.query_guard import QueryGuard, QueryGuardError
+    from services import query_service as query_module
+
+    fake_db.add("ventas", indexes={"fecha_1": {"key": [("fecha", 1)]}}, count=1_000_000)
+
+    def explain(command):
+        filter_ = command["explain"]["filter"]
+        stage = {"stage": "IXSCAN", "indexName": "fecha_1"} if "fecha" in filter_ else {"stage": "COLLSCAN"}
+        return {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": stage}, "rejectedPlans": []}}
+
+    fake_db.explain = explain
+    guard = QueryGuard()
+
+    with pytest.raises(QueryGuardError) as rejected:
+        await guard.check({"collection": "ventas", "operation": "find", "query": {"estado": "pagada"}})
+    assert rejected.value.reason == "collscan"
+    assert "fecha (1)" in rejected.value.feedback
+
+    with pytest.raises(QueryGuardError, match="no permitidos"):
+        guard.static_check({"collection": "ventas", "operation": "aggregate", "query": [{"$out": "copia"}]})
+
+    # El servicio reenvía el motivo al LLM hasta obtener un plan aceptable
+    plans = [
+        {"collection": "ventas", "operation": "find", "query": {"estado": "pagada"}},
+        {"collection": "ventas", "operation": "find", "query": {"fecha": {"$gte": "2024-03-01"}}}
+    ]
+    feedbacks = []
+
+    async def fake_plan(question, feedback=None):
+        feedbacks.append(feedback)
+        return plans[len(feedbacks) - 1]
+
+    service = query_module.QueryService()
+    monkeypatch.setattr(query_module, "query_guard", guard)
+    monkeypatch.setattr(service, "_generate_query_plan", fake_plan)
+
+    plan = await service._guarded_query_plan("ventas pagadas de marzo")
+
+    assert plan["query"] == {"fecha": {"$gte": "2024-03-01"}}
+    assert feedbacks[0] is None and "recorre la colección completa" in feedbacks[1]
+    assert guard.stats()["rejected"] == {"collscan": 2}
+    assert guard.stats()["rewrites_accepted"] == 1
+
+
+# Tests del asesor de índices
+@pytest.mark.asyncio
+async def test_index_advisor_recommends_esr_index_from_recorded_shapes(fake_db, monkeypatch):
+    """Las formas frecuentes dan un índice ESR que no cubra uno existente"""
+    from services.index_advisor import IndexAdvisor, extract_shapes
+
+    plan = {
+        "collection": "ventas",
+        "operation": "aggregate",
+        "query": [
+            {"$match": {"estado": "pagada", "fecha": {"$gte": "2024-03-01", "$lt": "2024-04-01"}}},
+            {"$sort": {"total": -1}},
+            {"$lookup": {"from": "clientes", "localField": "cliente_id", "foreignField": "cliente_id", "as": "c"}},
+            {"$group": {"_id": "$canal", "total": {"$sum": "$total"}}}
+        ]
+    }
+    shapes = extract_shapes(plan)
+    assert shapes[0]["equality"] == ["estado"] and shapes[0]["range"] == ["fecha"]
+    assert shapes[0]["sort"] == [["total", -1]] and shapes[0]["group"] == ["canal"]
+    assert shapes[1]["collection"] == "clientes" and shapes[1]["equality"] == ["cliente_id"]
+
+    advisor = IndexAdvisor()
+    for _ in range(3):
+        advisor.record(plan)
+    assert advisor.stats()["pending_shapes"] == 2
+
+    pending = [dict(shape, count=advisor._pending[key]) for key, shape in advisor._shapes.items()]
+
+    async def fake_load_shapes(min_count=1, collection=None):
+        return [shape for shape in pending if shape["count"] >= min_count]
+
+    monkeypatch.setattr(advisor, "load_shapes", fake_load_shapes)
+    fake_db.add("clientes", indexes={"cliente_id_1": {"key": [("cliente_id", 1)]}})
+    fake_db.explain = lambda command: {
+        "executionStats": {"totalDocsExamined": 50000, "nReturned": 200, "executionTimeMillis": 40},
+        "queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}
+    }
+
+    recommendations = await advisor.recommend(min_count=3)
+
+    # clientes.cliente_id ya tiene índice; ventas: igualdad, orden y rango
+    assert len(recommendations) == 1
+    assert recommendations[0]["keys"] == [["estado", 1], ["total", -1], ["fecha", 1]]
+    assert recommendations[0]["name"] == "advisor_estado_1_total_-1_fecha_1"
+    assert recommendations[0]["explain"]["blocking_sort"] is True
+    assert recommendations[0]["estimated_docs_saved"] == (50000 - 200) * 3
+
+
+
+@pytest.mark.asyncio
+async def test_index_advisor_flush_keeps_counts_when_write_fails(fake_db):
+    """Si bulk_write falla, las formas registradas se conservan para el siguiente volcado"""
+    from services.index_advisor import IndexAdvisor
+
+    advisor = IndexAdvisor()
+    shapes = fake_db.add(advisor.collection_name)
+    written = []
+
+    async def bulk_write(operations, ordered=True):
+        if not written:
+            written.append(None)
+            raise RuntimeError("primario no disponible")
+        written.append(operations)
+
+    shapes.bulk_write = bulk_write
+    plan = {"collection": "ventas", "operation": "find", "query": {"estado": "pagada"}}
+    advisor.record(plan)
+    advisor.record(plan)
+
+    with pytest.raises(RuntimeError):
+        await advisor.flush()
+    assert advisor.stats()["pending_shapes"] == 1
+
+    advisor.record(plan)
+    await advisor.flush()
+    assert written[1][0]._doc["$inc"] == {"count": 3}
+    assert advisor.stats()["pending_shapes"] == 0
+
+# Tests de reescritura de planes
+@pytest.mark.asyncio
+async def test_plan_rewriter_turns_date_regex_into_range(monkeypatch):
+    """Un prefijo de regex sobre una fecha BSON pasa a un rango del índice"""
+    from datetime import datetime
+    from services import plan_rewriter as rewriter_module
+    from services.plan_rewriter import PlanRewriter, decode_dates
+
+    schemas = {
+        "ventas": {"fields": {
+            "fecha": {"types": {"date": 12}},
+            "numero_orden": {"types": {"string": 12}},
+            "total": {"types": {"double": 12}}
+        }}
+    }
+
+    async def fake_get():
+        return schemas
+
+    monkeypatch.setattr(rewriter_module.schema_cache, "get", fake_get)
+    rewriter = PlanRewriter()
+
+    plan = {
+        "collection": "ventas",
+        "operation": "aggregate",
+        "query": [
+            {"$match": {"fecha": {"$regex": "^2024-12"}, "numero_orden": {"$regex": "^ORD-2024"}}},
+            {"$group": {"_id": None, "total": {"$sum": "$total"}}},
+            {"$match": {"fecha": {"$regex": "^2024"}}}
+        ]
+    }
+    rewritten = await rewriter.rewrite(plan)
+
+    match = rewritten["query"][0]["$match"]
+    assert match["fecha"] == {"$gte": {"$date": "2024-12-01T00:00:00Z"}, "$lt": {"$date": "2025-01-01T00:00:00Z"}}
+    assert match["numero_orden"] == {"$gte": "ORD-2024", "$lt": "ORD-2025"}
+    # Tras $group los campos ya no son los de la colección
+    assert rewritten["query"][2] == {"$match": {"fecha": {"$regex": "^2024"}}}
+    assert plan["query"][0]["$match"]["fecha"] == {"$regex": "^2024-12"}
+
+    find = await rewriter.rewrite({"collection": "ventas", "operation": "find", "query": {"fecha": {"$gte": "2024-03-01"}}})
+    assert decode_dates(find["query"]) == {"fecha": {"$gte": datetime(2024, 3, 1)}}
+    assert rewriter.stats() == {"regex_range": 2, "iso_date": 1}
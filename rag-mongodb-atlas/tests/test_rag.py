@@ -1,9 +1,11 @@
 """
 Tests para el pipeline RAG
 """
+import asyncio
 import pytest
 from typing import List, Dict
 
+
 # Uncomment cuando implementes los tests
 # from services.rag_service import rag_service
 
@@ -59,23 +61,73 @@ async def test_generate_answer_no_context():
     pass
 
 
+@pytest.fixture
+def batch_rag(fake_embeddings, monkeypatch):
+    """rag_service con búsqueda y LLM simulados que registran su concurrencia"""
+    from services import rag_service as rag_module
+
+    stats = {"search": 0, "search_peak": 0, "llm": 0, "llm_peak": 0}
+
+    async def search(query, limit=5, **kwargs):
+        stats["search"] += 1
+        stats["search_peak"] = max(stats["search_peak"], stats["search"])
+        await asyncio.sleep(0.01)
+        stats["search"] -= 1
+        if "falla" in query:
+            raise RuntimeError("búsqueda caída")
+        return [{"_id": query, "title": query, "content": f"Contexto de {query}.", "score": 0.99, "vector_score": 0.99}]
+
+    async def generate_response_async(prompt, **kwargs):
+        stats["llm"] += 1
+        stats["llm_peak"] = max(stats["llm_peak"], stats["llm"])
+        await asyncio.sleep(0.01)
+        stats["llm"] -= 1
+        return "respuesta"
+
+    async def compress(question, context, query_embedding=None):
+        return context, {"tokens_saved": 0}
+
+    monkeypatch.setattr(rag_module.search_service, "search", search)
+    monkeypatch.setattr(rag_module.llm_service, "generate_response_async", generate_response_async)
+    monkeypatch.setattr(rag_module.context_compressor, "compress", compress)
+    monkeypatch.setattr(rag_module.settings, "RAG_BATCH_RETRIEVAL_CONCURRENCY", 3)
+    monkeypatch.setattr(rag_module.settings, "ANSWER_CACHE_ENABLED", False)
+    return rag_module.rag_service, stats
+
+
 @pytest.mark.asyncio
-async def test_multi_query_rag():
-    """Test de múltiples queries"""
-    # TODO: Implementar
-    # questions = [
-    #     "¿Qué es IA?",
-    #     "¿Qué es ML?",
-    #     "¿Cuál es la diferencia?"
-    # ]
-    #
-    # results = await rag_service.multi_query_rag(
-    #     questions=questions,
-    #     context_limit=3
-    # )
-    #
-    # assert len(results) == len(questions)
-    pass
+async def test_multi_query_rag(batch_rag):
+    """Recuperación y LLM acotados por separado; un fallo no afecta al resto"""
+    rag_service, stats = batch_rag
+    questions = [f"pregunta {i}" for i in range(30)] + ["esta falla"]
+
+    results = await rag_service.multi_query_rag(questions=questions, context_limit=3, concurrency=2)
+
+    assert [result["question"] for result in results] == questions
+    assert stats["search_peak"] == 3
+    assert stats["llm_peak"] == 2
+    assert all(result["answer"] == "respuesta" for result in results[:-1])
+    assert results[-1]["answer"] is None
+    assert "búsqueda caída" in results[-1]["error"]
+
+
+@pytest.mark.asyncio
+async def test_rag_batch_endpoint_reports_errors_per_question(batch_rag, api_client, monkeypatch):
+    """/api/rag/batch devuelve cada fallo en su resultado y limita el tamaño"""
+    from api import routes
+
+    monkeypatch.setattr(routes.settings, "RAG_BATCH_MAX_QUESTIONS", 3)
+
+    async with api_client as client:
+        response = await client.post("/api/rag/batch", json={"questions": ["uno", "esta falla", "tres"]})
+        too_many = await client.post("/api/rag/batch", json={"questions": ["a", "b", "c", "d"]})
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["total"] == 3 and body["failed"] == 1
+    assert [item["error"] is not None for item in body["results"]] == [False, True, False]
+    assert body["results"][0]["answer"] == "respuesta"
+    assert too_many.status_code == 400
 
 
 @pytest.mark.asyncio
@@ -100,6 +152,112 @@ async def test_conversational_rag(sample_question):
     pass
 
 
+# Tests de streaming RAG (SSE)
+def parse_sse(body: str) -> List[Dict]:
+    """Eventos de un cuerpo text/event-stream como {"event", "data"}"""
+    import json
+
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append({"event": fields["event"], "data": json.loads(fields["data"])})
+    return events
+
+
+@pytest.fixture
+def stream_rag(fake_embeddings, monkeypatch):
+    """rag_service con búsqueda simulada y un proveedor LLM que emite tokens"""
+    from services import rag_service as rag_module
+    from services.llm_providers import TextStream
+
+    class FakeStreamProvider:
+        name = "fake"
+
+        def __init__(self):
+            self.tokens = ["La ", "IA ", "es..."]
+            self.fail_after = None
+
+        async def open_stream_async(self, request):
+            async def chunks(text_stream):
+                for i, token in enumerate(self.tokens):
+                    if i == self.fail_after:
+                        raise RuntimeError("conexión con el LLM perdida")
+                    await asyncio.sleep(0)
+                    yield token
+
+            return TextStream(chunks)
+
+    async def search(query, limit=5, **kwargs):
+        # "lejana" simula una recuperación por debajo del umbral de relevancia
+        score = 0.1 if "lejana" in query else 0.99
+        return [{"_id": "d1", "title": "IA", "content": "La IA es una rama de la informática.",
+                 "score": score, "vector_score": score}]
+
+    async def compress(question, context, query_embedding=None):
+        return context, {"tokens_saved": 0}
+
+    provider = FakeStreamProvider()
+    monkeypatch.setattr(rag_module.llm_service, "provider", provider)
+    monkeypatch.setattr(rag_module.search_service, "search", search)
+    monkeypatch.setattr(rag_module.context_compressor, "compress", compress)
+    monkeypatch.setattr(rag_module.settings, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(rag_module.settings, "RELEVANCE_THRESHOLDS", '{"documents": 0.5}')
+    return provider
+
+
+@pytest.mark.asyncio
+async def test_rag_stream_emits_context_tokens_and_done(stream_rag, api_client):
+    """/api/rag/stream: contexto, un evento por token del proveedor y done"""
+    async with api_client as client:
+        response = await client.post("/api/rag/stream", json={"question": "¿Qué es la IA?"})
+
+    events = parse_sse(response.text)
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert [event["event"] for event in events] == ["context", "token", "token", "token", "done"]
+    assert events[0]["data"]["context"][0]["id"] == "d1"
+    assert "".join(event["data"]["text"] for event in events[1:-1]) == "La IA es..."
+    assert events[-1]["data"]["cached"] is False
+    assert events[-1]["data"]["first_token_ms"] is not None
+
+
+@pytest.mark.asyncio
+async def test_rag_stream_serves_stored_answer_and_gated_answer(stream_rag, api_client, monkeypatch):
+    """Una respuesta precalculada o por debajo del umbral no llama al LLM"""
+    from api import routes
+
+    stored = {"question": "¿Qué es MongoDB?", "context": [], "answer": "Una base de datos.", "model": "groq"}
+    monkeypatch.setattr(
+        routes.answer_store, "lookup",
+        lambda endpoint, question, params=None: stored if question == stored["question"] else None
+    )
+    stream_rag.fail_after = 0
+
+    async with api_client as client:
+        stored_events = parse_sse((await client.post("/api/rag/stream", json={"question": "¿Qué es MongoDB?"})).text)
+        gated_events = parse_sse((await client.post("/api/rag/stream", json={"question": "pregunta lejana"})).text)
+
+    assert [event["event"] for event in stored_events] == ["context", "token", "done"]
+    assert stored_events[1]["data"]["text"] == "Una base de datos."
+    assert stored_events[2]["data"]["cached"] is True
+
+    assert [event["event"] for event in gated_events] == ["context", "token", "done"]
+    assert gated_events[2]["data"]["gated"] is True
+
+
+@pytest.mark.asyncio
+async def test_rag_stream_error_mid_stream_becomes_error_event(stream_rag, api_client):
+    """Un fallo del LLM a mitad de respuesta llega como evento error, sin cortar la conexión"""
+    stream_rag.fail_after = 1
+
+    async with api_client as client:
+        response = await client.post("/api/rag/stream", json={"question": "¿Qué es la IA?"})
+
+    events = parse_sse(response.text)
+    assert response.status_code == 200
+    assert [event["event"] for event in events] == ["context", "token", "error"]
+    assert "conexión con el LLM perdida" in events[-1]["data"]["detail"]
+
+
 # Tests de prompts
 def test_prompt_formatting(sample_question, sample_context):
     """Test de formateo de prompts"""
@@ -122,6 +280,359 @@ def test_prompt_formatting(sample_question, sample_context):
     assert sample_question in prompt["user"]
 
 
+# Tests de la caché de respuestas
+def test_answer_cache_key_depends_on_document_versions():
+    """La clave cambia si cambia la versión de un documento citado"""
+    from services.answer_cache import AnswerCache
+
+    cache = AnswerCache(max_entries=10, ttl_seconds=60)
+    params = {"temperature": 0.2, "max_tokens": 256}
+    docs = [{"_id": "1", "updated_at": "2024-01-01"}, {"_id": "2", "updated_at": "2024-01-01"}]
+
+    key = cache.make_key("¿Qué es IA?", docs, "model", params)
+
+    assert key == cache.make_key("  qué es   ia ", docs, "model", params)
+    assert key != cache.make_key("¿Qué es IA?", docs[::-1], "model", params)
+    assert key != cache.make_key(
+        "¿Qué es IA?",
+        [{"_id": "1", "updated_at": "2024-02-01"}, docs[1]],
+        "model",
+        params
+    )
+
+
+def test_answer_cache_eviction_and_invalidation():
+    """LRU acotado e invalidación por documento citado"""
+    from services.answer_cache import AnswerCache
+
+    cache = AnswerCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", "respuesta a", ["doc1"])
+    cache.set("b", "respuesta b", ["doc2"])
+    assert cache.get("a") == "respuesta a"
+
+    # "b" es la menos usada recientemente
+    cache.set("c", "respuesta c", ["doc1"])
+    assert cache.get("b") is None
+
+    assert cache.invalidate_document("doc1") == 2
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+    assert cache.stats()["evictions"] == 1
+
+
+# Tests de compresión de contexto
+@pytest.mark.asyncio
+async def test_context_compression_keeps_relevant_sentences():
+    """La compresión conserva la oración relevante y su vecina"""
+    from services.context_compressor import ContextCompressor
+
+    class KeywordEmbedder:
+        """Embeddings de juguete: 1 si el texto menciona Atlas"""
+
+        def generate_text_embeddings_batch(self, texts):
+            return [[1.0, 0.0] if "Atlas" in text else [0.0, 1.0] for text in texts]
+
+    filler = ["Frase de relleno sin relación con la pregunta número %d." % i for i in range(30)]
+    content = " ".join(filler[:15] + ["MongoDB Atlas ofrece búsqueda vectorial."] + filler[15:])
+    documents = [{"title": "Doc", "content": content, "score": 0.9}]
+
+    compressed, stats = await ContextCompressor(KeywordEmbedder()).compress(
+        "¿Qué ofrece Atlas?", documents, ratio=0.05
+    )
+
+    assert stats["applied"]
+    assert stats["tokens_saved"] > 0
+    assert stats["sentences_kept"] < stats["sentences_total"]
+    assert "MongoDB Atlas ofrece búsqueda vectorial." in compressed[0]["content"]
+    assert "número 14." in compressed[0]["content"]
+    assert "número 0." not in compressed[0]["content"]
+
+
+# Tests de sesiones de conversación
+@pytest.mark.asyncio
+async def test_session_store_keeps_window_and_rolls_summary():
+    """Los turnos antiguos pasan al resumen y el historial no crece"""
+    from services.session_store import SessionStore, MemorySessionBackend
+
+    summarized = []
+
+    async def summarizer(summary, turns):
+        summarized.append([turn["question"] for turn in turns])
+        return (summary + " " + " ".join(turn["question"] for turn in turns)).strip()
+
+    store = SessionStore(backend=MemorySessionBackend(), window_turns=2, summarizer=summarizer)
+    session = await store.get_or_create(None)
+    session_id = session["_id"]
+
+    history_sizes = []
+    for i in range(1, 7):
+        await store.add_turn(session_id, f"p{i}", "respuesta " * 20)
+        await store.wait_idle()
+        history_sizes.append(len(store.history_text(await store.get_or_create(session_id))))
+
+    session = await store.get_or_create(session_id)
+    assert [turn["question"] for turn in session["turns"]] == ["p5", "p6"]
+    assert session["pending"] == []
+    assert session["summary"] == "p1 p2 p3 p4"
+    assert session["total_turns"] == 6
+    # Solo crece el resumen (unas pocas palabras), no los turnos
+    assert history_sizes[-1] - history_sizes[2] < 20
+
+
+@pytest.mark.asyncio
+async def test_session_store_keeps_turns_added_during_summary():
+    """Un turno que llega mientras se resume no se pierde ni se resume dos veces"""
+    from services.session_store import SessionStore, MemorySessionBackend
+
+    release = asyncio.Event()
+
+    async def summarizer(summary, turns):
+        await release.wait()
+        return (summary + " " + " ".join(turn["question"] for turn in turns)).strip()
+
+    store = SessionStore(backend=MemorySessionBackend(), window_turns=1, summarizer=summarizer)
+    session_id = (await store.get_or_create(None))["_id"]
+
+    await store.add_turn(session_id, "p1", "r")
+    await store.add_turn(session_id, "p2", "r")
+    # El resumen de p1 está en curso; otros dos turnos llegan a la vez
+    await asyncio.gather(store.add_turn(session_id, "p3", "r"), store.add_turn(session_id, "p4", "r"))
+    release.set()
+    await store.wait_idle()
+
+    session = await store.get_or_create(session_id)
+    assert [turn["question"] for turn in session["turns"]] == ["p4"]
+    assert session["summary"] == "p1 p2 p3"
+    assert session["pending"] == []
+    assert session["total_turns"] == 4
+
+
+def test_conversation_embedding_decays_older_turns():
+    """El turno más reciente pesa más que los anteriores y la pregunta más que todos"""
+    import numpy as np
+    from utils.helpers import combine_embeddings_with_decay
+
+    current, recent, old = [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]
+
+    combined = np.array(combine_embeddings_with_decay(current, [old, recent], 0.5, 0.5))
+
+    assert np.isclose(np.linalg.norm(combined), 1.0)
+    assert combined[0] > combined[1] > combined[2] > 0
+    assert np.isclose(combined[1] / combined[0], 0.5)
+    assert np.isclose(combined[2] / combined[1], 0.5)
+    assert combine_embeddings_with_decay(current, [recent], history_weight=0) == current
+
+
+# Tests de la compuerta de relevancia
+def test_relevance_threshold_calibration_separates_groups():
+    """El umbral calibrado deja las preguntas con respuesta por encima"""
+    from services.relevance_gate import calibrate_threshold
+
+    threshold = calibrate_threshold([0.82, 0.88, 0.91, 0.79], [0.55, 0.61, 0.58, 0.66])
+
+    assert 0.66 < threshold <= 0.79
+
+
+def test_relevance_gate_skips_llm_below_threshold(monkeypatch):
+    """Por debajo del umbral no se llama al LLM y se responde de forma extractiva"""
+    from config.settings import settings
+    from models.schemas import SearchType
+    from services.relevance_gate import RelevanceGate, NO_RELEVANT_ANSWER
+
+    monkeypatch.setattr(settings, "RELEVANCE_GATE_ENABLED", True)
+    monkeypatch.setattr(settings, "RELEVANCE_GATE_MODE", "extractive")
+    monkeypatch.setattr(settings, "RELEVANCE_THRESHOLDS", '{"documents": 0.8}')
+    gate = RelevanceGate(thresholds_file="/nonexistent/thresholds.json")
+
+    weak = [{
+        "title": "Bases de datos",
+        "content": "MongoDB guarda documentos BSON. Los índices vectoriales aceleran la búsqueda semántica.",
+        "score": 0.03,
+        "vector_score": 0.62
+    }]
+    strong = [{"title": "IA", "content": "...", "score": 0.91}]
+
+    report = gate.evaluate(weak, SearchType.HYBRID, "documents")
+    assert not report["passed"]
+    assert report["threshold"] == 0.8
+    assert report["top_score"] == 0.62
+
+    answer = gate.fallback_answer("¿Cómo funcionan los índices vectoriales?", weak)
+    assert answer.startswith(NO_RELEVANT_ANSWER)
+    assert "Los índices vectoriales aceleran la búsqueda semántica." in answer
+
+    assert gate.evaluate(strong, SearchType.VECTOR, "documents")["passed"]
+    # Sin scores vectoriales no hay evidencia para cortar
+    assert gate.evaluate(weak, SearchType.FULLTEXT, "documents")["passed"]
+
+    stats = gate.stats()
+    assert stats["evaluated"] == 3
+    assert stats["llm_calls_avoided"] == 1
+    assert stats["extractive_answers"] == 1
+
+
+# Tests de agrupación de peticiones
+@pytest.mark.asyncio
+async def test_singleflight_coalesces_concurrent_duplicates():
+    """Peticiones idénticas concurrentes hacen una sola llamada al backend"""
+    import asyncio
+    from utils.singleflight import SingleFlight
+
+    flight = SingleFlight("test")
+    calls = []
+
+    async def backend(question):
+        calls.append(question)
+        await asyncio.sleep(0.05)
+        return {"answer": f"respuesta a {question}"}
+
+    results = await asyncio.gather(
+        *(flight.do("trending", lambda: backend("trending")) for _ in range(20)),
+        flight.do("otra", lambda: backend("otra"))
+    )
+
+    assert sorted(calls) == ["otra", "trending"]
+    assert all(result == {"answer": "respuesta a trending"} for result in results[:20])
+    # Cada llamador recibe su propia copia
+    assert len({id(result) for result in results[:20]}) == 20
+    assert flight.stats()["coalesced"] == 19
+    assert flight.stats()["in_flight"] == 0
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("groq caído")
+
+    errors = await asyncio.gather(
+        *(flight.do("error", failing) for _ in range(3)),
+        return_exceptions=True
+    )
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+    # Terminada la ejecución, la misma clave vuelve a llamar al backend
+    await flight.do("trending", lambda: backend("trending"))
+    assert calls.count("trending") == 2
+
+
+# Tests de respuestas precalculadas
+@pytest.mark.asyncio
+async def test_answer_store_serves_and_invalidates_precomputed_answers():
+    """Las FAQ se sirven desde memoria y se descartan si cambia su colección"""
+    import json
+    from services.answer_store import AnswerStore
+
+    class FakeCollection:
+        def __init__(self):
+            self.docs = {}
+
+        async def replace_one(self, query, doc, upsert=False):
+            self.docs[query["_id"]] = doc
+
+        async def update_many(self, query, update):
+            for doc in self.docs.values():
+                if query["collections"] in doc["collections"]:
+                    doc.update(update["$set"])
+
+    fake = FakeCollection()
+
+    class TestStore(AnswerStore):
+        @property
+        def collection(self):
+            return fake
+
+    store = TestStore()
+    params = {"context_limit": 5, "temperature": 0.7, "max_tokens": 1024}
+
+    await store.save("rag", "¿Qué es MongoDB Atlas?", {"answer": "Una base de datos"}, ["documents"], params)
+    plan = {"collection": "ventas", "operation": "count_documents", "query": {"estado": {"$eq": "pendiente"}}}
+    await store.save("query", "¿Cuántas ventas están pendientes?", {"answer": "12", "query_plan": plan}, ["ventas"])
+
+    assert store.lookup("rag", "  qué es mongodb atlas ", params) == {"answer": "Una base de datos"}
+    assert store.lookup("rag", "¿Qué es MongoDB Atlas?", {**params, "temperature": 0.1}) is None
+    assert store.lookup("query", "¿Cuántas ventas están pendientes?") == {"answer": "12", "query_plan": plan}
+    # El plan (claves $) se guarda como JSON en MongoDB
+    stored = fake.docs[store.make_key("query", "¿Cuántas ventas están pendientes?")]
+    assert json.loads(stored["response"]["query_plan"]) == plan
+    assert store.dependent_collections() == ["documents", "ventas"]
+
+    stale = await store.invalidate_collection("ventas")
+
+    assert [entry["question"] for entry in stale] == ["¿Cuántas ventas están pendientes?"]
+    assert store.lookup("query", "¿Cuántas ventas están pendientes?") is None
+    # Queda marcada como obsoleta para que un solo worker la recalcule
+    assert [doc["question"] for doc in fake.docs.values() if doc.get("stale")] == ["¿Cuántas ventas están pendientes?"]
+    assert store.stats()["hits"] == 2
+    assert store.stats()["invalidations"] == 1
+
+    # Lo que escribe el job offline (u otro worker) llega por el change stream
+    key = store.make_key("query", "¿Cuántos clientes hay?")
+    store.apply_change({
+        "operationType": "insert",
+        "documentKey": {"_id": key},
+        "fullDocument": {
+            "_id": key,
+            "response": {"answer": "10", "query_plan": '{"collection":"clientes","query":{"$and":[]}}'},
+            "collections": ["clientes"]
+        }
+    })
+    assert store.lookup("query", "¿Cuántos clientes hay?") == {
+        "answer": "10",
+        "query_plan": {"collection": "clientes", "query": {"$and": []}}
+    }
+    store.apply_change({"operationType": "delete", "documentKey": {"_id": key}})
+    assert store.lookup("query", "¿Cuántos clientes hay?") is None
+
+
+@pytest.mark.asyncio
+async def test_answer_store_refresh_lease_is_held_by_one_worker(monkeypatch):
+    """Solo el worker con la concesión recalcula una colección"""
+    from datetime import datetime
+    from pymongo.errors import DuplicateKeyError
+    from services import answer_store as store_module
+    from services.answer_store import AnswerStore
+
+    class FakeLeases:
+        def __init__(self):
+            self.docs = {}
+
+        async def update_one(self, query, update, upsert=False):
+            lease = self.docs.get(query["_id"])
+            if lease and lease["expires_at"] >= datetime.utcnow() and lease["owner"] != update["$set"]["owner"]:
+                raise DuplicateKeyError("E11000")
+            self.docs[query["_id"]] = dict(update["$set"])
+
+        async def delete_one(self, query):
+            if self.docs.get(query["_id"], {}).get("owner") == query["owner"]:
+                self.docs.pop(query["_id"])
+
+    leases = FakeLeases()
+    monkeypatch.setattr(store_module.mongodb, "get_collection", lambda name: leases)
+    worker_a, worker_b = AnswerStore(), AnswerStore()
+
+    assert await worker_a.acquire_refresh_lease("ventas")
+    assert not await worker_b.acquire_refresh_lease("ventas")
+    assert await worker_a.acquire_refresh_lease("ventas")
+
+    await worker_a.release_refresh_lease("ventas")
+    assert await worker_b.acquire_refresh_lease("ventas")
+
+
+def test_query_plan_collections_include_lookups():
+    """Una respuesta de /query depende también de las colecciones de $lookup"""
+    from services.answer_store import query_collections
+
+    plan = {
+        "collection": "ventas",
+        "operation": "aggregate",
+        "query": [
+            {"$lookup": {"from": "clientes", "localField": "cliente_id", "foreignField": "_id", "as": "c"}},
+            {"$group": {"_id": "$cliente_id", "total": {"$sum": "$total"}}}
+        ]
+    }
+
+    assert query_collections(plan) == ["ventas", "clientes"]
+    assert query_collections({"collection": "clientes", "operation": "find", "query": {}}) == ["clientes"]
+
+
 # Tests de validación
 @pytest.mark.asyncio
 async def test_rag_with_invalid_question():
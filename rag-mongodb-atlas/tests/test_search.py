@@ -98,6 +98,322 @@ def test_combine_search_results(sample_documents):
     pass
 
 
+# Tests de búsqueda exacta (memmap)
+def test_exact_top_k_matches_brute_force(tmp_path):
+    """El top-k por bloques coincide con el ordenamiento completo"""
+    import numpy as np
+    from services.exact_search_service import ExactSearchService
+
+    service = ExactSearchService(base_dir=str(tmp_path), block_size=7)
+
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(50, 8)).astype(np.float32)
+    query = rng.normal(size=8).astype(np.float32)
+
+    indices, scores = service.top_k(matrix, query, 5)
+
+    expected = np.argsort(-(matrix @ query))[:5]
+    assert indices.tolist() == expected.tolist()
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_exact_export_publishes_new_version(tmp_path, monkeypatch):
+    """Cada exportación publica una versión nueva y el lector la recarga"""
+    import numpy as np
+    from config.settings import settings
+    from services.exact_search_service import ExactSearchService
+
+    monkeypatch.setattr(settings, "EMBEDDING_DIMENSION", 4)
+
+    class FakeCursor(list):
+        def batch_size(self, size):
+            return self
+
+    class FakeCollection:
+        def __init__(self, docs):
+            self.docs = docs
+
+        def count_documents(self, query):
+            return len(self.docs)
+
+        def find(self, query, projection):
+            return FakeCursor(self.docs)
+
+    service = ExactSearchService(base_dir=str(tmp_path), block_size=2)
+
+    service.export_collection(
+        FakeCollection([{"_id": "a", "embedding": [1, 0, 0, 0]}]),
+        "docs"
+    )
+    first = service._load("docs")
+    assert first["ids"] == ["a"]
+
+    service.export_collection(
+        FakeCollection([
+            {"_id": "a", "embedding": [1, 0, 0, 0]},
+            {"_id": "b", "embedding": [0, 3, 0, 0]}
+        ]),
+        "docs"
+    )
+    second = service._load("docs")
+
+    assert second["ids"] == ["a", "b"]
+    assert second["manifest"]["version"] != first["manifest"]["version"]
+    # Los vectores se guardan normalizados
+    assert np.allclose(np.asarray(second["matrix"][1]), [0, 1, 0, 0])
+
+
+
+@pytest.mark.asyncio
+async def test_exact_search_ranks_off_the_event_loop(tmp_path, fake_db, monkeypatch):
+    """La carga de la matriz y el top-k corren en un hilo; solo el find queda en el loop"""
+    import threading
+    from config.settings import settings
+    from services.exact_search_service import ExactSearchService
+
+    monkeypatch.setattr(settings, "EMBEDDING_DIMENSION", 2)
+    service = ExactSearchService(base_dir=str(tmp_path))
+
+    class ExportCursor(list):
+        def batch_size(self, size):
+            return self
+
+    class ExportCollection:
+        docs = [{"_id": "a", "embedding": [1, 0]}, {"_id": "b", "embedding": [0, 1]}]
+
+        def count_documents(self, query):
+            return len(self.docs)
+
+        def find(self, query, projection):
+            return ExportCursor(self.docs)
+
+    service.export_collection(ExportCollection(), "docs")
+    fake_db.add("docs", documents=[{"_id": "a", "title": "A"}, {"_id": "b", "title": "B"}])
+
+    threads = []
+    rank = service._rank
+
+    def recording_rank(*args):
+        threads.append(threading.get_ident())
+        return rank(*args)
+
+    monkeypatch.setattr(service, "_rank", recording_rank)
+
+    results = await service.search([0.1, 1.0], collection_name="docs", limit=2)
+
+    assert threads and threads[0] != threading.get_ident()
+    assert [doc["_id"] for doc in results] == ["b", "a"]
+    assert results[0]["score"] > results[1]["score"]
+
+# Tests de perfilado
+def test_request_profiler_accumulates_stages():
+    """Las etapas repetidas se suman y el explain se vuelve serializable"""
+    import json
+    from bson import Int64, Timestamp
+    from utils.profiling import RequestProfiler, profile_stage
+
+    profiler = RequestProfiler()
+    with profiler.stage("embedding"):
+        pass
+    with profiler.stage("embedding"):
+        pass
+    with profile_stage(None, "ignored"):
+        pass
+
+    profiler.record("vector_candidates", 20)
+    profiler.add_explain("vector_search", {"nReturned": Int64(20), "ts": Timestamp(1, 1)})
+
+    profile = profiler.to_dict()
+
+    assert list(profile["stages_ms"]) == ["embedding"]
+    assert profile["counts"]["vector_candidates"] == 20
+    json.dumps(profile)
+
+
+# Tests de esquema
+def test_infer_schema_reports_nested_paths_types_and_frequency():
+    """Rutas anidadas (también en arrays), unión de tipos y frecuencia"""
+    from datetime import datetime
+    from services.schema_cache import infer_schema
+
+    schema = infer_schema([
+        {"_id": 1, "total": 10, "fecha": datetime(2024, 3, 1), "items": [{"sku": "a", "qty": 2}]},
+        {"_id": 2, "total": 12.5, "cliente": {"nombre": "Ana"}, "items": [{"sku": "b"}]},
+        {"_id": 3, "total": None, "items": []}
+    ])
+
+    assert "_id" not in schema
+    assert schema["total"]["types"] == {"int": 1, "double": 1, "null": 1}
+    assert schema["total"]["frequency"] == 1.0
+    assert schema["fecha"] == {"types": {"date": 1}, "frequency": 0.333}
+    assert schema["cliente.nombre"]["types"] == {"string": 1}
+    assert schema["items"]["types"] == {"array<object>": 2, "array": 1}
+    assert schema["items.sku"]["frequency"] == 0.667
+    assert schema["items.qty"]["frequency"] == 0.333
+
+
+
+@pytest.mark.asyncio
+async def test_schema_cache_get_waits_for_first_refresh(monkeypatch):
+    """Un get() durante el primer refresco no ve un esquema vacío"""
+    import asyncio
+    from config.database import mongodb
+    from services.schema_cache import SchemaCache
+
+    release = asyncio.Event()
+
+    class FakeCursor:
+        async def to_list(self, length=None):
+            await release.wait()
+            return [{"_id": 1, "total": 10}]
+
+    class FakeCollection:
+        def aggregate(self, pipeline):
+            return FakeCursor()
+
+        async def estimated_document_count(self):
+            return 1
+
+    class FakeDB:
+        async def list_collection_names(self):
+            return ["ventas"]
+
+    monkeypatch.setattr(mongodb, "db", FakeDB())
+    monkeypatch.setattr(mongodb, "get_collection", lambda name: FakeCollection())
+
+    cache = SchemaCache(sample_size=10)
+    background = asyncio.create_task(cache.refresh())
+    await asyncio.sleep(0)
+    reader = asyncio.create_task(cache.get())
+    await asyncio.sleep(0)
+    assert not reader.done()
+
+    release.set()
+    await background
+    assert "ventas" in await reader
+    assert cache.stats()["age_seconds"] is not None
+
+# Tests de búsqueda en streaming
+@pytest.mark.asyncio
+async def test_search_stream_emits_one_line_per_cursor_document(fake_embeddings, fake_db):
+    """/api/search/stream escribe cada documento en cuanto el cursor lo entrega"""
+    import json
+    from api import routes
+    from models.schemas import SearchRequest
+
+    produced = []
+
+    class LazyCursor:
+        """Cursor que registra cuántos documentos ha entregado"""
+
+        def __aiter__(self):
+            return self._iterate()
+
+        async def _iterate(self):
+            for i in range(3):
+                produced.append(i)
+                yield {"_id": f"d{i}", "title": f"Doc {i}", "content": "...", "score": 1 - i / 10}
+
+    fake_db.add("documents").aggregate = lambda pipeline, **options: LazyCursor()
+
+    response = await routes.search_documents_stream(SearchRequest(query="inteligencia", limit=3))
+
+    lines = []
+    async for chunk in response.body_iterator:
+        lines.append(json.loads(chunk))
+        if lines[-1]["type"] == "result":
+            # La línea sale antes de pedir el siguiente documento al cursor
+            assert len(produced) == len(lines)
+
+    assert response.media_type == "application/x-ndjson"
+    assert [line["type"] for line in lines] == ["result"] * 3 + ["summary"]
+    assert [line["id"] for line in lines[:3]] == ["d0", "d1", "d2"]
+    assert lines[0]["score"] > lines[1]["score"] > lines[2]["score"]
+
+    summary = lines[-1]
+    assert summary["total"] == 3
+    assert summary["search_type"] == "vector"
+    assert summary["timings"]["first_result_ms"] is not None
+    assert summary["timings"]["total_ms"] >= summary["timings"]["first_result_ms"]
+
+
+# Tests de serialización
+def test_serializer_converts_nested_bson_types(monkeypatch):
+    """ObjectId y fechas anidadas se convierten igual con y sin orjson"""
+    import json
+    from datetime import datetime
+    from bson import Decimal128, ObjectId
+    from utils import serialization
+
+    product_id = ObjectId()
+    sale = {
+        "_id": ObjectId(),
+        "fecha": datetime(2024, 3, 1, 10, 30),
+        "total": Decimal128("10.50"),
+        "items": [{"producto_id": product_id, "entregado": datetime(2024, 3, 2)}]
+    }
+
+    expected = {
+        "_id": str(sale["_id"]),
+        "fecha": "2024-03-01T10:30:00",
+        "total": 10.5,
+        "items": [{"producto_id": str(product_id), "entregado": "2024-03-02T00:00:00"}]
+    }
+
+    assert serialization.to_jsonable(sale) == expected
+    assert json.loads(serialization.dumps([sale])) == [expected]
+    assert serialization.dumps_line(sale).endswith(b"\n")
+
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert serialization.to_jsonable(sale) == expected
+    assert json.loads(serialization.dumps_line(sale)) == expected
+
+
+
+@pytest.mark.asyncio
+async def test_search_stream_error_and_summary_lines_use_serializer(api_client, monkeypatch):
+    """Las líneas de error y resumen del stream salen como el resto: UTF-8 sin escapar"""
+    import json
+    from api import routes
+
+    async def search_stream(**kwargs):
+        yield {"_id": 1, "title": "Educación", "score": 0.9}
+        raise RuntimeError("conexión perdida en la réplica")
+
+    monkeypatch.setattr(routes.search_service, "search_stream", search_stream)
+
+    async with api_client as client:
+        response = await client.post("/api/search/stream", json={"query": "educación"})
+
+    lines = response.content.splitlines()
+    assert [json.loads(line)["type"] for line in lines] == ["result", "error", "summary"]
+    assert "réplica".encode("utf-8") in lines[1]
+    assert "educación".encode("utf-8") in lines[2]
+
+
+@pytest.mark.asyncio
+async def test_collection_stats_converts_nested_bson_types(api_client, fake_db):
+    """El documento de ejemplo pasa por el serializador compartido, no solo su _id"""
+    from datetime import datetime
+    from bson import Decimal128, ObjectId
+
+    product_id = ObjectId()
+    fake_db.add("ventas", documents=[{
+        "_id": ObjectId(),
+        "fecha": datetime(2024, 3, 1),
+        "items": [{"producto_id": product_id, "precio": Decimal128("9.90")}]
+    }])
+
+    async with api_client as client:
+        response = await client.get("/api/collections/ventas/stats")
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["document_count"] == 1
+    assert body["sample_document"]["fecha"] == "2024-03-01T00:00:00"
+    assert body["sample_document"]["items"] == [{"producto_id": str(product_id), "precio": 9.9}]
+
+
 # Tests de validación
 @pytest.mark.asyncio
 async def test_search_with_empty_query():
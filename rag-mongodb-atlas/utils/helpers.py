@@ -7,6 +7,8 @@ from typing import Any, Dict, List
 from datetime import datetime
 import re
 
+import numpy as np
+
 
 def generate_document_id(content: str) -> str:
     """
@@ -68,6 +70,20 @@ def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]
     return chunks
 
 
+def split_sentences(text: str) -> List[str]:
+    """
+    Divide un texto en oraciones (por signos de cierre o saltos de línea)
+
+    Args:
+        text: Texto a dividir
+
+    Returns:
+        Lista de oraciones sin espacios sobrantes
+    """
+    parts = re.split(r'(?<=[.!?…])\s+|\n+', text)
+    return [part.strip() for part in parts if part and part.strip()]
+
+
 def normalize_score(score: float, min_score: float = 0.0, max_score: float = 1.0) -> float:
     """
     Normaliza un score al rango [0, 1]
@@ -87,6 +103,44 @@ def normalize_score(score: float, min_score: float = 0.0, max_score: float = 1.0
     return max(0.0, min(1.0, normalized))
 
 
+def combine_embeddings_with_decay(
+    current: List[float],
+    history: List[List[float]],
+    history_weight: float = 0.5,
+    decay: float = 0.5
+) -> List[float]:
+    """
+    Combina el embedding actual con los de turnos previos, con peso decreciente
+
+    El turno más reciente pesa history_weight, el anterior
+    history_weight * decay, y así sucesivamente. Los vectores se normalizan
+    antes y después de combinarlos.
+
+    Args:
+        current: Embedding de la pregunta actual
+        history: Embeddings de turnos previos, del más antiguo al más reciente
+        history_weight: Peso del turno más reciente (0 = ignorar historial)
+        decay: Factor de decaimiento por cada turno hacia atrás
+
+    Returns:
+        Vector combinado y normalizado
+    """
+    def unit(vector):
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    combined = unit(current)
+    weight = history_weight
+    for vector in reversed(history):
+        if weight <= 0:
+            break
+        combined = combined + weight * unit(vector)
+        weight *= decay
+
+    return unit(combined).tolist()
+
+
 def format_timestamp(dt: datetime = None) -> str:
     """
     Formatea timestamp en formato ISO
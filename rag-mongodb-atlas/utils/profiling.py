@@ -0,0 +1,68 @@
+"""
+Perfilado por petición: tiempos por etapa, explain de MongoDB y contadores
+"""
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+import json
+import time
+
+from bson import json_util
+
+
+class RequestProfiler:
+    """Acumula los diagnósticos de una sola petición (profile=true)"""
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, Any] = {}
+        self.explains: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Mide el tiempo de pared de una etapa (se acumula si se repite)
+
+        Args:
+            name: Nombre de la etapa
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def record(self, key: str, value: Any):
+        """Registra un contador o valor (candidatos, tamaño de prompt, etc.)"""
+        self.counts[key] = value
+
+    def add_explain(self, name: str, explain: Dict[str, Any]):
+        """
+        Guarda la salida de explain de un pipeline o consulta
+
+        Args:
+            name: Etapa que emitió la consulta
+            explain: Respuesta del comando explain
+        """
+        # Explain contiene tipos BSON (Timestamp, Int64...) no serializables
+        self.explains.append({
+            "stage": name,
+            "explain": json.loads(json_util.dumps(explain))
+        })
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Retorna el perfil listo para incluir en la respuesta"""
+        return {
+            "total_ms": round((time.perf_counter() - self._start) * 1000, 2),
+            "stages_ms": {name: round(ms, 2) for name, ms in self.stages.items()},
+            "counts": self.counts,
+            "explain": self.explains
+        }
+
+
+def profile_stage(profiler: Optional[RequestProfiler], name: str):
+    """Context manager de etapa que no hace nada si no hay profiler"""
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
@@ -74,6 +74,19 @@ Pregunta actual: {question}
 
 Pregunta reformulada:"""
 
+    # Prompt para el resumen acumulado de una conversación
+    CONVERSATION_SUMMARY_PROMPT = """Actualiza el resumen de una conversación incorporando los nuevos turnos.
+Conserva nombres, cifras, preferencias y temas pendientes; omite saludos y repeticiones.
+Responde solo con el resumen actualizado, en pocas frases.
+
+Resumen actual:
+{summary}
+
+Nuevos turnos:
+{turns}
+
+Resumen actualizado:"""
+
     @classmethod
     def format_rag_prompt(cls, context: str, question: str) -> dict:
         """
@@ -136,6 +149,41 @@ Pregunta reformulada:"""
             history=history_str
         )
 
+    @classmethod
+    def format_history(cls, turns: list, summary: str = "", max_answer_chars: int = None) -> str:
+        """
+        Formatea el historial como resumen previo + últimos turnos
+
+        Args:
+            turns: Turnos recientes {"question", "answer"}
+            summary: Resumen de los turnos anteriores
+            max_answer_chars: Recorte de cada respuesta (opcional)
+        """
+        parts = []
+        if summary:
+            parts.append(f"Resumen de la conversación anterior: {summary}")
+
+        for turn in turns:
+            answer = turn.get("answer", "") or ""
+            if max_answer_chars and len(answer) > max_answer_chars:
+                answer = answer[:max_answer_chars] + "..."
+            parts.append(f"Usuario: {turn.get('question', '')}\nAsistente: {answer}")
+
+        return "\n".join(parts)
+
+    @classmethod
+    def format_reformulation_prompt(cls, question: str, history: str) -> str:
+        """Formatea prompt para reformular una pregunta con su historial"""
+        return cls.QUERY_REFORMULATION_PROMPT.format(question=question, history=history)
+
+    @classmethod
+    def format_conversation_summary_prompt(cls, summary: str, turns: list) -> str:
+        """Formatea prompt para actualizar el resumen de una conversación"""
+        return cls.CONVERSATION_SUMMARY_PROMPT.format(
+            summary=summary or "(vacío)",
+            turns=cls.format_history(turns)
+        )
+
 
 # Configuración de prompts específicos por dominio
 DOMAIN_PROMPTS = {
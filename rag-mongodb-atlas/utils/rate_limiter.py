@@ -0,0 +1,133 @@
+"""
+Limitador de tasa por token bucket (peticiones/min y tokens/min)
+
+Funciona por reserva: cada llamada descuenta su coste de inmediato (el
+balance puede quedar negativo) y espera lo necesario hasta que el bucket
+vuelva a cero. Así las peticiones concurrentes se ordenan sin sondeo y
+nunca se supera la tasa configurada en media.
+"""
+from typing import Any, Dict
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """Bucket con capacidad `per_minute` que se rellena de forma continua"""
+
+    def __init__(self, per_minute: float):
+        """
+        Args:
+            per_minute: Capacidad y tasa de recarga por minuto (0 = sin límite)
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def refill(self, now: float):
+        """Recarga el bucket según el tiempo transcurrido"""
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos de espera si se reservara `amount` ahora"""
+        if not self.enabled:
+            return 0.0
+        deficit = amount - self.level
+        return max(0.0, deficit / self.rate)
+
+
+class RateLimiter:
+    """Limitador combinado de peticiones por minuto y tokens por minuto"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        """
+        Args:
+            requests_per_minute: Peticiones por minuto (0 = sin límite)
+            tokens_per_minute: Tokens por minuto (0 = sin límite)
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self.throttled_requests = 0
+        self.throttled_seconds = 0.0
+
+    def _reserve(self, tokens: int, force: bool = True) -> float:
+        """
+        Reserva una petición de `tokens` tokens
+
+        Args:
+            tokens: Tokens estimados (prompt + max_tokens)
+            force: Si es False, no reserva cuando habría que esperar
+
+        Returns:
+            Segundos a esperar antes de enviar, o -1 si no se reservó
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+
+            # Una petición mayor que la capacidad nunca cabría: se limita a ella
+            if self.tokens.enabled:
+                tokens = min(tokens, self.tokens.capacity)
+
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0 and not force:
+                return -1.0
+
+            if self.requests.enabled:
+                self.requests.level -= 1
+            if self.tokens.enabled:
+                self.tokens.level -= tokens
+
+            if wait > 0:
+                self.throttled_requests += 1
+                self.throttled_seconds += wait
+            return wait
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Reserva capacidad y espera sin bloquear el event loop; retorna la espera"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def acquire_sync(self, tokens: int = 0) -> float:
+        """Versión bloqueante de acquire() para el cliente síncrono"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        """Reserva solo si hay capacidad inmediata (p. ej. para peticiones de cobertura)"""
+        return self._reserve(tokens, force=False) >= 0
+
+    def refund(self, tokens: int, requests: int = 0):
+        """
+        Devuelve capacidad reservada que no se consumió
+
+        Args:
+            tokens: Tokens a devolver
+            requests: Peticiones a devolver (p. ej. una petición cancelada)
+        """
+        with self._lock:
+            if tokens > 0 and self.tokens.enabled:
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level + tokens)
+            if requests > 0 and self.requests.enabled:
+                self.requests.level = min(self.requests.capacity, self.requests.level + requests)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estadísticas de espera por limitación"""
+        return {
+            "requests_per_minute": self.requests.capacity,
+            "tokens_per_minute": self.tokens.capacity,
+            "throttled_requests": self.throttled_requests,
+            "throttled_seconds": round(self.throttled_seconds, 3)
+        }
@@ -0,0 +1,102 @@
+"""
+Serialización de documentos BSON a JSON
+
+Un único punto para convertir resultados de MongoDB (ObjectId, fechas,
+Decimal128, binarios...) a JSON en cualquier nivel de anidamiento, p. ej.
+ventas.items[].producto_id. Con orjson instalado la conversión ocurre en una
+sola pasada en C (los tipos que orjson no conoce pasan por _default); sin
+orjson se usa json de la biblioteca estándar con el mismo hook.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+import base64
+import json
+import uuid
+
+from bson import Binary, Decimal128, ObjectId, Timestamp
+from bson.regex import Regex
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: mismo resultado, más lento
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+
+def _default(value: Any) -> Any:
+    """Hook para los tipos que el serializador JSON no conoce"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, Binary)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    if isinstance(value, Timestamp):
+        return value.as_datetime().isoformat()
+    if isinstance(value, Regex):
+        return value.pattern
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, "tolist"):
+        # Escalares y arrays de numpy con el backend json
+        return value.tolist()
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+
+def dumps(value: Any) -> str:
+    """
+    Serializa a JSON compacto (sin sangría: menos tokens en los prompts)
+
+    Args:
+        value: Documento, lista de documentos o cualquier valor BSON
+
+    Returns:
+        Texto JSON (UTF-8 sin escapar)
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=ORJSON_OPTIONS).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def dumps_line(value: Any) -> bytes:
+    """Serializa una línea NDJSON (terminada en salto de línea)"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+    return (dumps(value) + "\n").encode("utf-8")
+
+
+def to_jsonable(value: Any) -> Any:
+    """
+    Convierte un valor BSON (a cualquier profundidad) en tipos nativos de JSON
+
+    Útil cuando el resultado sigue su camino como objeto Python (respuestas
+    de FastAPI, modelos de pydantic, caché de respuestas).
+
+    Args:
+        value: Documento, lista de documentos o cualquier valor BSON
+
+    Returns:
+        Estructura con solo dict, list, str, int, float, bool y None
+    """
+    if orjson is not None:
+        return orjson.loads(orjson.dumps(value, default=_default, option=ORJSON_OPTIONS))
+    return _to_jsonable(value)
+
+
+def _to_jsonable(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(key): _to_jsonable(child) for key, child in value.items()}
+    if isinstance(value, list):
+        return [_to_jsonable(child) for child in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    converted = _default(value)
+    return _to_jsonable(converted) if isinstance(converted, list) else converted
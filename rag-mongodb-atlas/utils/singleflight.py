@@ -0,0 +1,82 @@
+"""
+Single-flight: una sola ejecución por clave entre peticiones concurrentes
+
+Si llegan varias peticiones idénticas mientras la primera sigue en curso,
+las siguientes esperan a la misma tarea en lugar de repetir la búsqueda y
+la llamada al LLM. La caché de respuestas solo ayuda cuando la primera ya
+terminó; esto cubre la ventana en la que aún no hay nada que cachear.
+
+La tarea compartida corre aparte de quien la lanzó: si ese cliente se
+desconecta, el resto sigue esperando el resultado.
+"""
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """Hash estable de una petición ya normalizada"""
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Agrupa ejecuciones concurrentes con la misma clave"""
+
+    def __init__(self, name: str = "default"):
+        """
+        Args:
+            name: Nombre para logs y métricas
+        """
+        self.name = name
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta fn() o se une a la ejecución en curso con la misma clave
+
+        Los que se unen reciben una copia del resultado, para que ningún
+        llamador modifique el de otro. Los errores llegan a todos.
+
+        Args:
+            key: Clave de la petición normalizada
+            fn: Corrutina a ejecutar si no hay ninguna en curso
+
+        Returns:
+            Resultado de fn()
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.debug(f"Single-flight {self.name}: petición unida a una en curso")
+            return copy.deepcopy(await asyncio.shield(task))
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        self.executions += 1
+        task.add_done_callback(lambda _: self._finish(key))
+
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str):
+        task = self._inflight.pop(key, None)
+        # Si todos los llamadores se cancelaron, el error se marca como leído
+        if task is not None and not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Ejecuciones reales y peticiones que se unieron a una en curso"""
+        total = self.executions + self.coalesced
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "coalesced_rate": round(self.coalesced / total, 4) if total else 0.0
+        }
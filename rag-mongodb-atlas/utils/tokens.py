@@ -0,0 +1,84 @@
+"""
+Conteo de tokens para presupuestar prompts
+
+Usa tiktoken (cl100k_base, cercano al vocabulario de Llama 3) si está
+disponible; si no, una estimación de ~4 caracteres por token.
+"""
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Carga el tokenizer una sola vez (puede requerir descarga)"""
+    global _encoding, _encoding_loaded
+
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken no disponible, se estiman tokens por caracteres: {e}")
+            _encoding = None
+
+    return _encoding
+
+
+def tokenizer_name() -> str:
+    """Nombre del método de conteo en uso"""
+    return "tiktoken:cl100k_base" if _get_encoding() is not None else "chars/4"
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    Cuenta (o estima) los tokens de un texto
+
+    Args:
+        text: Texto a medir
+
+    Returns:
+        Número de tokens
+    """
+    if not text:
+        return 0
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+
+    return max(1, (len(text) + 3) // 4)
+
+
+def truncate_to_tokens(text: Optional[str], max_tokens: int) -> str:
+    """
+    Recorta un texto a un máximo de tokens, en un límite de palabra
+
+    Args:
+        text: Texto a recortar
+        max_tokens: Tokens máximos
+
+    Returns:
+        Prefijo del texto que no supera max_tokens (vacío si no cabe nada)
+    """
+    if not text or max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        prefix = encoding.decode(encoding.encode(text)[:max_tokens])
+    else:
+        prefix = text[:max_tokens * 4]
+
+    # Sin media palabra al final; decodificar un prefijo puede recontar distinto
+    cut = prefix.rfind(" ")
+    prefix = prefix[:cut] if cut > 0 else prefix
+    while prefix and count_tokens(prefix) > max_tokens:
+        prefix = prefix[:-1]
+    return prefix.rstrip()